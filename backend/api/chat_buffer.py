@@ -0,0 +1,83 @@
+import asyncio
+import atexit
+import threading
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.utils import timezone
+from channels.db import database_sync_to_async
+from .models import ChatMessage, Project
+from . import metrics
+
+# Chat lines are broadcast first and persisted behind the conversation: they
+# queue up in this process and are written with one bulk_create once
+# CHAT_FLUSH_SIZE lines are waiting or CHAT_FLUSH_INTERVAL seconds after the
+# first one, whichever comes first. Timestamps are taken on arrival, so the
+# stored order matches the order the room saw.
+
+FLUSH_SIZE = getattr(settings, 'CHAT_FLUSH_SIZE', 50)
+FLUSH_INTERVAL = getattr(settings, 'CHAT_FLUSH_INTERVAL', 1.0)
+
+_pending = []
+_pending_lock = threading.Lock()
+_flush_timer = None
+
+def enqueue_message(project_id, user_id, message):
+    # The consumer's project id comes from the URL as a string; the flush
+    # matches it against integer primary keys
+    chat_message = ChatMessage(project_id=int(project_id), user_id=int(user_id), message=message, timestamp=timezone.now())
+    with _pending_lock:
+        _pending.append(chat_message)
+        full = len(_pending) >= FLUSH_SIZE
+
+    if full:
+        cancel_flush_timer()
+        asyncio.ensure_future(flush_messages_async())
+    else:
+        schedule_flush()
+    return chat_message
+
+def schedule_flush():
+    global _flush_timer
+    if _flush_timer is None:
+        _flush_timer = asyncio.get_running_loop().call_later(
+            FLUSH_INTERVAL, lambda: asyncio.ensure_future(flush_messages_async())
+        )
+
+def cancel_flush_timer():
+    global _flush_timer
+    if _flush_timer:
+        _flush_timer.cancel()
+        _flush_timer = None
+
+def flush_messages():
+    with _pending_lock:
+        batch = sorted(_pending, key=lambda chat_message: chat_message.timestamp)
+        _pending.clear()
+    if not batch:
+        return 0
+
+    try:
+        # A project or user deleted while its lines were queued would fail
+        # the whole batch on the foreign key, so those lines are dropped.
+        project_ids = set(Project.objects.filter(id__in={m.project_id for m in batch}).values_list('id', flat=True))
+        user_ids = set(User.objects.filter(id__in={m.user_id for m in batch}).values_list('id', flat=True))
+        rows = [m for m in batch if m.project_id in project_ids and m.user_id in user_ids]
+        with metrics.timer('chat.flush_seconds'):
+            ChatMessage.objects.bulk_create(rows)
+        metrics.incr('chat.messages_persisted', len(rows))
+        return len(rows)
+    except Exception as e:
+        print(f"Error saving {len(batch)} chat messages: {e}")
+        with _pending_lock:
+            _pending[:0] = batch
+        return 0
+
+async def flush_messages_async():
+    cancel_flush_timer()
+    await database_sync_to_async(flush_messages)()
+    # Lines put back by a failed flush are retried on the next interval
+    if _pending:
+        schedule_flush()
+
+# Lines still queued when the worker stops are written on the way out
+atexit.register(flush_messages)
@@ -0,0 +1,178 @@
+import re
+
+# Splits source files on definition boundaries (functions, classes, methods)
+# for the languages the editor runs, then packs neighbouring definitions into
+# chunks of at most CHUNK_MAX_CHARS. A definition that is too big on its own
+# is split again one nesting level down, and only falls back to plain line
+# windows when it has no inner structure. Every chunk carries its 1-based,
+# inclusive line range so answers can cite file:line.
+
+CHUNK_MAX_CHARS = 1500
+
+# Bump when the chunking rules change so indexed files are re-chunked
+CHUNKING_VERSION = 'code-v1'
+
+LANGUAGE_BY_EXTENSION = {
+    'py': 'python',
+    'js': 'javascript',
+    'jsx': 'javascript',
+    'ts': 'javascript',
+    'tsx': 'javascript',
+    'cpp': 'cpp',
+    'cc': 'cpp',
+    'cxx': 'cpp',
+    'h': 'cpp',
+    'hpp': 'cpp',
+    'java': 'java',
+}
+
+BRACE_LANGUAGES = ('javascript', 'cpp', 'java')
+
+# Comments, decorators and annotations belong to the definition below them
+LEADING_LINE_RE = re.compile(r'\s*(#|//|/\*|\*|@)')
+STRING_OR_COMMENT_RE = re.compile(r'"(?:\\.|[^"\\])*"|\'(?:\\.|[^\'\\])*\'|`(?:\\.|[^`\\])*`|//.*|/\*|\*/')
+
+
+def language_for_file(file_name):
+    ext = file_name.rsplit('.', 1)[-1].lower() if '.' in file_name else ''
+    return LANGUAGE_BY_EXTENSION.get(ext)
+
+
+def python_levels(lines):
+    levels = []
+    for line in lines:
+        stripped = line.lstrip()
+        if not stripped or stripped[0] in ')]}':
+            levels.append(None)
+        else:
+            levels.append(len(line) - len(stripped))
+    return levels
+
+
+def brace_levels(lines):
+    # Brace depth at the start of each line, ignoring braces in strings and comments
+    levels = []
+    depth = 0
+    in_block_comment = False
+    for line in lines:
+        stripped = line.strip()
+        if not stripped or in_block_comment or stripped.startswith('}'):
+            levels.append(None)
+        else:
+            levels.append(depth)
+
+        code = []
+        position = 0
+        for match in STRING_OR_COMMENT_RE.finditer(line):
+            if not in_block_comment:
+                code.append(line[position:match.start()])
+            token = match.group()
+            if in_block_comment:
+                if token == '*/':
+                    in_block_comment = False
+            elif token == '/*':
+                in_block_comment = True
+            elif token.startswith('//'):
+                position = len(line)
+                break
+            position = match.end()
+        if not in_block_comment:
+            code.append(line[position:])
+
+        code = ''.join(code)
+        depth = max(0, depth + code.count('{') - code.count('}'))
+    return levels
+
+
+def line_levels(lines, language):
+    if language == 'python':
+        return python_levels(lines)
+    if language in BRACE_LANGUAGES:
+        return brace_levels(lines)
+    return [0 if line.strip() else None for line in lines]
+
+
+def unit_starts(lines, levels, start, end, level):
+    candidates = [
+        index for index in range(start + 1, end)
+        if levels[index] == level and not LEADING_LINE_RE.match(lines[index])
+    ]
+    starts = [start]
+    for candidate in candidates:
+        while candidate - 1 > starts[-1] and LEADING_LINE_RE.match(lines[candidate - 1]):
+            candidate -= 1
+        if candidate > starts[-1]:
+            starts.append(candidate)
+    return starts
+
+
+def line_windows(lines, start, end, max_chars):
+    ranges = []
+    window_start, size = start, 0
+    for index in range(start, end):
+        line_size = len(lines[index]) + 1
+        if size and size + line_size > max_chars:
+            ranges.append((window_start, index))
+            window_start, size = index, 0
+        size += line_size
+    ranges.append((window_start, end))
+    return ranges
+
+
+def range_size(lines, start, end):
+    return sum(len(line) + 1 for line in lines[start:end])
+
+
+def split_range(lines, levels, start, end, max_chars):
+    # Split at the shallowest level nested inside the range's head, the first
+    # line that is not a comment or decorator
+    head = next(
+        (index for index in range(start, end) if levels[index] is not None and not LEADING_LINE_RE.match(lines[index])),
+        end,
+    )
+    inner = [levels[index] for index in range(head + 1, end) if levels[index] is not None and levels[index] > levels[head]]
+    if not inner:
+        return line_windows(lines, start, end, max_chars)
+    starts = unit_starts(lines, levels, start, end, min(inner))
+    if len(starts) == 1:
+        return line_windows(lines, start, end, max_chars)
+    return pack_units(lines, levels, list(zip(starts, starts[1:] + [end])), max_chars)
+
+
+def pack_units(lines, levels, units, max_chars):
+    ranges = []
+    current_start, current_end, current_size = None, None, 0
+    for start, end in units:
+        size = range_size(lines, start, end)
+        if current_start is not None and current_size + size > max_chars:
+            ranges.append((current_start, current_end))
+            current_start, current_size = None, 0
+        if size > max_chars:
+            ranges.extend(split_range(lines, levels, start, end, max_chars))
+            continue
+        if current_start is None:
+            current_start = start
+        current_end = end
+        current_size += size
+    if current_start is not None:
+        ranges.append((current_start, current_end))
+    return ranges
+
+
+def chunk_code(content, file_name, max_chars=CHUNK_MAX_CHARS):
+    lines = content.splitlines()
+    if not lines:
+        return []
+
+    language = language_for_file(file_name)
+    levels = line_levels(lines, language)
+    top_level = min((level for level in levels if level is not None), default=0)
+    starts = unit_starts(lines, levels, 0, len(lines), top_level)
+    ranges = pack_units(lines, levels, list(zip(starts, starts[1:] + [len(lines)])), max_chars)
+
+    chunks = []
+    for start, end in ranges:
+        text = "\n".join(lines[start:end])
+        if text.strip():
+            chunks.append({'text': text, 'start_line': start + 1, 'end_line': end, 'language': language})
+    return chunks
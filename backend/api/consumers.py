@@ -1,184 +1,297 @@
-import json
+import asyncio
 from channels.generic.websocket import AsyncWebsocketConsumer
-from .models import ChatMessage, Project, Documentation, Membership
-from django.contrib.auth.models import User
 from channels.db import database_sync_to_async
+from .ot import normalize_ops, StaleRevision
+from .documents import open_document, release_document, publish_ops, DocumentNotFound
+from .permissions import EDIT_ROLES, get_project_role
+from .chat_buffer import enqueue_message
+from .presence import get_presence, schedule_presence_delta, HEARTBEAT_SECONDS
+from .framing import MSGPACK, negotiate, shared_event, frame_for, decode
 
-active_users_in_project = {}
+class FramedWebsocketConsumer(AsyncWebsocketConsumer):
+    # Sends JSON text or MessagePack binary frames, as the client asked for
+    # with ?encoding= when it connected
+    async def websocket_connect(self, message):
+        self.encoding = negotiate(self.scope)
+        await super().websocket_connect(message)
 
-class ProjectConsumer(AsyncWebsocketConsumer):
+    async def send_payload(self, payload, event=None):
+        frame = frame_for(payload, self.encoding, event)
+        if self.encoding == MSGPACK:
+            await self.send(bytes_data=frame)
+        else:
+            await self.send(text_data=frame)
+
+class ProjectConsumer(FramedWebsocketConsumer):
     async def connect(self):
         self.project_id = self.scope['url_route']['kwargs']['projectId']
         self.room_group_name = f'project_{self.project_id}'
         self.user = self.scope["user"]
+        self.open_files = set()
+        self.heartbeat_task = None
 
         if self.user.is_anonymous:
             await self.close()
             return
 
-        self.can_edit = await self.check_edit_permission(self.user.id, self.project_id)
+        # Outsiders may neither watch the room nor read its files
+        role = await self.get_role()
+        if role is None:
+            await self.close()
+            return
+        self.can_edit = role in EDIT_ROLES
 
-        if self.room_group_name not in active_users_in_project:
-            active_users_in_project[self.room_group_name] = set()
-        active_users_in_project[self.room_group_name].add(self.user.id)
+        await get_presence().add(self.room_group_name, self.channel_name, self.user.id)
+        self.heartbeat_task = asyncio.ensure_future(self.heartbeat_presence())
 
         await self.channel_layer.group_add(self.room_group_name, self.channel_name)
         await self.accept()
         
-        await self.send(text_data=json.dumps({
+        await self.send_payload({
             'type': 'permission_status',
             'can_edit': self.can_edit
-        }))
+        })
+
+        # The new socket gets a full snapshot; everyone else gets a delta
+        await self.send_payload({
+            'type': 'presence_update',
+            'active_user_ids': await get_presence().active_user_ids(self.room_group_name)
+        })
+        schedule_presence_delta(self.room_group_name, self.user.id)
 
         print(f"WebSocket connected to project {self.project_id} (User: {self.user.username}, Can Edit: {self.can_edit})")
-        await self.broadcast_presence()
 
     async def disconnect(self, close_code):
-        if self.user.is_authenticated:
-            if self.room_group_name in active_users_in_project:
-                active_users_in_project[self.room_group_name].discard(self.user.id)
-                if not active_users_in_project[self.room_group_name]:
-                    del active_users_in_project[self.room_group_name]
-            
-            await self.broadcast_presence()
+        for file_id in self.open_files:
+            await release_document(file_id, self.channel_name)
+        self.open_files.clear()
+
+        if self.heartbeat_task:
+            self.heartbeat_task.cancel()
+            await get_presence().remove(self.room_group_name, self.channel_name)
+            schedule_presence_delta(self.room_group_name, self.user.id)
 
         await self.channel_layer.group_discard(self.room_group_name, self.channel_name)
         print(f"WebSocket disconnected from project {self.project_id}")
 
-    async def receive(self, text_data):
-        data = json.loads(text_data)
+    async def receive(self, text_data=None, bytes_data=None):
+        data = decode(text_data, bytes_data)
         message_type = data.get('type')
 
         if message_type == 'code_update':
+            # Whole-file updates from older clients are diffed into ops and
+            # published like any other delta
             if not self.can_edit:
                 print(f"Blocked code update from Viewer: {self.user.username}")
                 return
-            await self.channel_layer.group_send(
-                self.room_group_name, {
-                'type': 'broadcast_code', 
-                'message': data['message'],
-                'fileId': data.get('fileId')
-            }
-        )
+            buffer = await self.open_file(data.get('fileId'))
+            if buffer is None or not isinstance(data.get('message'), str):
+                return
+            revision, ops = await buffer.replace(data['message'])
+            if ops:
+                await publish_ops(self.project_id, data.get('fileId'), revision, ops, self.channel_name)
+        elif message_type == 'code_delta':
+            if not self.can_edit:
+                print(f"Blocked code delta from Viewer: {self.user.username}")
+                return
+            await self.apply_code_delta(data)
+        elif message_type == 'code_open':
+            buffer = await self.open_file(data.get('fileId'))
+            if buffer is None:
+                return
+            revision, content = await buffer.snapshot()
+            await self.send_payload({
+                'type': 'code_snapshot',
+                'fileId': data.get('fileId'),
+                'revision': revision,
+                'content': content
+            })
+        elif message_type == 'code_close':
+            try:
+                file_id = int(data.get('fileId'))
+            except (TypeError, ValueError):
+                return
+            if file_id in self.open_files:
+                self.open_files.discard(file_id)
+                await release_document(file_id, self.channel_name)
         elif message_type == 'chat_message':
-            username = self.user.username
-            
-            await self.save_chat_message(data['message'], self.user)
-
+            # Only queued here; the database write happens in the background
+            chat_message = enqueue_message(self.project_id, self.user.id, data['message'])
             await self.channel_layer.group_send(
-                self.room_group_name, {
+                self.room_group_name, shared_event({
                     'type': 'broadcast_chat_message',
                     'message': data['message'],
-                    'username': username,
-                    'user_id': self.user.id
-                }
+                    'username': self.user.username,
+                    'user_id': self.user.id,
+                    'timestamp': chat_message.timestamp.isoformat()
+                })
             )
 
-    async def broadcast_code(self, event):
-        await self.send(text_data=json.dumps({
-            'type': 'code_update',
-            'message': event['message'],
-            'fileId': event.get('fileId')
-        }))
+    async def open_file(self, file_id):
+        # Checked per file as well, so a member removed mid-session loses access
+        if await self.get_role() is None:
+            return None
+        try:
+            file_id = int(file_id)
+            buffer = await open_document(file_id, self.project_id, self.channel_name)
+        except (TypeError, ValueError, DocumentNotFound) as e:
+            print(f"Could not open file {file_id} for {self.user.username}: {e}")
+            return None
+        self.open_files.add(file_id)
+        return buffer
+
+    async def apply_code_delta(self, data):
+        file_id = data.get('fileId')
+        try:
+            ops = normalize_ops(data.get('ops'))
+            base_revision = int(data.get('revision'))
+        except (TypeError, ValueError) as e:
+            print(f"Rejected code delta from {self.user.username}: {e}")
+            return
+
+        buffer = await self.open_file(file_id)
+        if buffer is None:
+            return
+
+        try:
+            revision, ops = await buffer.commit(base_revision, ops)
+        except (StaleRevision, ValueError):
+            await self.send_payload({
+                'type': 'code_resync',
+                'fileId': file_id,
+                'revision': buffer.revision
+            })
+            return
+
+        await publish_ops(self.project_id, file_id, revision, ops, self.channel_name)
+
+    async def broadcast_delta(self, event):
+        if event['sender_channel'] == self.channel_name:
+            await self.send_payload({
+                'type': 'code_delta_ack',
+                'fileId': event['fileId'],
+                'revision': event['revision']
+            })
+            return
+
+        await self.send_payload({
+            'type': 'code_delta',
+            'fileId': event['fileId'],
+            'revision': event['revision'],
+            'ops': event['ops']
+        }, event)
 
     async def broadcast_chat_message(self, event):
-        await self.send(text_data=json.dumps({
+        await self.send_payload({
             'type': 'chat_message',
             'message': event['message'],
             'username': event['username'],
-            'user_id': event.get('user_id')
-        }))
+            'user_id': event.get('user_id'),
+            'timestamp': event.get('timestamp')
+        }, event)
 
     async def file_tree_update(self, event):
-        await self.send(text_data=json.dumps({
+        await self.send_payload({
             'type': 'file_tree_update',
-            'message': event['message']
-        }))
+            'message': event['message'],
+            'version': event.get('version'),
+            'change': event.get('change')
+        }, event)
 
     async def collaborator_update(self, event):
         removed_user_id = event.get('removed_user_id')
         
-        if removed_user_id and self.room_group_name in active_users_in_project:
-            active_users_in_project[self.room_group_name].discard(removed_user_id)
-            await self.broadcast_presence()
+        # Each removed user's own sockets drop out of presence
+        if removed_user_id == self.user.id:
+            await get_presence().remove(self.room_group_name, self.channel_name)
+            schedule_presence_delta(self.room_group_name, self.user.id)
         
-        await self.send(text_data=json.dumps({
+        await self.send_payload({
             'type': 'collaborator_update',
             'message': event['message']
-        }))
+        }, event)
+
+    async def permission_update(self, event):
+        if event['user_id'] != self.user.id:
+            return
+
+        role = await self.get_role()
+        if role is None:
+            await self.close()
+            return
+        self.can_edit = role in EDIT_ROLES
+        await self.send_payload({
+            'type': 'permission_status',
+            'can_edit': self.can_edit
+        })
 
     async def new_join_request(self, event):
-        await self.send(text_data=json.dumps({
+        await self.send_payload({
             'type': 'new_join_request'
-        }))
-
-    async def broadcast_presence(self):
-        active_ids = list(active_users_in_project.get(self.room_group_name, set()))
-        await self.channel_layer.group_send(
-            self.room_group_name,
-            {
-                'type': 'presence_update',
-                'active_user_ids': active_ids
-            }
-        )
-    
-    async def presence_update(self, event):
-        await self.send(text_data=json.dumps({
-            'type': 'presence_update',
-            'active_user_ids': event['active_user_ids']
-        }))
+        })
+
+    async def heartbeat_presence(self):
+        while True:
+            await asyncio.sleep(HEARTBEAT_SECONDS)
+            try:
+                await get_presence().heartbeat(self.room_group_name, self.channel_name)
+            except Exception as e:
+                print(f"Presence heartbeat failed for {self.channel_name}: {e}")
+
+    async def presence_delta(self, event):
+        await self.send_payload({
+            'type': 'presence_delta',
+            'joined': event['joined'],
+            'left': event['left']
+        }, event)
  
     async def doc_content_update(self, event):
          print(f"CONSUMER: Received doc_content_update from channel layer for doc {event.get('documentId')}. Sending via WebSocket.")
-         await self.send(text_data=json.dumps({
+         await self.send_payload({
             'type': 'doc_content_update',
             'documentId': event['documentId'],
             'updater_username': event['updater_username'],
             'updated_at': event['updated_at'],
             'title': event.get('title'),
             'content': event.get('content'),
-        }))
+        }, event)
 
     async def doc_list_update(self, event):
-        await self.send(text_data=json.dumps({
+        await self.send_payload({
             'type': 'doc_list_update',
             'message': event.get('message', 'Document list updated')
-        }))
+        }, event)
+
+    async def index_progress(self, event):
+        await self.send_payload({
+            'type': 'index_progress',
+            'job': event['job']
+        }, event)
+
+    async def execution_result(self, event):
+        # Runs are published to the whole project; only the requester gets the output
+        if event['run']['user_id'] != self.user.id:
+            return
+        await self.send_payload({
+            'type': 'execution_result',
+            'run': event['run']
+        })
 
     async def alert_update(self, event):
-        await self.send(text_data=json.dumps({
+        await self.send_payload({
             'type': 'alert_update',
             'message': event['message'],
             'unresolved_count': event['unresolved_count'] 
-        }))
+        }, event)
 
     @database_sync_to_async
-    def save_chat_message(self, message, user):
+    def get_role(self):
         try:
-            project = Project.objects.get(id=self.project_id)
-            ChatMessage.objects.create(project=project, user=user, message=message)
-        except Project.DoesNotExist:
-            print(f"Project {self.project_id} not found")
-        except Exception as e:
-            print(f"Error saving chat message: {e}")
-
-    @database_sync_to_async
-    def check_edit_permission(self, user_id, project_id):
-        try:
-            project = Project.objects.get(id=project_id)
-            if project.owner.id == user_id:
-                return True
-            
-            membership = Membership.objects.get(
-                project_id=project_id, 
-                user_id=user_id, 
-                status=Membership.Status.APPROVED
-            )
-            return membership.role in [Membership.Role.ADMIN, Membership.Role.EDITOR]
-        except (Project.DoesNotExist, Membership.DoesNotExist):
-            return False
+            return get_project_role(self.project_id, self.user.id)
+        except ValueError:
+            return None
 
-class UserNotificationConsumer(AsyncWebsocketConsumer):
+class UserNotificationConsumer(FramedWebsocketConsumer):
     async def connect(self):
         self.user = self.scope['user']
 
@@ -195,7 +308,7 @@ class UserNotificationConsumer(AsyncWebsocketConsumer):
             await self.channel_layer.group_discard(self.room_group_name, self.channel_name)
 
     async def project_approval_notification(self, event):
-        await self.send(text_data=json.dumps({
+        await self.send_payload({
             'type': 'project_approved',
             'project': event['project']
-        }))
\ No newline at end of file
+        })
\ No newline at end of file
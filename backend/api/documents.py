@@ -0,0 +1,435 @@
+import asyncio
+import atexit
+import json
+import time
+import uuid
+import weakref
+from django.conf import settings
+from django.utils import timezone
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from .models import File
+from .ot import HISTORY_LIMIT, DocumentLog, StaleRevision, apply_ops, diff_ops, transform
+from .framing import shared_event
+from . import lexical
+
+# Live editing state for open files. The authoritative copy of each file
+# (content, revision and the recent ops needed to rebase late edits) lives
+# in Redis, so every WebSocket worker commits against the same revision
+# sequence. Each worker keeps a DocumentBuffer per open file as a local
+# replica and flushes the shared content to File.content on a coalesced
+# schedule: FLUSH_OP_COUNT local commits, FLUSH_IDLE_SECONDS after the last
+# one, or when the worker's last editor of the file leaves.
+
+FLUSH_IDLE_SECONDS = getattr(settings, 'CODE_BUFFER_FLUSH_IDLE_SECONDS', 2.0)
+FLUSH_OP_COUNT = getattr(settings, 'CODE_BUFFER_FLUSH_OP_COUNT', 100)
+# How long a file's shared state outlives its last edit
+DOCUMENT_TTL = getattr(settings, 'CODE_BUFFER_TTL_SECONDS', 24 * 3600)
+FLUSH_LOCK_MS = 30_000
+
+# file id -> this worker's buffer for it
+open_documents = {}
+_load_lock = asyncio.Lock()
+
+
+class DocumentNotFound(Exception):
+    pass
+
+
+@database_sync_to_async
+def load_file_content(file_id, project_id):
+    return File.objects.filter(pk=file_id, project_id=project_id).values_list('content', flat=True).first()
+
+
+def save_file_content(file_id, project_id, content):
+    File.objects.filter(pk=file_id).update(content=content, updated_at=timezone.now())
+    lexical.update_file(project_id, file_id, content)
+
+
+write_file_content = database_sync_to_async(save_file_content)
+
+
+class RedisDocumentStore:
+    # doc:<file>:content   string  latest content
+    # doc:<file>:revision  int     latest revision
+    # doc:<file>:ops       zset    JSON [revision, ops], scored by revision
+    # doc:<file>:flushed   int     revision last written to the database
+    # doc:<file>:flushing  string  token of the worker writing the database
+    def __init__(self, url):
+        self.url = url
+        # redis.asyncio connections belong to the event loop that opened them
+        self.clients = weakref.WeakKeyDictionary()
+        self.sync_client = None
+
+    def client(self):
+        from redis import asyncio as aioredis
+
+        loop = asyncio.get_running_loop()
+        client = self.clients.get(loop)
+        if client is None:
+            client = aioredis.from_url(self.url, decode_responses=True)
+            self.clients[loop] = client
+        return client
+
+    def blocking_client(self):
+        # For the request threads and the shutdown flush, which have no loop
+        if self.sync_client is None:
+            import redis
+
+            self.sync_client = redis.Redis.from_url(self.url, decode_responses=True)
+        return self.sync_client
+
+    def keys(self, file_id):
+        return tuple(f'doc:{int(file_id)}:{name}' for name in ('content', 'revision', 'ops', 'flushed', 'flushing'))
+
+    async def load(self, buffer):
+        content_key, revision_key = self.keys(buffer.file_id)[:2]
+        # The first worker to open the file seeds the shared copy from the
+        # database; everyone else adopts what is already there
+        async with self.client().pipeline(transaction=True) as pipe:
+            pipe.set(content_key, buffer.content, nx=True, ex=DOCUMENT_TTL)
+            pipe.set(revision_key, buffer.revision, nx=True, ex=DOCUMENT_TTL)
+            pipe.get(content_key)
+            pipe.get(revision_key)
+            _, _, content, revision = await pipe.execute()
+        # Unconditionally: the shared revision may be older than this
+        # buffer's clock-seeded one
+        buffer.log.revision, buffer.content = int(revision), content
+
+    async def refresh(self, buffer):
+        content_key, revision_key = self.keys(buffer.file_id)[:2]
+        async with self.client().pipeline(transaction=True) as pipe:
+            pipe.get(content_key)
+            pipe.get(revision_key)
+            content, revision = await pipe.execute()
+        if revision is None:
+            # Expired while open: start the shared copy again from this replica
+            await self.load(buffer)
+        else:
+            buffer.adopt(int(revision), content)
+
+    async def commit(self, buffer, base_revision, ops, replacement=None):
+        from redis.exceptions import WatchError
+
+        content_key, revision_key, ops_key = self.keys(buffer.file_id)[:3]
+        async with self.client().pipeline(transaction=True) as pipe:
+            while True:
+                try:
+                    await pipe.watch(revision_key)
+                    revision = await pipe.get(revision_key)
+                    if revision is None:
+                        raise StaleRevision("document is no longer open")
+                    revision = int(revision)
+                    content = buffer.content if revision == buffer.revision else await pipe.get(content_key)
+
+                    if replacement is not None:
+                        rebased = diff_ops(content, replacement)
+                    else:
+                        behind = revision - base_revision
+                        if behind < 0 or behind > HISTORY_LIMIT:
+                            raise StaleRevision(f"revision {base_revision} is not available")
+                        applied = await pipe.zrangebyscore(ops_key, base_revision + 1, revision) if behind else []
+                        if len(applied) != behind:
+                            raise StaleRevision(f"revision {base_revision} is not available")
+                        rebased = ops
+                        for entry in applied:
+                            rebased, _ = transform(rebased, json.loads(entry)[1])
+                    # A delta that rebases to nothing still takes a revision,
+                    # which is what acknowledges it to its sender
+                    if not rebased and replacement is not None:
+                        return revision, []
+
+                    content = apply_ops(content, rebased)
+                    pipe.multi()
+                    pipe.set(content_key, content, ex=DOCUMENT_TTL)
+                    pipe.set(revision_key, revision + 1, ex=DOCUMENT_TTL)
+                    pipe.zadd(ops_key, {json.dumps([revision + 1, rebased]): revision + 1})
+                    pipe.zremrangebyscore(ops_key, '-inf', revision - HISTORY_LIMIT)
+                    pipe.expire(ops_key, DOCUMENT_TTL)
+                    await pipe.execute()
+                except WatchError:
+                    continue
+                buffer.adopt(revision + 1, content)
+                return revision + 1, rebased
+
+    async def flush(self, buffer):
+        # One worker at a time writes the database, always the newest shared
+        # content, so a slow write can never land on top of a newer one
+        content_key, revision_key, _, flushed_key, lock_key = self.keys(buffer.file_id)
+        client = self.client()
+        token = uuid.uuid4().hex
+        if not await client.set(lock_key, token, nx=True, px=FLUSH_LOCK_MS):
+            return False
+        try:
+            async with client.pipeline(transaction=True) as pipe:
+                pipe.get(content_key)
+                pipe.get(revision_key)
+                pipe.get(flushed_key)
+                content, revision, flushed = await pipe.execute()
+            if content is None or (flushed is not None and int(flushed) >= int(revision)):
+                return True
+            await write_file_content(buffer.file_id, buffer.project_id, content)
+            await client.set(flushed_key, revision, ex=DOCUMENT_TTL)
+            return True
+        finally:
+            await self.release_flush_lock(client, lock_key, token)
+
+    async def release_flush_lock(self, client, lock_key, token):
+        from redis.exceptions import WatchError
+
+        async with client.pipeline(transaction=True) as pipe:
+            try:
+                await pipe.watch(lock_key)
+                if await pipe.get(lock_key) == token:
+                    pipe.multi()
+                    pipe.delete(lock_key)
+                    await pipe.execute()
+            except WatchError:
+                pass
+
+    def flush_blocking(self, buffer):
+        from redis.exceptions import WatchError
+
+        content_key, revision_key, _, flushed_key, lock_key = self.keys(buffer.file_id)
+        client = self.blocking_client()
+        token = uuid.uuid4().hex
+        if not client.set(lock_key, token, nx=True, px=FLUSH_LOCK_MS):
+            return False
+        try:
+            content, revision, flushed = client.mget(content_key, revision_key, flushed_key)
+            if content is None or (flushed is not None and int(flushed) >= int(revision)):
+                return True
+            save_file_content(buffer.file_id, buffer.project_id, content)
+            client.set(flushed_key, revision, ex=DOCUMENT_TTL)
+            return True
+        finally:
+            with client.pipeline(transaction=True) as pipe:
+                try:
+                    pipe.watch(lock_key)
+                    if pipe.get(lock_key) == token:
+                        pipe.multi()
+                        pipe.delete(lock_key)
+                        pipe.execute()
+                except WatchError:
+                    pass
+
+    def live_content(self, file_id):
+        return self.blocking_client().get(self.keys(file_id)[0])
+
+    async def is_live(self, file_id):
+        return bool(await self.client().exists(self.keys(file_id)[1]))
+
+
+class MemoryDocumentStore:
+    # Single-process stand-in used when no Redis URL is configured (tests):
+    # each buffer is itself the authoritative copy
+    async def load(self, buffer):
+        pass
+
+    async def refresh(self, buffer):
+        pass
+
+    async def commit(self, buffer, base_revision, ops, replacement=None):
+        if replacement is not None:
+            ops = diff_ops(buffer.content, replacement)
+        else:
+            ops = buffer.log.rebase(base_revision, ops)
+        if not ops and replacement is not None:
+            return buffer.revision, []
+        buffer.content = apply_ops(buffer.content, ops)
+        return buffer.log.commit(ops), ops
+
+    async def flush(self, buffer):
+        await write_file_content(buffer.file_id, buffer.project_id, buffer.content)
+        return True
+
+    def flush_blocking(self, buffer):
+        save_file_content(buffer.file_id, buffer.project_id, buffer.content)
+        return True
+
+    def live_content(self, file_id):
+        buffer = open_documents.get(file_id)
+        return buffer.content if buffer else None
+
+    async def is_live(self, file_id):
+        return file_id in open_documents
+
+
+_stores = {}
+
+
+def get_document_store():
+    url = getattr(settings, 'DOCUMENT_REDIS_URL', None)
+    store = _stores.get(url)
+    if store is None:
+        store = _stores.setdefault(url, RedisDocumentStore(url) if url else MemoryDocumentStore())
+    return store
+
+
+class DocumentBuffer:
+    def __init__(self, file_id, project_id, content):
+        self.file_id = file_id
+        self.project_id = project_id
+        self.content = content
+        # Revisions restart whenever a file is loaded afresh, so seed them from
+        # the clock to keep a reconnecting client from matching a recycled number.
+        self.log = DocumentLog(revision=int(time.time() * 1000))
+        self.sessions = set()
+        self.pending_ops = 0
+        self.flush_timer = None
+        self.flush_lock = asyncio.Lock()
+
+    @property
+    def revision(self):
+        return self.log.revision
+
+    def adopt(self, revision, content):
+        # Take on the shared copy, unless a newer commit has already been seen
+        if revision >= self.log.revision:
+            self.log.revision = revision
+            self.content = content
+
+    async def snapshot(self):
+        await get_document_store().refresh(self)
+        return self.revision, self.content
+
+    async def commit(self, base_revision, ops):
+        """Rebase ops made against `base_revision` and apply them; returns (revision, ops)."""
+        revision, ops = await get_document_store().commit(self, base_revision, ops)
+        if ops:
+            self.mark_dirty()
+        return revision, ops
+
+    async def replace(self, content):
+        # A whole-file update becomes ordinary ops against the latest
+        # revision, so clients editing with deltas can transform past it
+        # instead of having to resync.
+        revision, ops = await get_document_store().commit(self, None, None, replacement=content)
+        if ops:
+            self.mark_dirty()
+        return revision, ops
+
+    def mark_dirty(self):
+        self.pending_ops += 1
+        self.cancel_flush_timer()
+        if self.pending_ops >= FLUSH_OP_COUNT:
+            asyncio.ensure_future(self.flush())
+        else:
+            self.schedule_flush()
+
+    def schedule_flush(self):
+        self.flush_timer = asyncio.get_running_loop().call_later(
+            FLUSH_IDLE_SECONDS, lambda: asyncio.ensure_future(self.flush())
+        )
+
+    def cancel_flush_timer(self):
+        if self.flush_timer:
+            self.flush_timer.cancel()
+            self.flush_timer = None
+
+    async def flush(self):
+        self.cancel_flush_timer()
+        async with self.flush_lock:
+            if self.pending_ops:
+                flushed_ops = self.pending_ops
+                self.pending_ops = 0
+                try:
+                    saved = await get_document_store().flush(self)
+                except Exception as e:
+                    print(f"Error flushing file {self.file_id}: {e}")
+                    saved = False
+                if not saved:
+                    # Keep the edits and try again after the idle interval
+                    self.pending_ops += flushed_ops
+                    if not self.flush_timer:
+                        self.schedule_flush()
+                    return False
+
+        # A buffer nobody has open is only dropped once its edits are saved
+        if not self.sessions and not self.pending_ops and open_documents.get(self.file_id) is self:
+            del open_documents[self.file_id]
+        return True
+
+
+async def open_document(file_id, project_id, channel_name):
+    async with _load_lock:
+        buffer = open_documents.get(file_id)
+        if buffer is None:
+            content = await load_file_content(file_id, project_id)
+            if content is None:
+                raise DocumentNotFound(f"File {file_id} not found in project {project_id}")
+            buffer = DocumentBuffer(file_id, project_id, content)
+            await get_document_store().load(buffer)
+            open_documents[file_id] = buffer
+
+    if buffer.project_id != project_id:
+        raise DocumentNotFound(f"File {file_id} not found in project {project_id}")
+
+    buffer.sessions.add(channel_name)
+    return buffer
+
+
+async def release_document(file_id, channel_name):
+    buffer = open_documents.get(file_id)
+    if buffer is None:
+        return
+
+    buffer.sessions.discard(channel_name)
+    if not buffer.sessions:
+        await buffer.flush()
+
+
+async def publish_ops(project_id, file_id, revision, ops, sender_channel=None):
+    # Sent to the whole project; the sender's own socket turns it into an ack
+    await get_channel_layer().group_send(
+        f'project_{project_id}', shared_event({
+            'type': 'broadcast_delta',
+            'fileId': file_id,
+            'revision': revision,
+            'ops': ops,
+            'sender_channel': sender_channel
+        })
+    )
+
+
+async def replace_live_content(file_id, project_id, content):
+    # Brings an edit saved outside the editor socket (a REST save) into the
+    # file's live copy, if it has one, so the next flush does not undo it and
+    # open editors see it. Returns the new revision, or None if not live.
+    # The caller has already written `content` to the database, so this goes
+    # straight to the store without scheduling a flush of its own.
+    store = get_document_store()
+    buffer = open_documents.get(file_id)
+    if buffer is None:
+        if not await store.is_live(file_id):
+            return None
+        # Open only in other workers: commit through a throwaway replica
+        buffer = DocumentBuffer(file_id, project_id, content)
+        await store.load(buffer)
+    revision, ops = await store.commit(buffer, None, None, replacement=content)
+    if ops:
+        await publish_ops(project_id, file_id, revision, ops)
+    return revision
+
+
+def get_live_content(file_id):
+    return get_document_store().live_content(file_id)
+
+
+def flush_open_documents():
+    flushed = 0
+    store = get_document_store()
+    for buffer in list(open_documents.values()):
+        if not buffer.pending_ops:
+            continue
+        try:
+            if store.flush_blocking(buffer):
+                buffer.pending_ops = 0
+                flushed += 1
+        except Exception as e:
+            print(f"Error flushing file {buffer.file_id}: {e}")
+    return flushed
+
+
+# Edits still buffered when the worker stops are written on the way out
+atexit.register(flush_open_documents)
@@ -0,0 +1,187 @@
+import hashlib
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from cachetools import TTLCache
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.core.cache import cache
+from . import judge0, metrics
+from .executors import get_executor
+from .judge0 import LANGUAGE_IDS
+
+# Code runs are handed to the configured executor (see executors.py) on a
+# local thread pool instead of the request thread. Run state lives in the
+# shared cache so any worker can answer a status request; finished runs are
+# also pushed to the requester over the project socket.
+EXECUTION_WORKERS = getattr(settings, 'CODE_EXECUTION_WORKERS', 8)
+EXECUTION_DEADLINE = getattr(settings, 'CODE_EXECUTION_DEADLINE', 30)
+RUN_TIMEOUT = getattr(settings, 'CODE_EXECUTION_RESULT_TTL', 600)
+PROJECT_CONCURRENCY = getattr(settings, 'CODE_EXECUTION_PROJECT_CONCURRENCY', 4)
+BATCH_LIMIT = judge0.BATCH_LIMIT
+# Outlives any run, so slots held by a worker that died are eventually freed
+SLOT_TIMEOUT = EXECUTION_DEADLINE + 2 * judge0.REQUEST_TIMEOUT + 60
+RESULT_CACHE_SIZE = getattr(settings, 'CODE_EXECUTION_CACHE_SIZE', 1024)
+RESULT_CACHE_TTL = getattr(settings, 'CODE_EXECUTION_CACHE_TTL', 3600)
+
+PENDING = 'PENDING'
+RUNNING = 'RUNNING'
+COMPLETED = 'COMPLETED'
+FAILED = 'FAILED'
+
+# Accepted, Wrong Answer, Compilation Error and Runtime Error (NZEC) depend
+# only on the source and stdin. Time limits, signals and internal errors can
+# change with load, so those results are never cached.
+CACHEABLE_STATUSES = {3, 4, 6, 11}
+
+_executor = ThreadPoolExecutor(max_workers=EXECUTION_WORKERS, thread_name_prefix='code-exec')
+
+# result_cache_key(...) -> Judge0 result, shared by every run in this process
+_result_cache = TTLCache(maxsize=RESULT_CACHE_SIZE, ttl=RESULT_CACHE_TTL)
+_result_cache_lock = threading.Lock()
+_result_cache_stats = {'hits': 0, 'lookups': 0}
+
+class ConcurrencyLimitExceeded(Exception):
+    pass
+
+def _run_key(run_id):
+    return f'code_run:{run_id}'
+
+def _slot_key(run):
+    scope = f"project:{run['project_id']}" if run['project_id'] else f"user:{run['user_id']}"
+    return f'code_run_slots:{scope}'
+
+def get_run(run_id):
+    return cache.get(_run_key(run_id))
+
+def result_cache_key(language, code, stdin):
+    # Keyed by backend too: local toolchain versions differ from Judge0's
+    digest = hashlib.sha256()
+    for part in (get_executor().name, str(LANGUAGE_IDS[language]), code, stdin):
+        digest.update(part.encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+def lookup_results(language, code, inputs):
+    # Cached results for every input, or None if any of them is missing
+    with _result_cache_lock:
+        results = [_result_cache.get(result_cache_key(language, code, stdin)) for stdin in inputs]
+        hit = all(results)
+        _result_cache_stats['lookups'] += 1
+        _result_cache_stats['hits'] += int(hit)
+        hit_rate = _result_cache_stats['hits'] / _result_cache_stats['lookups']
+    metrics.incr('execution.cache_hits' if hit else 'execution.cache_misses')
+    metrics.gauge('execution.cache_hit_rate', hit_rate)
+    return results if hit else None
+
+def store_results(language, code, inputs, results):
+    with _result_cache_lock:
+        for stdin, result in zip(inputs, results):
+            if result.get('status', {}).get('id') in CACHEABLE_STATUSES:
+                _result_cache[result_cache_key(language, code, stdin)] = result
+
+def acquire_slot(run):
+    key = _slot_key(run)
+    cache.add(key, 0, SLOT_TIMEOUT)
+    try:
+        active = cache.incr(key)
+        # Counted from the latest run, so a busy project's counter never
+        # expires while earlier runs still hold slots
+        cache.touch(key, SLOT_TIMEOUT)
+    except ValueError:
+        cache.set(key, 1, SLOT_TIMEOUT)
+        active = 1
+    if active > PROJECT_CONCURRENCY:
+        release_slot(run)
+        raise ConcurrencyLimitExceeded(f"At most {PROJECT_CONCURRENCY} runs may execute at once.")
+
+def release_slot(run):
+    key = _slot_key(run)
+    try:
+        active = cache.decr(key)
+    except ValueError:
+        return
+    # A run that outlived an expired counter releases into a fresh one; undo
+    # the overshoot so the count never goes negative and admits extra runs
+    if active < 0:
+        cache.incr(key, -active)
+
+def submit_run(user_id, project_id, language, code, inputs, use_cache=True):
+    # A list of inputs runs the same code once per input as a single batch
+    run = {
+        'id': uuid.uuid4().hex,
+        'user_id': user_id,
+        'project_id': int(project_id) if project_id else None,
+        'language': language,
+        'status': PENDING,
+        'result': None,
+        'results': None,
+        'error': None,
+        'cached': False,
+    }
+    batch = isinstance(inputs, list)
+
+    cached = lookup_results(language, code, inputs if batch else [inputs]) if use_cache else None
+    if cached:
+        run['status'] = COMPLETED
+        run['cached'] = True
+        if batch:
+            run['results'] = cached
+        else:
+            run['result'] = cached[0]
+        cache.set(_run_key(run['id']), run, RUN_TIMEOUT)
+        return dict(run)
+
+    acquire_slot(run)
+    try:
+        cache.set(_run_key(run['id']), run, RUN_TIMEOUT)
+        _executor.submit(_run_execution, run, code, inputs)
+    except Exception:
+        release_slot(run)
+        raise
+    return dict(run)
+
+def _save_run(run, publish=False):
+    cache.set(_run_key(run['id']), run, RUN_TIMEOUT)
+    if not publish or not run['project_id']:
+        return
+    try:
+        async_to_sync(get_channel_layer().group_send)(
+            f"project_{run['project_id']}",
+            {'type': 'execution_result', 'run': dict(run)}
+        )
+    except Exception as e:
+        print(f"Code Execution: could not publish run {run['id']}: {e}")
+
+def _run_execution(run, code, inputs):
+    started = time.monotonic()
+    batch = isinstance(inputs, list)
+    inputs = inputs if batch else [inputs]
+
+    def on_started():
+        run['status'] = RUNNING
+        _save_run(run)
+
+    try:
+        results = get_executor().execute(run['language'], code, inputs, started + EXECUTION_DEADLINE, on_started)
+        store_results(run['language'], code, inputs, results)
+        run['status'] = COMPLETED
+        if batch:
+            run['results'] = results
+        else:
+            run['result'] = results[0]
+    except TimeoutError as e:
+        metrics.incr('execution.timeouts')
+        print(f"Code Execution Timeout (run {run['id']}): {e}")
+        run['status'] = FAILED
+        run['error'] = f"Execution did not finish within {EXECUTION_DEADLINE}s"
+    except Exception as e:
+        print(f"Code Execution Error (run {run['id']}): {e}")
+        run['status'] = FAILED
+        run['error'] = str(e)
+    finally:
+        release_slot(run)
+        metrics.observe('execution.seconds', time.monotonic() - started)
+        _save_run(run, publish=True)
@@ -0,0 +1,317 @@
+import os
+import queue
+import shutil
+import signal
+import subprocess
+import tempfile
+import threading
+import time
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from . import judge0, metrics
+
+# Backends that turn (language, code, inputs) into Judge0-shaped results, one
+# per input: stdout, stderr, compile_output, message, status {id, description},
+# time and memory. CODE_EXECUTOR picks the backend; the run bookkeeping in
+# executions.py is the same for all of them.
+
+EXECUTION_WORKERS = getattr(settings, 'CODE_EXECUTION_WORKERS', 8)
+POLL_INITIAL_DELAY = getattr(settings, 'CODE_EXECUTION_POLL_INITIAL', 0.2)
+POLL_MAX_DELAY = getattr(settings, 'CODE_EXECUTION_POLL_MAX', 2.0)
+
+ACCEPTED = {'id': 3, 'description': 'Accepted'}
+TIME_LIMIT_EXCEEDED = {'id': 5, 'description': 'Time Limit Exceeded'}
+COMPILATION_ERROR = {'id': 6, 'description': 'Compilation Error'}
+RUNTIME_ERROR = {'id': 11, 'description': 'Runtime Error (NZEC)'}
+INTERNAL_ERROR = {'id': 13, 'description': 'Internal Error'}
+SIGNAL_STATUSES = {
+    signal.SIGSEGV: {'id': 7, 'description': 'Runtime Error (SIGSEGV)'},
+    signal.SIGXFSZ: {'id': 8, 'description': 'Runtime Error (SIGXFSZ)'},
+    signal.SIGFPE: {'id': 9, 'description': 'Runtime Error (SIGFPE)'},
+    signal.SIGABRT: {'id': 10, 'description': 'Runtime Error (SIGABRT)'},
+    signal.SIGXCPU: TIME_LIMIT_EXCEEDED,
+}
+
+# Judge0 status ids 1 and 2 are "In Queue" and "Processing"
+JUDGE0_PROCESSING = 2
+
+class Judge0Executor:
+    name = 'judge0'
+
+    def execute(self, language, code, inputs, deadline, on_started=None):
+        submissions = [
+            {"language_id": judge0.LANGUAGE_IDS[language], "source_code": code, "stdin": stdin}
+            for stdin in inputs
+        ]
+        batch = len(submissions) > 1
+        tokens = judge0.submit_batch(submissions) if batch else [judge0.submit(submissions[0])]
+        if on_started:
+            on_started()
+
+        results = {}
+        delay = POLL_INITIAL_DELAY
+        while len(results) < len(tokens):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError("Execution did not finish in time")
+            time.sleep(min(delay, remaining))
+            delay = min(delay * 2, POLL_MAX_DELAY)
+
+            pending = [token for token in tokens if token not in results]
+            if batch:
+                polled = zip(pending, judge0.get_submissions(pending))
+            else:
+                polled = [(pending[0], judge0.get_submission(pending[0]))]
+            for token, result in polled:
+                if result and result.get('status', {}).get('id', 0) > JUDGE0_PROCESSING:
+                    results[token] = result
+        return [results[token] for token in tokens]
+
+
+OUTPUT_LIMIT = 64 * 1024
+FILE_SIZE_LIMIT = 16 * 1024 * 1024
+
+# source file, compile command (or None), run command; memory limits are
+# applied with RLIMIT_AS except for the JVM and V8, which reserve far more
+# address space than they use and are capped through their heap flags.
+LOCAL_TOOLCHAINS = {
+    'python': {
+        'source': 'main.py',
+        'compile': None,
+        'run': lambda memory_mb: ['python3', '-I', 'main.py'],
+        'limit_address_space': True,
+    },
+    'javascript': {
+        'source': 'main.js',
+        'compile': None,
+        'run': lambda memory_mb: ['node', f'--max-old-space-size={memory_mb}', 'main.js'],
+        'limit_address_space': False,
+    },
+    'cpp': {
+        'source': 'main.cpp',
+        'compile': ['g++', '-O2', '-std=c++17', '-o', 'main', 'main.cpp'],
+        'run': lambda memory_mb: ['./main'],
+        'limit_address_space': True,
+    },
+    'java': {
+        'source': 'Main.java',
+        'compile': ['javac', 'Main.java'],
+        'run': lambda memory_mb: ['java', f'-Xmx{memory_mb}m', '-cp', '.', 'Main'],
+        'limit_address_space': False,
+    },
+}
+
+class LocalExecutor:
+    # Runs code in subprocesses on this host. Every command is exec'd through
+    # util-linux wrappers: `unshare --user --net` gives it a user namespace
+    # with no capabilities on the host and an empty network namespace, and
+    # `prlimit` sets CPU, address-space, file-size, core and process-count
+    # limits before the program starts. Nothing runs between fork and exec in
+    # this (threaded) server process. On top of that there is a wall-clock
+    # timeout, a scrubbed environment and capped output.
+    #
+    # The namespaces do not hide the filesystem, so programs always run as a
+    # separate unprivileged LOCAL_EXECUTOR_UID, never as root or as the
+    # server's own uid (which can write the database, the vector store,
+    # settings and source). Switching uid needs a server started as root (or
+    # with CAP_SETUID), and the server's files must not be readable by
+    # others. There is no pool of
+    # started interpreters (each run needs fresh limits and namespaces); the
+    # executor keeps a fixed set of scratch directories, reused between runs,
+    # whose number caps how many programs run at once.
+    name = 'local'
+
+    def __init__(self, workers=None, cpu_seconds=None, memory_mb=None, wall_seconds=None, run_as_uid=None, max_processes=None):
+        self.cpu_seconds = cpu_seconds or getattr(settings, 'LOCAL_EXECUTOR_CPU_SECONDS', 5)
+        self.memory_mb = memory_mb or getattr(settings, 'LOCAL_EXECUTOR_MEMORY_MB', 256)
+        self.wall_seconds = wall_seconds or getattr(settings, 'LOCAL_EXECUTOR_WALL_SECONDS', 10)
+        self.max_processes = max_processes or getattr(settings, 'LOCAL_EXECUTOR_MAX_PROCESSES', 64)
+        self.run_as_uid = run_as_uid if run_as_uid is not None else getattr(settings, 'LOCAL_EXECUTOR_UID', None)
+        if self.run_as_uid is None:
+            raise ImproperlyConfigured("The local executor needs LOCAL_EXECUTOR_UID, an unprivileged uid to run code as")
+        if self.run_as_uid == 0:
+            raise ImproperlyConfigured("LOCAL_EXECUTOR_UID must not be 0")
+        if self.run_as_uid == os.geteuid():
+            raise ImproperlyConfigured("LOCAL_EXECUTOR_UID must differ from the uid the server runs as")
+        self.env = {'PATH': os.environ.get('PATH', '/usr/bin:/bin'), 'LANG': 'C.UTF-8'}
+        self.check_sandbox()
+
+        self.workspaces = queue.Queue()
+        for _ in range(workers or EXECUTION_WORKERS):
+            workspace = tempfile.mkdtemp(prefix='codelive-run-')
+            os.chown(workspace, self.run_as_uid, self.run_as_uid)
+            self.workspaces.put(workspace)
+
+    def check_sandbox(self):
+        # Fail at startup rather than turning every run into an Internal Error
+        try:
+            probe = subprocess.run(
+                self.sandboxed(['true'], limit_address_space=False), capture_output=True,
+                env=self.env, timeout=10, **self.credentials()
+            )
+        except (OSError, subprocess.SubprocessError) as e:
+            raise ImproperlyConfigured(f"The local executor sandbox is unavailable: {e}")
+        if probe.returncode != 0:
+            detail = probe.stderr.decode('utf-8', errors='replace').strip()
+            raise ImproperlyConfigured(f"The local executor sandbox is unavailable: {detail}")
+
+    def credentials(self):
+        return {'user': self.run_as_uid, 'group': self.run_as_uid, 'extra_groups': []}
+
+    def sandboxed(self, command, limit_address_space):
+        limits = [
+            f'--cpu={self.cpu_seconds}:{self.cpu_seconds + 1}',
+            f'--fsize={FILE_SIZE_LIMIT}',
+            '--core=0',
+            f'--nproc={self.max_processes}',
+        ]
+        if limit_address_space:
+            limits.append(f'--as={self.memory_mb * 1024 * 1024}')
+        return ['unshare', '--user', '--net', '--', 'prlimit', *limits, '--', *command]
+
+    def execute(self, language, code, inputs, deadline, on_started=None):
+        toolchain = LOCAL_TOOLCHAINS[language]
+        try:
+            workspace = self.workspaces.get(timeout=max(deadline - time.monotonic(), 0.01))
+        except queue.Empty:
+            raise TimeoutError("Execution did not finish in time: no worker became free")
+        try:
+            if on_started:
+                on_started()
+            source = os.path.join(workspace, toolchain['source'])
+            with open(source, 'w', encoding='utf-8') as handle:
+                handle.write(code)
+            os.chown(source, self.run_as_uid, self.run_as_uid)
+
+            if toolchain['compile']:
+                compiled = self.run_process(toolchain['compile'], workspace, '', deadline, limit_address_space=False)
+                if compiled['status']['id'] != ACCEPTED['id']:
+                    if compiled['status']['id'] != INTERNAL_ERROR['id']:
+                        compiled['compile_output'] = compiled['stderr'] or compiled['stdout']
+                        compiled['stdout'] = compiled['stderr'] = None
+                        compiled['status'] = COMPILATION_ERROR
+                    return [dict(compiled) for _ in inputs]
+
+            command = toolchain['run'](self.memory_mb)
+            return [
+                self.run_process(command, workspace, stdin, deadline, toolchain['limit_address_space'])
+                for stdin in inputs
+            ]
+        finally:
+            for entry in os.listdir(workspace):
+                path = os.path.join(workspace, entry)
+                if os.path.isdir(path):
+                    shutil.rmtree(path, ignore_errors=True)
+                else:
+                    os.unlink(path)
+            self.workspaces.put(workspace)
+
+    def run_process(self, command, workspace, stdin, deadline, limit_address_space):
+        result = {'stdout': None, 'stderr': None, 'compile_output': None, 'message': None, 'time': None, 'memory': None}
+        timeout = min(self.wall_seconds, deadline - time.monotonic())
+        if timeout <= 0:
+            return dict(result, status=TIME_LIMIT_EXCEEDED)
+        if not command[0].startswith('./') and shutil.which(command[0], path=self.env['PATH']) is None:
+            return dict(result, status=INTERNAL_ERROR, message=f"Could not start {command[0]}: not installed")
+
+        started = time.monotonic()
+        try:
+            process = subprocess.Popen(
+                self.sandboxed(command, limit_address_space),
+                cwd=workspace,
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                env=dict(self.env, HOME=workspace),
+                start_new_session=True,
+                **self.credentials(),
+            )
+        except (OSError, subprocess.SubprocessError) as e:
+            return dict(result, status=INTERNAL_ERROR, message=f"Could not start {command[0]}: {e}")
+
+        # Output is read as it is produced and only the first OUTPUT_LIMIT
+        # bytes of each stream are kept; the rest is drained and dropped so a
+        # chatty program can neither fill memory nor block on a full pipe.
+        stdout, stderr = bytearray(), bytearray()
+        threads = [
+            threading.Thread(target=feed_pipe, args=(process.stdin, stdin.encode('utf-8')), daemon=True),
+            threading.Thread(target=drain_pipe, args=(process.stdout, stdout), daemon=True),
+            threading.Thread(target=drain_pipe, args=(process.stderr, stderr), daemon=True),
+        ]
+        for thread in threads:
+            thread.start()
+
+        timed_out = False
+        try:
+            process.wait(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            timed_out = True
+        # Also reaps anything the program left running in its process group
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+        process.wait()
+        for thread in threads:
+            thread.join(timeout=1)
+
+        result['time'] = f"{time.monotonic() - started:.3f}"
+        if timed_out:
+            return dict(result, status=TIME_LIMIT_EXCEEDED)
+
+        result['stdout'] = stdout.decode('utf-8', errors='replace') or None
+        result['stderr'] = stderr.decode('utf-8', errors='replace') or None
+        if process.returncode == 0:
+            result['status'] = ACCEPTED
+        elif process.returncode < 0:
+            result['status'] = SIGNAL_STATUSES.get(-process.returncode, {'id': 12, 'description': 'Runtime Error (Other)'})
+            if process.returncode == -signal.SIGKILL:
+                result['status'] = TIME_LIMIT_EXCEEDED
+        else:
+            result['status'] = RUNTIME_ERROR
+            result['message'] = f"Exited with error status {process.returncode}"
+        if len(stdout) >= OUTPUT_LIMIT or len(stderr) >= OUTPUT_LIMIT:
+            result['message'] = ' '.join(filter(None, [result['message'], f"Output truncated to {OUTPUT_LIMIT // 1024} KB"]))
+        return result
+
+def feed_pipe(pipe, data):
+    try:
+        pipe.write(data)
+    except (BrokenPipeError, OSError):
+        pass
+    finally:
+        try:
+            pipe.close()
+        except OSError:
+            pass
+
+def drain_pipe(pipe, sink):
+    while True:
+        chunk = pipe.read1(65536)
+        if not chunk:
+            break
+        if len(sink) < OUTPUT_LIMIT:
+            sink.extend(chunk[:OUTPUT_LIMIT - len(sink)])
+    pipe.close()
+
+
+EXECUTORS = {
+    'judge0': Judge0Executor,
+    'local': LocalExecutor,
+}
+
+_executor = None
+_executor_lock = threading.Lock()
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                backend = getattr(settings, 'CODE_EXECUTOR', 'judge0')
+                if backend not in EXECUTORS:
+                    raise ValueError(f"Unknown CODE_EXECUTOR {backend!r}; expected one of {', '.join(EXECUTORS)}")
+                started = time.perf_counter()
+                _executor = EXECUTORS[backend]()
+                metrics.observe('execution.executor_start_seconds', time.perf_counter() - started)
+    return _executor
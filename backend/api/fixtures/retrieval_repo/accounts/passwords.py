@@ -0,0 +1,23 @@
+import hashlib
+import hmac
+import os
+
+ITERATIONS = 260_000
+
+
+def hash_password(password, salt=None):
+    salt = salt or os.urandom(16)
+    digest = hashlib.pbkdf2_hmac("sha256", password.encode(), salt, ITERATIONS)
+    return f"pbkdf2_sha256${ITERATIONS}${salt.hex()}${digest.hex()}"
+
+
+def check_password(password, encoded):
+    algorithm, iterations, salt, expected = encoded.split("$")
+    if algorithm != "pbkdf2_sha256":
+        return False
+    digest = hashlib.pbkdf2_hmac("sha256", password.encode(), bytes.fromhex(salt), int(iterations))
+    return hmac.compare_digest(digest.hex(), expected)
+
+
+def needs_rehash(encoded):
+    return int(encoded.split("$")[1]) < ITERATIONS
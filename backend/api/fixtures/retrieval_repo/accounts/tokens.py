@@ -0,0 +1,45 @@
+import hashlib
+import hmac
+import secrets
+import time
+
+from storage.cache import ExpiringCache
+
+TOKEN_TTL_SECONDS = 3600
+_revoked = ExpiringCache(max_entries=10_000)
+
+
+class TokenError(Exception):
+    pass
+
+
+def issue_token(user_id, secret, now=None):
+    issued_at = int(now or time.time())
+    nonce = secrets.token_hex(8)
+    payload = f"{user_id}:{issued_at}:{nonce}"
+    return f"{payload}:{sign_payload(payload, secret)}"
+
+
+def sign_payload(payload, secret):
+    return hmac.new(secret.encode(), payload.encode(), hashlib.sha256).hexdigest()
+
+
+def verify_token(token, secret, now=None):
+    try:
+        user_id, issued_at, nonce, signature = token.split(":")
+    except ValueError:
+        raise TokenError("malformed token")
+
+    payload = f"{user_id}:{issued_at}:{nonce}"
+    if not hmac.compare_digest(signature, sign_payload(payload, secret)):
+        raise TokenError("bad signature")
+    if (now or time.time()) - int(issued_at) > TOKEN_TTL_SECONDS:
+        raise TokenError("token expired")
+    if _revoked.get(nonce):
+        raise TokenError("token revoked")
+    return int(user_id)
+
+
+def revoke_token(token):
+    nonce = token.split(":")[2]
+    _revoked.set(nonce, True, ttl=TOKEN_TTL_SECONDS)
@@ -0,0 +1,45 @@
+from dataclasses import dataclass, field
+
+from accounts.passwords import check_password, hash_password, needs_rehash
+from accounts.tokens import issue_token
+from storage.repository import Repository
+
+
+@dataclass
+class UserRecord:
+    id: int
+    email: str
+    password: str
+    roles: set = field(default_factory=set)
+
+
+class UserService:
+    def __init__(self, repository: Repository, secret):
+        self.repository = repository
+        self.secret = secret
+
+    def register_user(self, email, password):
+        if self.repository.find_by("email", normalize_email(email)):
+            raise ValueError("email already registered")
+        record = UserRecord(id=self.repository.next_id(), email=normalize_email(email), password=hash_password(password))
+        self.repository.save(record)
+        return record
+
+    def authenticate(self, email, password):
+        record = self.repository.find_by("email", normalize_email(email))
+        if record is None or not check_password(password, record.password):
+            return None
+        if needs_rehash(record.password):
+            record.password = hash_password(password)
+            self.repository.save(record)
+        return issue_token(record.id, self.secret)
+
+    def grant_role(self, user_id, role):
+        record = self.repository.get(user_id)
+        record.roles.add(role)
+        self.repository.save(record)
+
+
+def normalize_email(email):
+    local, _, domain = email.strip().partition("@")
+    return f"{local}@{domain.lower()}"
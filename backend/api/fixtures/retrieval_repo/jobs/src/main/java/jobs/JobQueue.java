@@ -0,0 +1,45 @@
+package jobs;
+
+import java.util.PriorityQueue;
+
+public class JobQueue {
+    public interface Job {
+        int priority();
+        void run() throws Exception;
+    }
+
+    private final PriorityQueue<Job> pending = new PriorityQueue<>((a, b) -> Integer.compare(b.priority(), a.priority()));
+    private final RateLimiter limiter;
+
+    public JobQueue(RateLimiter limiter) {
+        this.limiter = limiter;
+    }
+
+    public synchronized void enqueueJob(Job job) {
+        pending.add(job);
+    }
+
+    public int drainReadyJobs() {
+        int completed = 0;
+        while (true) {
+            Job job;
+            synchronized (this) {
+                if (pending.isEmpty() || !limiter.tryAcquire(1)) {
+                    return completed;
+                }
+                job = pending.poll();
+            }
+            try {
+                job.run();
+                completed++;
+            } catch (Exception e) {
+                scheduleRetry(job, e);
+            }
+        }
+    }
+
+    private void scheduleRetry(Job job, Exception cause) {
+        System.err.println("Job failed, requeueing: " + cause.getMessage());
+        enqueueJob(job);
+    }
+}
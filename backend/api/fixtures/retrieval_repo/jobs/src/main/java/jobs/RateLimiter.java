@@ -0,0 +1,32 @@
+package jobs;
+
+import java.util.concurrent.TimeUnit;
+
+public class RateLimiter {
+    private final long capacity;
+    private final double refillPerNano;
+    private double tokens;
+    private long lastRefill;
+
+    public RateLimiter(long capacity, long refillPerSecond) {
+        this.capacity = capacity;
+        this.refillPerNano = refillPerSecond / (double) TimeUnit.SECONDS.toNanos(1);
+        this.tokens = capacity;
+        this.lastRefill = System.nanoTime();
+    }
+
+    public synchronized boolean tryAcquire(int permits) {
+        refillTokens();
+        if (tokens < permits) {
+            return false;
+        }
+        tokens -= permits;
+        return true;
+    }
+
+    private void refillTokens() {
+        long now = System.nanoTime();
+        tokens = Math.min(capacity, tokens + (now - lastRefill) * refillPerNano);
+        lastRefill = now;
+    }
+}
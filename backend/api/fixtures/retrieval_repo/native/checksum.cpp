@@ -0,0 +1,38 @@
+#include <cstdint>
+#include <string_view>
+
+namespace {
+
+constexpr std::uint32_t kCrcPolynomial = 0xEDB88320u;
+
+struct CrcTable {
+    std::uint32_t entries[256];
+
+    constexpr CrcTable() : entries{} {
+        for (std::uint32_t i = 0; i < 256; ++i) {
+            std::uint32_t crc = i;
+            for (int bit = 0; bit < 8; ++bit) {
+                crc = (crc & 1) ? (crc >> 1) ^ kCrcPolynomial : crc >> 1;
+            }
+            entries[i] = crc;
+        }
+    }
+};
+
+constexpr CrcTable kTable;
+
+}  // namespace
+
+std::uint32_t crc32_update(std::uint32_t crc, std::string_view data) {
+    crc = ~crc;
+    for (unsigned char byte : data) {
+        crc = kTable.entries[(crc ^ byte) & 0xFF] ^ (crc >> 8);
+    }
+    return ~crc;
+}
+
+struct ChecksumWriter {
+    std::uint32_t crc = 0;
+
+    void write_chunk(std::string_view chunk) { crc = crc32_update(crc, chunk); }
+};
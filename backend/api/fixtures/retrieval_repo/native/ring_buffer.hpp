@@ -0,0 +1,35 @@
+#pragma once
+
+#include <array>
+#include <cstddef>
+#include <optional>
+
+template <typename T, std::size_t Capacity>
+class RingBuffer {
+public:
+    bool push_back(const T& value) {
+        if (size_ == Capacity) {
+            return false;
+        }
+        items_[(head_ + size_) % Capacity] = value;
+        ++size_;
+        return true;
+    }
+
+    std::optional<T> pop_front() {
+        if (size_ == 0) {
+            return std::nullopt;
+        }
+        T value = items_[head_];
+        head_ = (head_ + 1) % Capacity;
+        --size_;
+        return value;
+    }
+
+    std::size_t size() const { return size_; }
+
+private:
+    std::array<T, Capacity> items_{};
+    std::size_t head_ = 0;
+    std::size_t size_ = 0;
+};
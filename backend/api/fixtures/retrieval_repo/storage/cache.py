@@ -0,0 +1,40 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class ExpiringCache:
+    """LRU map whose entries also expire after a per-entry TTL."""
+
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return default
+            value, expires_at = entry
+            if expires_at is not None and expires_at < time.monotonic():
+                del self.entries[key]
+                return default
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.monotonic() + ttl if ttl else None
+        with self.lock:
+            self.entries[key] = (value, expires_at)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def purge_expired(self):
+        now = time.monotonic()
+        with self.lock:
+            expired = [key for key, (_, expires_at) in self.entries.items() if expires_at is not None and expires_at < now]
+            for key in expired:
+                del self.entries[key]
+        return len(expired)
@@ -0,0 +1,30 @@
+MIGRATIONS = []
+
+
+def migration(version):
+    def register(function):
+        MIGRATIONS.append((version, function))
+        MIGRATIONS.sort(key=lambda item: item[0])
+        return function
+    return register
+
+
+def apply_migrations(rows, current_version):
+    for version, function in MIGRATIONS:
+        if version > current_version:
+            rows = [function(row) for row in rows]
+            current_version = version
+    return rows, current_version
+
+
+@migration(2)
+def add_roles_column(row):
+    row.setdefault("roles", [])
+    return row
+
+
+@migration(3)
+def lowercase_email_domains(row):
+    local, _, domain = row["email"].partition("@")
+    row["email"] = f"{local}@{domain.lower()}"
+    return row
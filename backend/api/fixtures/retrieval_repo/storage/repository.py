@@ -0,0 +1,42 @@
+import itertools
+import json
+import os
+import tempfile
+
+
+class Repository:
+    """In-memory table with an append-only JSON snapshot on disk."""
+
+    def __init__(self, path):
+        self.path = path
+        self.rows = {}
+        self.ids = itertools.count(1)
+        if os.path.exists(path):
+            self.load_snapshot()
+
+    def next_id(self):
+        return next(self.ids)
+
+    def get(self, row_id):
+        return self.rows[row_id]
+
+    def find_by(self, column, value):
+        for row in self.rows.values():
+            if getattr(row, column) == value:
+                return row
+        return None
+
+    def save(self, row):
+        self.rows[row.id] = row
+
+    def write_snapshot(self, serialize):
+        directory = os.path.dirname(self.path) or "."
+        with tempfile.NamedTemporaryFile("w", dir=directory, delete=False) as handle:
+            json.dump([serialize(row) for row in self.rows.values()], handle)
+        os.replace(handle.name, self.path)
+
+    def load_snapshot(self):
+        with open(self.path) as handle:
+            rows = json.load(handle)
+        self.ids = itertools.count(max((row["id"] for row in rows), default=0) + 1)
+        return rows
@@ -0,0 +1,40 @@
+import React, { useEffect, useState } from 'react';
+import { useDebouncedValue } from './useDebouncedValue';
+
+function highlightMatch(text, query) {
+    const index = text.toLowerCase().indexOf(query.toLowerCase());
+    if (!query || index < 0) return text;
+    return (
+        <>
+            {text.slice(0, index)}
+            <mark>{text.slice(index, index + query.length)}</mark>
+            {text.slice(index + query.length)}
+        </>
+    );
+}
+
+export default function SearchBox({ client, onSelect }) {
+    const [query, setQuery] = useState('');
+    const [results, setResults] = useState([]);
+    const debouncedQuery = useDebouncedValue(query);
+
+    useEffect(() => {
+        if (!debouncedQuery) return setResults([]);
+        let cancelled = false;
+        client.get(`/search?q=${encodeURIComponent(debouncedQuery)}`).then((rows) => {
+            if (!cancelled) setResults(rows);
+        });
+        return () => { cancelled = true; };
+    }, [client, debouncedQuery]);
+
+    return (
+        <div className="search-box">
+            <input value={query} onChange={(event) => setQuery(event.target.value)} placeholder="Search users" />
+            <ul>
+                {results.map((row) => (
+                    <li key={row.id} onClick={() => onSelect(row)}>{highlightMatch(row.email, query)}</li>
+                ))}
+            </ul>
+        </div>
+    );
+}
@@ -0,0 +1,40 @@
+const DEFAULT_RETRIES = 3;
+
+export class ApiError extends Error {
+    constructor(status, body) {
+        super(`Request failed with status ${status}`);
+        this.status = status;
+        this.body = body;
+    }
+}
+
+export function createApiClient(baseUrl, getToken) {
+    async function request(method, path, body, retries = DEFAULT_RETRIES) {
+        const response = await fetch(`${baseUrl}${path}`, {
+            method,
+            headers: {
+                'Content-Type': 'application/json',
+                Authorization: `Bearer ${getToken()}`,
+            },
+            body: body === undefined ? undefined : JSON.stringify(body),
+        });
+        if (response.status >= 500 && retries > 0) {
+            await waitWithBackoff(DEFAULT_RETRIES - retries);
+            return request(method, path, body, retries - 1);
+        }
+        const payload = await response.json().catch(() => null);
+        if (!response.ok) throw new ApiError(response.status, payload);
+        return payload;
+    }
+
+    return {
+        get: (path) => request('GET', path),
+        post: (path, body) => request('POST', path, body),
+        patch: (path, body) => request('PATCH', path, body),
+    };
+}
+
+export function waitWithBackoff(attempt) {
+    const delay = Math.min(2000, 100 * 2 ** attempt) * (0.5 + Math.random() / 2);
+    return new Promise((resolve) => setTimeout(resolve, delay));
+}
@@ -0,0 +1,86 @@
+import json
+import threading
+import time
+import uuid
+import zlib
+from urllib.parse import parse_qs
+import msgpack
+from cachetools import TTLCache
+from django.conf import settings
+from . import metrics
+
+# WebSocket frame encoding. A socket picks JSON text frames (the default) or
+# MessagePack binary frames at connect time with ?encoding=msgpack. Group
+# events built with shared_event() carry a frame id, and the encoded frame is
+# kept for a few seconds, so a broadcast is serialized once per encoding in
+# each worker instead of once per recipient socket.
+#
+# Binary frames start with one flag byte: 0 for a plain MessagePack body, 1
+# for a zlib-deflated one. Bodies of WS_COMPRESS_MIN_BYTES or more (file
+# contents, mostly) are deflated; source text shrinks several times over.
+# Daphne does not negotiate permessage-deflate, so this is done per frame.
+
+JSON = 'json'
+MSGPACK = 'msgpack'
+ENCODINGS = (JSON, MSGPACK)
+
+FRAME_CACHE_SIZE = getattr(settings, 'WS_FRAME_CACHE_SIZE', 512)
+FRAME_CACHE_TTL = getattr(settings, 'WS_FRAME_CACHE_TTL', 5)
+COMPRESS_MIN_BYTES = getattr(settings, 'WS_COMPRESS_MIN_BYTES', 2048)
+PLAIN = b'\x00'
+DEFLATED = b'\x01'
+
+_frames = TTLCache(maxsize=FRAME_CACHE_SIZE, ttl=FRAME_CACHE_TTL)
+_frames_lock = threading.Lock()
+
+def negotiate(scope):
+    query = parse_qs(scope.get('query_string', b'').decode('utf-8'))
+    encoding = query.get('encoding', [JSON])[0]
+    return encoding if encoding in ENCODINGS else JSON
+
+def shared_event(event):
+    # Every recipient of this group event gets an identical payload
+    return dict(event, frame_id=uuid.uuid4().hex)
+
+def encode(payload, encoding):
+    started = time.perf_counter()
+    if encoding == MSGPACK:
+        body = msgpack.packb(payload, use_bin_type=True)
+        if len(body) >= COMPRESS_MIN_BYTES:
+            frame = DEFLATED + zlib.compress(body, 1)
+        else:
+            frame = PLAIN + body
+        size = len(frame)
+    else:
+        frame = json.dumps(payload)
+        size = len(frame.encode('utf-8'))
+    metrics.observe(f'ws.encode_seconds.{encoding}', time.perf_counter() - started)
+    return frame, size
+
+def frame_for(payload, encoding, event=None):
+    frame_id = event.get('frame_id') if event else None
+    if frame_id is None:
+        frame, size = encode(payload, encoding)
+    else:
+        key = (frame_id, encoding)
+        with _frames_lock:
+            cached = _frames.get(key)
+        if cached is None:
+            cached = encode(payload, encoding)
+            with _frames_lock:
+                _frames[key] = cached
+        else:
+            metrics.incr('ws.frames_shared')
+        frame, size = cached
+
+    metrics.incr(f'ws.frames_sent.{encoding}')
+    metrics.incr(f'ws.bytes_sent.{encoding}', size)
+    return frame
+
+def decode(text_data=None, bytes_data=None):
+    if bytes_data is not None:
+        body = bytes_data[1:]
+        if bytes_data[:1] == DEFLATED:
+            body = zlib.decompress(body)
+        return msgpack.unpackb(body, raw=False)
+    return json.loads(text_data)
@@ -0,0 +1,255 @@
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.core.cache import cache
+from django.db import close_old_connections
+from .rag_service import index_project
+from .framing import shared_event
+
+# Indexing runs on a small local thread pool. Job state lives in the shared
+# cache so any worker can report on, de-duplicate or cancel a job. Each
+# project has a lock naming its active job; the worker holding it renews it
+# every HEARTBEAT_SECONDS, so the lock of a worker that died simply expires.
+INDEX_WORKERS = getattr(settings, 'RAG_INDEX_WORKERS', 2)
+JOB_TIMEOUT = getattr(settings, 'RAG_INDEX_JOB_TIMEOUT', 3600)
+HEARTBEAT_SECONDS = getattr(settings, 'RAG_INDEX_HEARTBEAT_SECONDS', 30)
+LOCK_TTL = HEARTBEAT_SECONDS * 3
+
+PENDING = 'PENDING'
+RUNNING = 'RUNNING'
+COMPLETED = 'COMPLETED'
+FAILED = 'FAILED'
+CANCELLED = 'CANCELLED'
+ACTIVE_STATUSES = [PENDING, RUNNING]
+
+_executor = ThreadPoolExecutor(max_workers=INDEX_WORKERS, thread_name_prefix='rag-index')
+
+def _lock_key(project_id):
+    return f'rag_index_lock:{int(project_id)}'
+
+def _job_key(project_id):
+    return f'rag_index_job:{int(project_id)}'
+
+def _cancel_key(job_id):
+    return f'rag_index_cancel:{job_id}'
+
+class RedisJobLocks:
+    def __init__(self, url):
+        self.url = url
+        self.redis = None
+
+    def client(self):
+        if self.redis is None:
+            import redis
+
+            self.redis = redis.Redis.from_url(self.url, decode_responses=True)
+        return self.redis
+
+    def acquire(self, key, owner, ttl):
+        return bool(self.client().set(key, owner, nx=True, px=int(ttl * 1000)))
+
+    def holder(self, key):
+        return self.client().get(key)
+
+    def refresh(self, key, owner, ttl):
+        return self._if_held(key, owner, lambda pipe: pipe.pexpire(key, int(ttl * 1000)))
+
+    def release(self, key, owner):
+        return self._if_held(key, owner, lambda pipe: pipe.delete(key))
+
+    def _if_held(self, key, owner, command):
+        # Compare-and-set: only touch the lock while `owner` still holds it
+        from redis.exceptions import WatchError
+
+        with self.client().pipeline(transaction=True) as pipe:
+            try:
+                pipe.watch(key)
+                if pipe.get(key) != owner:
+                    return False
+                pipe.multi()
+                command(pipe)
+                pipe.execute()
+                return True
+            except WatchError:
+                return False
+
+
+class MemoryJobLocks:
+    # Single-process stand-in for RedisJobLocks (tests, local development)
+    def __init__(self):
+        self.locks = {}
+        self.guard = threading.Lock()
+
+    def acquire(self, key, owner, ttl):
+        with self.guard:
+            if self._holder(key) is not None:
+                return False
+            self.locks[key] = (owner, time.monotonic() + ttl)
+            return True
+
+    def holder(self, key):
+        with self.guard:
+            return self._holder(key)
+
+    def refresh(self, key, owner, ttl):
+        with self.guard:
+            if self._holder(key) != owner:
+                return False
+            self.locks[key] = (owner, time.monotonic() + ttl)
+            return True
+
+    def release(self, key, owner):
+        with self.guard:
+            if self._holder(key) != owner:
+                return False
+            del self.locks[key]
+            return True
+
+    def _holder(self, key):
+        owner, expires = self.locks.get(key, (None, 0))
+        return owner if expires > time.monotonic() else None
+
+
+_job_locks = {}
+
+
+def get_job_locks():
+    url = getattr(settings, 'INDEX_JOB_REDIS_URL', None)
+    locks = _job_locks.get(url)
+    if locks is None:
+        locks = _job_locks.setdefault(url, RedisJobLocks(url) if url else MemoryJobLocks())
+    return locks
+
+
+# Locks this process holds, renewed by the heartbeat thread: project id -> job id
+_held_locks = {}
+_held_guard = threading.Lock()
+_heartbeat_thread = None
+
+def _hold_lock(project_id, job_id):
+    global _heartbeat_thread
+    with _held_guard:
+        _held_locks[project_id] = job_id
+        if _heartbeat_thread is None:
+            _heartbeat_thread = threading.Thread(target=_heartbeat, name='rag-index-heartbeat', daemon=True)
+            _heartbeat_thread.start()
+
+def _heartbeat():
+    while True:
+        time.sleep(HEARTBEAT_SECONDS)
+        _renew_held_locks()
+
+def _renew_held_locks():
+    with _held_guard:
+        held = list(_held_locks.items())
+    for project_id, job_id in held:
+        try:
+            renewed = get_job_locks().refresh(_lock_key(project_id), job_id, LOCK_TTL)
+        except Exception as e:
+            print(f"RAG Index Job: could not renew the lock of project {project_id}: {e}")
+            continue
+        if not renewed:
+            print(f"RAG Index Job: lost the lock of project {project_id}")
+            with _held_guard:
+                if _held_locks.get(project_id) == job_id:
+                    del _held_locks[project_id]
+
+def _release_lock(project_id, job_id):
+    with _held_guard:
+        if _held_locks.get(project_id) == job_id:
+            del _held_locks[project_id]
+    return get_job_locks().release(_lock_key(project_id), job_id)
+
+def get_index_job(project_id):
+    job = cache.get(_job_key(project_id))
+    if job and job['status'] in ACTIVE_STATUSES and get_job_locks().holder(_lock_key(project_id)) != job['id']:
+        # Its lock expired without being released: the worker running it died
+        job = {**job, 'status': FAILED, 'message': 'Indexing stopped unexpectedly.'}
+    return job
+
+def _new_job(job_id, project_id):
+    return {
+        'id': job_id,
+        'project_id': int(project_id),
+        'status': PENDING,
+        'progress': 0,
+        'message': 'Indexing queued.',
+    }
+
+def _acquire_lock(project_id, job_id):
+    # Returns the id of the job holding the project's lock afterwards
+    locks = get_job_locks()
+    while not locks.acquire(_lock_key(project_id), job_id, LOCK_TTL):
+        holder = locks.holder(_lock_key(project_id))
+        # None: the lock expired or was released in between; try again
+        if holder is not None:
+            return holder
+    _hold_lock(int(project_id), job_id)
+    return job_id
+
+def submit_index_job(project_id):
+    job = _new_job(uuid.uuid4().hex, project_id)
+    holder = _acquire_lock(project_id, job['id'])
+    if holder != job['id']:
+        current = get_index_job(project_id)
+        if not current or current['id'] != holder:
+            current = _new_job(holder, project_id)
+        return current, False
+
+    _save_job(job)
+    _executor.submit(_run_job, job)
+    return dict(job), True
+
+def cancel_index_job(project_id):
+    job = get_index_job(project_id)
+    if job and job['status'] in ACTIVE_STATUSES:
+        cache.set(_cancel_key(job['id']), True, JOB_TIMEOUT)
+    return job
+
+def _save_job(job):
+    cache.set(_job_key(job['project_id']), job, JOB_TIMEOUT)
+    try:
+        async_to_sync(get_channel_layer().group_send)(
+            f"project_{job['project_id']}",
+            shared_event({'type': 'index_progress', 'job': dict(job)})
+        )
+    except Exception as e:
+        print(f"RAG Index Job: could not publish progress: {e}")
+
+def _run_job(job):
+    def on_progress(percent):
+        if percent != job['progress']:
+            job['progress'] = percent
+            _save_job(job)
+
+    def should_cancel():
+        return bool(cache.get(_cancel_key(job['id'])))
+
+    try:
+        job['status'] = RUNNING
+        job['message'] = 'Indexing started.'
+        _save_job(job)
+
+        success, message = index_project(job['project_id'], progress_callback=on_progress, should_cancel=should_cancel)
+        if should_cancel():
+            job['status'] = CANCELLED
+        else:
+            job['status'] = COMPLETED if success else FAILED
+        if job['status'] == COMPLETED:
+            job['progress'] = 100
+        job['message'] = message
+    except Exception as e:
+        print(f"RAG Index Job Error: {e}")
+        job['status'] = FAILED
+        job['message'] = str(e)
+    finally:
+        try:
+            _save_job(job)
+        finally:
+            _release_lock(job['project_id'], job['id'])
+            cache.delete(_cancel_key(job['id']))
+            close_old_connections()
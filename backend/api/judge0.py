@@ -0,0 +1,70 @@
+import threading
+from urllib.parse import urlparse
+import requests
+from requests.adapters import HTTPAdapter
+from django.conf import settings
+
+# Thin Judge0 client over one keep-alive session per process, so polls reuse
+# pooled connections instead of paying a TCP+TLS handshake each time.
+POOL_SIZE = getattr(settings, 'CODE_EXECUTION_WORKERS', 8)
+REQUEST_TIMEOUT = 10
+# Judge0's default MAX_SUBMISSION_BATCH_SIZE
+BATCH_LIMIT = 20
+RESULT_FIELDS = 'token,stdout,stderr,compile_output,message,status,time,memory'
+
+LANGUAGE_IDS = {
+    "python": 71,
+    "javascript": 63,
+    "cpp": 54,
+    "java": 62,
+}
+
+_session = None
+_session_lock = threading.Lock()
+
+def get_session():
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                _session = session
+    return _session
+
+def base_url():
+    return settings.JUDGE0_URL.rstrip('/')
+
+def headers():
+    result = {"content-type": "application/json"}
+    if settings.JUDGE0_API_KEY:
+        result["X-RapidAPI-Key"] = settings.JUDGE0_API_KEY
+        result["X-RapidAPI-Host"] = urlparse(settings.JUDGE0_URL).hostname
+    return result
+
+def _request(method, path, **kwargs):
+    response = get_session().request(method, f"{base_url()}{path}", headers=headers(), timeout=REQUEST_TIMEOUT, **kwargs)
+    response.raise_for_status()
+    return response.json()
+
+def submit(submission):
+    token = _request('POST', '/submissions', json=submission).get('token')
+    if not token:
+        raise ValueError("Failed to get submission token")
+    return token
+
+def submit_batch(submissions):
+    # One request for up to BATCH_LIMIT submissions; tokens come back in order
+    tokens = [entry.get('token') for entry in _request('POST', '/submissions/batch', json={'submissions': submissions})]
+    if not all(tokens):
+        raise ValueError("Failed to get submission tokens")
+    return tokens
+
+def get_submission(token):
+    return _request('GET', f'/submissions/{token}', params={'fields': RESULT_FIELDS})
+
+def get_submissions(tokens):
+    data = _request('GET', '/submissions/batch', params={'tokens': ','.join(tokens), 'fields': RESULT_FIELDS})
+    return data.get('submissions', [])
@@ -0,0 +1,214 @@
+import math
+import re
+import threading
+import time
+from collections import Counter
+from cachetools import LRUCache
+from django.conf import settings
+from django.core.cache import cache
+from .models import File
+from .chunking import chunk_code
+
+# Per-project BM25 index over code tokens. Identifiers are indexed whole and
+# split on snake_case/camelCase, so "getUserName" matches "user name" and
+# "get_user_name" alike. Files are chunked with chunk_code, the same as the
+# vector index, so hits from both line up by line range.
+#
+# Indexes live in each worker process, so every change to a project's files
+# also bumps a content version in the shared cache. A worker patches its own
+# index in place when it was current before the change; any other worker sees
+# a newer version on its next search and rebuilds from the database.
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+INDEX_HANDLES = getattr(settings, 'LEXICAL_INDEX_HANDLES', 32)
+
+IDENTIFIER_RE = re.compile(r'[A-Za-z_][A-Za-z0-9_]*|\d+')
+WORD_PART_RE = re.compile(r'[A-Z]+(?=[A-Z][a-z])|[A-Z]?[a-z]+|[A-Z]+|\d+')
+
+
+def tokenize(text):
+    tokens = []
+    for identifier in IDENTIFIER_RE.findall(text):
+        lowered = identifier.lower()
+        tokens.append(lowered)
+        parts = [part.lower() for part in WORD_PART_RE.findall(identifier)]
+        if len(parts) > 1:
+            tokens.extend(parts)
+    return tokens
+
+
+class LexicalIndex:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.postings = {}
+        self.chunks = {}
+        self.file_chunks = {}
+        self.total_length = 0
+        self.next_key = 0
+
+    def add_file(self, file_id, file_name, content):
+        with self.lock:
+            self._remove_file(file_id)
+            keys = []
+            for chunk in chunk_code(content, file_name):
+                terms = Counter(tokenize(chunk['text']))
+                if not terms:
+                    continue
+                key = self.next_key
+                self.next_key += 1
+                length = sum(terms.values())
+                self.chunks[key] = {
+                    'file_id': file_id,
+                    'file_name': file_name,
+                    'start_line': chunk['start_line'],
+                    'end_line': chunk['end_line'],
+                    'text': chunk['text'],
+                    'length': length,
+                    'terms': terms,
+                }
+                self.total_length += length
+                for term, frequency in terms.items():
+                    self.postings.setdefault(term, {})[key] = frequency
+                keys.append(key)
+            self.file_chunks[file_id] = keys
+
+    def remove_file(self, file_id):
+        with self.lock:
+            self._remove_file(file_id)
+
+    def _remove_file(self, file_id):
+        for key in self.file_chunks.pop(file_id, []):
+            chunk = self.chunks.pop(key)
+            self.total_length -= chunk['length']
+            for term in chunk['terms']:
+                posting = self.postings[term]
+                posting.pop(key, None)
+                if not posting:
+                    del self.postings[term]
+
+    def file_name(self, file_id):
+        with self.lock:
+            keys = self.file_chunks.get(file_id)
+            return self.chunks[keys[0]]['file_name'] if keys else None
+
+    def search(self, query, k=5):
+        query_terms = set(tokenize(query))
+        with self.lock:
+            if not self.chunks:
+                return []
+            chunk_count = len(self.chunks)
+            average_length = self.total_length / chunk_count
+            scores = {}
+            for term in query_terms:
+                posting = self.postings.get(term)
+                if not posting:
+                    continue
+                idf = math.log(1 + (chunk_count - len(posting) + 0.5) / (len(posting) + 0.5))
+                for key, frequency in posting.items():
+                    length = self.chunks[key]['length']
+                    norm = frequency + BM25_K1 * (1 - BM25_B + BM25_B * length / average_length)
+                    scores[key] = scores.get(key, 0.0) + idf * frequency * (BM25_K1 + 1) / norm
+
+            ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+            return [(score, self.chunks[key]) for key, score in ranked]
+
+
+# project_id -> (content_version, LexicalIndex)
+_indexes = LRUCache(maxsize=INDEX_HANDLES)
+_indexes_lock = threading.Lock()
+
+
+def content_version_key(project_id):
+    return f'lexical_content_version:{int(project_id)}'
+
+
+def get_content_version(project_id):
+    key = content_version_key(project_id)
+    version = cache.get(key)
+    if version is None:
+        # Seeded from the clock so a version lost to eviction is never reused
+        cache.add(key, int(time.time() * 1000), timeout=None)
+        version = cache.get(key)
+    return version
+
+
+def bump_content_version(project_id):
+    get_content_version(project_id)
+    try:
+        return cache.incr(content_version_key(project_id))
+    except ValueError:
+        return get_content_version(project_id)
+
+
+def build_index(files):
+    index = LexicalIndex()
+    for file_id, file_name, content in files:
+        if content.strip():
+            index.add_file(file_id, file_name, content)
+    return index
+
+
+def get_lexical_index(project_id):
+    project_id = int(project_id)
+    # Read before loading files, so an edit racing the build leaves the new
+    # index marked stale rather than current
+    version = get_content_version(project_id)
+    with _indexes_lock:
+        entry = _indexes.get(project_id)
+    if entry is not None and entry[0] == version:
+        return entry[1]
+
+    files = File.objects.filter(project_id=project_id).values_list('id', 'name', 'content').iterator()
+    index = build_index(files)
+    with _indexes_lock:
+        entry = _indexes.get(project_id)
+        if entry is None or entry[0] < version:
+            entry = _indexes[project_id] = (version, index)
+    return entry[1]
+
+
+def _current_index(project_id, version):
+    # The loaded index, if it saw every change before the one that produced
+    # `version`; anything else is left to be rebuilt on its next search
+    with _indexes_lock:
+        entry = _indexes.get(project_id)
+    return entry[1] if entry is not None and entry[0] == version - 1 else None
+
+
+def _mark_current(project_id, index, version):
+    with _indexes_lock:
+        entry = _indexes.get(project_id)
+        if entry is not None and entry[1] is index and entry[0] == version - 1:
+            _indexes[project_id] = (version, index)
+
+
+def update_file(project_id, file_id, content, file_name=None):
+    project_id = int(project_id)
+    version = bump_content_version(project_id)
+    index = _current_index(project_id, version)
+    if index is None:
+        return
+    file_name = file_name or index.file_name(file_id)
+    if file_name is None:
+        file_name = File.objects.filter(pk=file_id).values_list('name', flat=True).first()
+    if file_name is None or not content.strip():
+        index.remove_file(file_id)
+    else:
+        index.add_file(file_id, file_name, content)
+    _mark_current(project_id, index, version)
+
+
+def remove_file(project_id, file_id):
+    project_id = int(project_id)
+    version = bump_content_version(project_id)
+    index = _current_index(project_id, version)
+    if index is not None:
+        index.remove_file(file_id)
+        _mark_current(project_id, index, version)
+
+
+def drop_project(project_id):
+    bump_content_version(project_id)
+    with _indexes_lock:
+        _indexes.pop(int(project_id), None)
@@ -0,0 +1,60 @@
+import json
+import os
+import statistics
+import time
+import uuid
+from django.core.management.base import BaseCommand
+import api
+from api import framing
+
+
+class Command(BaseCommand):
+    help = "Compare per-recipient JSON encoding with shared JSON/MessagePack frames for one room broadcast."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--recipients', type=int, default=20)
+        parser.add_argument('--file-kb', type=int, default=64, help="Size of the file body in a code_update")
+        parser.add_argument('--rounds', type=int, default=200)
+
+    def handle(self, *args, **options):
+        body = self.source_text(options['file_kb'] * 1024)
+        payload = {'type': 'code_update', 'message': body, 'fileId': 42}
+        recipients = options['recipients']
+
+        def per_recipient():
+            return [json.dumps(payload) for _ in range(recipients)]
+
+        def shared(encoding):
+            def broadcast():
+                event = {'frame_id': uuid.uuid4().hex}
+                return [framing.frame_for(payload, encoding, event) for _ in range(recipients)]
+            return broadcast
+
+        self.stdout.write(f"{recipients} recipients, {options['file_kb']} KB file body, {options['rounds']} rounds")
+        self.report("json, encoded per recipient", per_recipient, options['rounds'])
+        self.report("json, shared frame", shared(framing.JSON), options['rounds'])
+        self.report("msgpack, shared frame", shared(framing.MSGPACK), options['rounds'])
+
+    def source_text(self, size):
+        # Real source text, so compression ratios are representative
+        root = os.path.dirname(api.__file__)
+        text = ''
+        for name in sorted(os.listdir(root)):
+            if name.endswith('.py'):
+                with open(os.path.join(root, name), encoding='utf-8') as handle:
+                    text += handle.read()
+        return (text * (size // max(len(text), 1) + 1))[:size]
+
+    def report(self, label, broadcast, rounds):
+        timings = []
+        for _ in range(rounds):
+            started = time.perf_counter()
+            frames = broadcast()
+            timings.append(time.perf_counter() - started)
+        frame = frames[0]
+        size = len(frame) if isinstance(frame, bytes) else len(frame.encode('utf-8'))
+        self.stdout.write(
+            f"{label:<30} frame={size / 1024:.1f} KB  "
+            f"cpu/broadcast p50={statistics.median(timings) * 1000:.3f} ms "
+            f"p95={statistics.quantiles(timings, n=20)[-1] * 1000:.3f} ms"
+        )
@@ -0,0 +1,117 @@
+import os
+import re
+import statistics
+import time
+from django.core.management.base import BaseCommand, CommandError
+from api.chunking import chunk_code
+from api.lexical import build_index
+from api.rag_service import reciprocal_rank_fusion
+
+CODE_EXTENSIONS = ('.py', '.js', '.jsx', '.ts', '.tsx', '.cpp', '.cc', '.h', '.hpp', '.java')
+DEFINITION_RE = re.compile(r'\b(?:def|class|function|interface|struct)\s+([A-Za-z_][A-Za-z0-9_]{3,})')
+MAX_FILE_BYTES = 200_000
+FIXTURE_REPO = os.path.join(os.path.dirname(__file__), '..', '..', 'fixtures', 'retrieval_repo')
+
+
+class Command(BaseCommand):
+    help = "Benchmark lexical, vector and hybrid retrieval recall/latency on a directory of source files."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', default=os.path.normpath(FIXTURE_REPO),
+                            help="Repository to index (default: the bundled fixture, see its README for recorded results)")
+        parser.add_argument('--k', type=int, default=5)
+        parser.add_argument('--queries', type=int, default=200)
+        parser.add_argument('--vector', action='store_true', help="Also embed chunks and compare vector/hybrid retrieval")
+
+    def handle(self, *args, **options):
+        files = self.load_files(options['path'])
+        if not files:
+            raise CommandError(f"No source files found under {options['path']}")
+
+        started = time.perf_counter()
+        index = build_index(files)
+        self.stdout.write(f"Indexed {len(files)} files ({len(index.chunks)} chunks) in {time.perf_counter() - started:.2f}s")
+
+        queries = self.build_queries(files, options['queries'])
+        if not queries:
+            raise CommandError(f"No definitions to query under {options['path']}")
+        k = options['k']
+
+        def lexical_search(query):
+            return [(chunk['file_id'], (chunk['file_id'], chunk['start_line'])) for _, chunk in index.search(query, k=k * 2)]
+
+        self.report("lexical", queries, k, lexical_search)
+
+        if options['vector']:
+            vector_search = self.build_vector_search(files, k)
+            self.report("vector", queries, k, vector_search)
+
+            def hybrid_search(query):
+                fused = reciprocal_rank_fusion([
+                    [(key, (file_id, key)) for file_id, key in lexical_search(query)],
+                    [(key, (file_id, key)) for file_id, key in vector_search(query)],
+                ], k=k)
+                return fused
+
+            self.report("hybrid", queries, k, hybrid_search)
+
+    def load_files(self, root):
+        files = []
+        for directory, dirnames, filenames in os.walk(root):
+            dirnames[:] = [name for name in dirnames if not name.startswith('.') and name not in ('node_modules', 'venv', '__pycache__')]
+            for filename in filenames:
+                path = os.path.join(directory, filename)
+                if not filename.endswith(CODE_EXTENSIONS) or os.path.getsize(path) > MAX_FILE_BYTES:
+                    continue
+                with open(path, encoding='utf-8', errors='ignore') as handle:
+                    files.append((os.path.relpath(path, root), filename, handle.read()))
+        return files
+
+    def build_queries(self, files, limit):
+        # Each defined identifier becomes a question whose answer is any file defining it
+        definitions = {}
+        for file_id, _, content in files:
+            for name in DEFINITION_RE.findall(content):
+                definitions.setdefault(name, set()).add(file_id)
+        names = sorted(definitions)[:limit]
+        return [(f"where is {name} implemented", definitions[name]) for name in names]
+
+    def build_vector_search(self, files, k):
+        import numpy as np
+        from api.rag_service import get_embeddings
+
+        embeddings = get_embeddings()
+        keys, texts = [], []
+        for file_id, file_name, content in files:
+            for chunk in chunk_code(content, file_name):
+                keys.append((file_id, (file_id, chunk['start_line'])))
+                texts.append(chunk['text'])
+
+        started = time.perf_counter()
+        vectors = np.asarray(embeddings.embed_documents(texts))
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True) + 1e-12
+        self.stdout.write(f"Embedded {len(texts)} chunks in {time.perf_counter() - started:.2f}s")
+
+        def search(query):
+            query_vector = np.asarray(embeddings.embed_query(query))
+            scores = vectors @ (query_vector / (np.linalg.norm(query_vector) + 1e-12))
+            return [keys[i] for i in np.argsort(-scores)[:k * 2]]
+
+        return search
+
+    def report(self, label, queries, k, search):
+        hits = 0
+        latencies = []
+        for query, expected_files in queries:
+            started = time.perf_counter()
+            results = search(query)
+            latencies.append((time.perf_counter() - started) * 1000)
+            if any(file_id in expected_files for file_id, _ in results[:k]):
+                hits += 1
+
+        latencies.sort()
+        p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+        self.stdout.write(
+            f"{label:>8}: recall@{k} {hits / len(queries):.3f} over {len(queries)} queries, "
+            f"latency p50 {statistics.median(latencies):.2f}ms p95 {p95:.2f}ms"
+        )
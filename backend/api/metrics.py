@@ -0,0 +1,42 @@
+import threading
+import time
+from contextlib import contextmanager
+
+# Lightweight in-process metrics: counters, gauges and timing summaries.
+# Values are per worker process and reset on restart.
+
+_lock = threading.Lock()
+_counters = {}
+_timings = {}
+_gauges = {}
+
+def incr(name, value=1):
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+def gauge(name, value):
+    with _lock:
+        _gauges[name] = value
+
+def observe(name, seconds):
+    with _lock:
+        timing = _timings.setdefault(name, {'count': 0, 'total': 0.0, 'max': 0.0, 'last': 0.0})
+        timing['count'] += 1
+        timing['total'] += seconds
+        timing['max'] = max(timing['max'], seconds)
+        timing['last'] = seconds
+
+@contextmanager
+def timer(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start)
+
+def snapshot():
+    with _lock:
+        timings = {}
+        for name, timing in _timings.items():
+            timings[name] = dict(timing, avg=timing['total'] / timing['count'])
+        return {'counters': dict(_counters), 'gauges': dict(_gauges), 'timings': timings}
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.6 on 2026-10-17 23:09
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_alter_chatmessage_timestamp'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='chatmessage',
+            index=models.Index(fields=['project', 'timestamp', 'id'], name='chat_project_timestamp_idx'),
+        ),
+    ]
@@ -1,5 +1,6 @@
 from django.db import models
 from django.contrib.auth.models import User
+from django.utils import timezone
 import uuid
 
 class Project(models.Model):
@@ -38,13 +39,16 @@ class ChatMessage(models.Model):
     project = models.ForeignKey(Project, on_delete=models.CASCADE, related_name='messages')
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     message = models.TextField()
-    timestamp = models.DateTimeField(auto_now_add=True)
+    # Set when the message arrives, not when the buffered write lands
+    timestamp = models.DateTimeField(default=timezone.now)
 
     def __str__(self):
         return f'{self.user.username}: {self.message[:20]}'
 
     class Meta:
         ordering = ['timestamp']
+        # History pages are keyset scans of one project's chat in (timestamp, id) order
+        indexes = [models.Index(fields=['project', 'timestamp', 'id'], name='chat_project_timestamp_idx')]
 
 class Folder(models.Model):
     name = models.CharField(max_length=255)
@@ -0,0 +1,156 @@
+from collections import deque
+
+# Operational transform for plain-text edits exchanged over the project socket.
+# An edit is a list of ops applied in order, each op being either
+#   {'type': 'insert', 'pos': int, 'text': str}
+#   {'type': 'delete', 'pos': int, 'length': int}
+# Positions are character offsets into the document as it stands after the
+# previous op in the same list has been applied.
+
+HISTORY_LIMIT = 500
+
+
+class StaleRevision(Exception):
+    pass
+
+
+def normalize_ops(raw_ops):
+    if not isinstance(raw_ops, list):
+        raise ValueError("ops must be a list")
+
+    ops = []
+    for raw in raw_ops:
+        if not isinstance(raw, dict):
+            raise ValueError("op must be an object")
+        pos = raw.get('pos')
+        if not isinstance(pos, int) or isinstance(pos, bool) or pos < 0:
+            raise ValueError("op position must be a non-negative integer")
+
+        if raw.get('type') == 'insert':
+            text = raw.get('text')
+            if not isinstance(text, str):
+                raise ValueError("insert text must be a string")
+            if text:
+                ops.append({'type': 'insert', 'pos': pos, 'text': text})
+        elif raw.get('type') == 'delete':
+            length = raw.get('length')
+            if not isinstance(length, int) or isinstance(length, bool) or length < 0:
+                raise ValueError("delete length must be a non-negative integer")
+            if length:
+                ops.append({'type': 'delete', 'pos': pos, 'length': length})
+        else:
+            raise ValueError(f"unknown op type: {raw.get('type')}")
+    return ops
+
+
+def apply_ops(text, ops):
+    for op in ops:
+        if op['type'] == 'insert':
+            if op['pos'] > len(text):
+                raise ValueError("insert position is past the end of the document")
+            text = text[:op['pos']] + op['text'] + text[op['pos']:]
+        else:
+            if op['pos'] + op['length'] > len(text):
+                raise ValueError("delete range is past the end of the document")
+            text = text[:op['pos']] + text[op['pos'] + op['length']:]
+    return text
+
+
+def _insert(pos, text):
+    return {'type': 'insert', 'pos': pos, 'text': text}
+
+
+def _delete(pos, length):
+    return [{'type': 'delete', 'pos': pos, 'length': length}] if length > 0 else []
+
+
+def _transform_op(op, other, op_wins_tie):
+    # Rewrite `op` so it can be applied after `other`. May split a delete in two.
+    if op['type'] == 'insert':
+        if other['type'] == 'insert':
+            if op['pos'] < other['pos'] or (op['pos'] == other['pos'] and op_wins_tie):
+                return [op]
+            return [_insert(op['pos'] + len(other['text']), op['text'])]
+
+        del_start, del_end = other['pos'], other['pos'] + other['length']
+        if op['pos'] <= del_start:
+            return [op]
+        if op['pos'] >= del_end:
+            return [_insert(op['pos'] - other['length'], op['text'])]
+        return [_insert(del_start, op['text'])]
+
+    start, end = op['pos'], op['pos'] + op['length']
+    if other['type'] == 'insert':
+        ins_pos, ins_len = other['pos'], len(other['text'])
+        if ins_pos <= start:
+            return _delete(start + ins_len, op['length'])
+        if ins_pos >= end:
+            return [op]
+        head = ins_pos - start
+        return _delete(start, head) + _delete(start + ins_len, op['length'] - head)
+
+    other_start, other_end = other['pos'], other['pos'] + other['length']
+    if end <= other_start:
+        return [op]
+    if start >= other_end:
+        return _delete(start - other['length'], op['length'])
+    overlap = min(end, other_end) - max(start, other_start)
+    return _delete(min(start, other_start), op['length'] - overlap)
+
+
+def diff_ops(old, new):
+    """Ops turning `old` into `new`: one delete and one insert between the common prefix and suffix."""
+    limit = min(len(old), len(new))
+    prefix = 0
+    while prefix < limit and old[prefix] == new[prefix]:
+        prefix += 1
+    suffix = 0
+    while suffix < limit - prefix and old[len(old) - 1 - suffix] == new[len(new) - 1 - suffix]:
+        suffix += 1
+
+    ops = _delete(prefix, len(old) - prefix - suffix)
+    inserted = new[prefix:len(new) - suffix]
+    if inserted:
+        ops.append(_insert(prefix, inserted))
+    return ops
+
+
+def transform(ops, against, ops_win_ties=False):
+    """Transform two concurrent op lists; returns (ops', against')."""
+    if not ops or not against:
+        return ops, against
+
+    if len(ops) == 1 and len(against) == 1:
+        return (
+            _transform_op(ops[0], against[0], ops_win_ties),
+            _transform_op(against[0], ops[0], not ops_win_ties),
+        )
+
+    if len(ops) > 1:
+        head, against = transform(ops[:1], against, ops_win_ties)
+        tail, against = transform(ops[1:], against, ops_win_ties)
+        return head + tail, against
+
+    ops, head = transform(ops, against[:1], ops_win_ties)
+    ops, tail = transform(ops, against[1:], ops_win_ties)
+    return ops, head + tail
+
+
+class DocumentLog:
+    def __init__(self, revision=0):
+        self.revision = revision
+        self.history = deque(maxlen=HISTORY_LIMIT)
+
+    def rebase(self, base_revision, ops):
+        behind = self.revision - base_revision
+        if behind < 0 or behind > len(self.history):
+            raise StaleRevision(f"revision {base_revision} is not available")
+
+        for applied in list(self.history)[len(self.history) - behind:]:
+            ops, _ = transform(ops, applied)
+        return ops
+
+    def commit(self, ops):
+        self.revision += 1
+        self.history.append(ops)
+        return self.revision
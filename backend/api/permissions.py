@@ -1,5 +1,43 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import OuterRef, Subquery
 from rest_framework import permissions
-from .models import Membership
+from .models import Membership, Project
+
+OWNER_ROLE = 'OWNER'
+EDIT_ROLES = [OWNER_ROLE, Membership.Role.ADMIN, Membership.Role.EDITOR]
+ROLE_CACHE_TIMEOUT = getattr(settings, 'PROJECT_ROLE_CACHE_TIMEOUT', 300)
+
+def role_cache_key(project_id, user_id):
+    return f'project_role:{int(project_id)}:{int(user_id)}'
+
+def get_project_role(project_id, user_id):
+    key = role_cache_key(project_id, user_id)
+    role = cache.get(key)
+    if role is None:
+        member_role = Membership.objects.filter(
+            project=OuterRef('pk'),
+            user_id=user_id,
+            status=Membership.Status.APPROVED
+        ).values('role')[:1]
+        row = Project.objects.filter(pk=project_id).annotate(
+            member_role=Subquery(member_role)
+        ).values_list('owner_id', 'member_role').first()
+
+        if row is None:
+            role = ''
+        elif row[0] == int(user_id):
+            role = OWNER_ROLE
+        else:
+            role = row[1] or ''
+        cache.set(key, role, ROLE_CACHE_TIMEOUT)
+    return role or None
+
+def can_edit_project(project_id, user_id):
+    return get_project_role(project_id, user_id) in EDIT_ROLES
+
+def invalidate_project_role(project_id, user_id):
+    cache.delete(role_cache_key(project_id, user_id))
 
 class IsProjectOwner(permissions.BasePermission):
     def has_object_permission(self, request, view, obj):
@@ -7,20 +45,11 @@ class IsProjectOwner(permissions.BasePermission):
 
 class IsEditorOrOwner(permissions.BasePermission):
     def has_object_permission(self, request, view, obj):
-        if obj.project.owner == request.user:
-            return True
+        role = get_project_role(obj.project_id, request.user.id)
+        if role is None:
+            return False
 
-        try:
-            membership = Membership.objects.get(
-                project=obj.project,
-                user=request.user,
-                status=Membership.Status.APPROVED
-            )
-            
-            if request.method in permissions.SAFE_METHODS:
-                return True
-
-            return membership.role in [Membership.Role.ADMIN, Membership.Role.EDITOR]
+        if request.method in permissions.SAFE_METHODS:
+            return True
 
-        except Membership.DoesNotExist:
-            return False
\ No newline at end of file
+        return role in EDIT_ROLES
@@ -0,0 +1,137 @@
+import asyncio
+import time
+import weakref
+from channels.layers import get_channel_layer
+from django.conf import settings
+from .framing import shared_event
+
+# Who is connected to each project room, shared by every WebSocket worker.
+# Presence is tracked per connection (channel name) rather than per user, so a
+# user stays online until their last tab closes. Every connection refreshes a
+# heartbeat; connections whose worker died without a clean disconnect drop
+# out once their heartbeat is older than PRESENCE_TTL_SECONDS.
+
+HEARTBEAT_SECONDS = getattr(settings, 'PRESENCE_HEARTBEAT_SECONDS', 30)
+CONNECTION_TTL = getattr(settings, 'PRESENCE_TTL_SECONDS', 90)
+BROADCAST_INTERVAL = getattr(settings, 'PRESENCE_BROADCAST_INTERVAL_MS', 250) / 1000
+
+class RedisPresence:
+    # presence:<room>:users  hash  channel name -> user id
+    # presence:<room>:seen   zset  channel name -> last heartbeat (unix time)
+    def __init__(self, url):
+        self.url = url
+        # redis.asyncio connections belong to the event loop that opened them
+        self.clients = weakref.WeakKeyDictionary()
+
+    def client(self):
+        from redis import asyncio as aioredis
+
+        loop = asyncio.get_running_loop()
+        client = self.clients.get(loop)
+        if client is None:
+            client = aioredis.from_url(self.url, decode_responses=True)
+            self.clients[loop] = client
+        return client
+
+    def keys(self, room):
+        return f'presence:{room}:users', f'presence:{room}:seen'
+
+    async def add(self, room, channel_name, user_id):
+        users_key, seen_key = self.keys(room)
+        async with self.client().pipeline(transaction=True) as pipe:
+            pipe.hset(users_key, channel_name, user_id)
+            pipe.zadd(seen_key, {channel_name: time.time()})
+            pipe.expire(users_key, CONNECTION_TTL)
+            pipe.expire(seen_key, CONNECTION_TTL)
+            await pipe.execute()
+
+    async def heartbeat(self, room, channel_name):
+        users_key, seen_key = self.keys(room)
+        async with self.client().pipeline(transaction=True) as pipe:
+            pipe.zadd(seen_key, {channel_name: time.time()}, xx=True)
+            pipe.expire(users_key, CONNECTION_TTL)
+            pipe.expire(seen_key, CONNECTION_TTL)
+            await pipe.execute()
+
+    async def remove(self, room, channel_name):
+        users_key, seen_key = self.keys(room)
+        async with self.client().pipeline(transaction=True) as pipe:
+            pipe.hdel(users_key, channel_name)
+            pipe.zrem(seen_key, channel_name)
+            await pipe.execute()
+
+    async def active_user_ids(self, room):
+        users_key, seen_key = self.keys(room)
+        client = self.client()
+        stale = await client.zrangebyscore(seen_key, '-inf', time.time() - CONNECTION_TTL)
+        if stale:
+            async with client.pipeline(transaction=True) as pipe:
+                pipe.hdel(users_key, *stale)
+                pipe.zrem(seen_key, *stale)
+                await pipe.execute()
+        return sorted({int(user_id) for user_id in await client.hvals(users_key)})
+
+class MemoryPresence:
+    # Single-process stand-in used when no Redis URL is configured (tests)
+    def __init__(self):
+        self.rooms = {}
+
+    async def add(self, room, channel_name, user_id):
+        self.rooms.setdefault(room, {})[channel_name] = [user_id, time.time()]
+
+    async def heartbeat(self, room, channel_name):
+        connection = self.rooms.get(room, {}).get(channel_name)
+        if connection:
+            connection[1] = time.time()
+
+    async def remove(self, room, channel_name):
+        connections = self.rooms.get(room, {})
+        connections.pop(channel_name, None)
+        if not connections:
+            self.rooms.pop(room, None)
+
+    async def active_user_ids(self, room):
+        cutoff = time.time() - CONNECTION_TTL
+        connections = self.rooms.get(room, {})
+        for channel_name in [name for name, (_, seen) in connections.items() if seen < cutoff]:
+            del connections[channel_name]
+        return sorted({user_id for user_id, _ in connections.values()})
+
+_backends = {}
+
+def get_presence():
+    url = getattr(settings, 'PRESENCE_REDIS_URL', None)
+    backend = _backends.get(url)
+    if backend is None:
+        backend = _backends.setdefault(url, RedisPresence(url) if url else MemoryPresence())
+    return backend
+
+# room -> user ids whose connections changed since the room's last flush.
+# Changes are coalesced for BROADCAST_INTERVAL and sent to the room as one
+# presence_delta, so a burst of n joins costs one fan-out instead of n.
+_pending_changes = {}
+
+def schedule_presence_delta(room, user_id):
+    pending = _pending_changes.get(room)
+    if pending is None:
+        pending = _pending_changes[room] = set()
+        asyncio.get_running_loop().call_later(
+            BROADCAST_INTERVAL, lambda: asyncio.ensure_future(flush_presence_delta(room))
+        )
+    pending.add(user_id)
+
+async def flush_presence_delta(room):
+    changed = _pending_changes.pop(room, set())
+    if not changed:
+        return
+    try:
+        # Judged against shared presence, so a user who closed one of two tabs
+        # is not reported as leaving
+        active = set(await get_presence().active_user_ids(room))
+        await get_channel_layer().group_send(room, shared_event({
+            'type': 'presence_delta',
+            'joined': sorted(changed & active),
+            'left': sorted(changed - active),
+        }))
+    except Exception as e:
+        print(f"Presence broadcast failed for {room}: {e}")
@@ -1,78 +1,262 @@
 import os
+import hashlib
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import chromadb
+from chromadb.errors import NotFoundError
+from cachetools import LRUCache, TTLCache
 from django.conf import settings
+from django.core.cache import cache
 from .models import File, Project
+from .tree_cache import get_project_outline
+from .lexical import get_content_version, get_lexical_index
+from .chunking import CHUNKING_VERSION, chunk_code
+from . import metrics
 from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain_community.embeddings import HuggingFaceEmbeddings 
 from langchain_community.vectorstores import Chroma
-from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.documents import Document
-from langchain_core.runnables import RunnablePassthrough
 from langchain_core.output_parsers import StrOutputParser
 
 PERSIST_DIRECTORY = os.path.join(settings.BASE_DIR, 'chroma_db')
+EMBED_BATCH_SIZE = getattr(settings, 'RAG_EMBED_BATCH_SIZE', 64)
+EMBED_WORKERS = getattr(settings, 'RAG_EMBED_WORKERS', 2)
+FILE_PAGE_SIZE = getattr(settings, 'RAG_FILE_PAGE_SIZE', 100)
+RETRIEVAL_CANDIDATES = getattr(settings, 'RAG_RETRIEVAL_CANDIDATES', 10)
+VECTORSTORE_HANDLES = getattr(settings, 'RAG_VECTORSTORE_HANDLES', 32)
+ANSWER_CACHE_SIZE = getattr(settings, 'AI_ANSWER_CACHE_SIZE', 512)
+ANSWER_CACHE_TTL = getattr(settings, 'AI_ANSWER_CACHE_TTL', 3600)
+ANSWER_CACHE_SIMILARITY = getattr(settings, 'AI_ANSWER_CACHE_SIMILARITY', 0.95)
+
+# (project_id, version, normalized_query) -> (answer, query_embedding), where
+# version pairs the vector index version with the lexical content version, so
+# both reindexing and file edits make a project's old entries unreachable;
+# they age out through the TTL/LRU eviction.
+_answer_cache = TTLCache(maxsize=ANSWER_CACHE_SIZE, ttl=ANSWER_CACHE_TTL)
+_answer_cache_lock = threading.Lock()
+
+# Loaded once per process and shared by every request and indexing job
+_embeddings = None
+_chroma_client = None
+_embed_executor = None
+_embeddings_lock = threading.Lock()
+_vectorstore_lock = threading.Lock()
+
+# Each project has its own Chroma collection; recently used handles stay open
+_vectorstores = LRUCache(maxsize=VECTORSTORE_HANDLES)
 
 def get_embeddings():
-    return HuggingFaceEmbeddings(model_name="all-MiniLM-L6-v2")
+    global _embeddings
+    if _embeddings is None:
+        with _embeddings_lock:
+            if _embeddings is None:
+                start = time.perf_counter()
+                _embeddings = HuggingFaceEmbeddings(model_name="all-MiniLM-L6-v2")
+                elapsed = time.perf_counter() - start
+                metrics.observe('rag.embedding_model_load_seconds', elapsed)
+                print(f"RAG: Loaded embedding model in {elapsed:.2f}s")
+    return _embeddings
 
-def get_vectorstore():
-    embeddings = get_embeddings()
-    return Chroma(
-        persist_directory=PERSIST_DIRECTORY, 
-        embedding_function=embeddings
-    )
+def get_chroma_client():
+    global _chroma_client
+    if _chroma_client is None:
+        with _vectorstore_lock:
+            if _chroma_client is None:
+                _chroma_client = chromadb.PersistentClient(path=PERSIST_DIRECTORY)
+    return _chroma_client
 
-def index_project(project_id):
-    print(f"RAG: Starting indexing for Project {project_id}...")
-    
+def collection_name(project_id):
+    return f"project_{int(project_id)}"
+
+def get_vectorstore(project_id, create=True):
+    # Queries pass create=False: a project that was never indexed has no
+    # collection and gets None back rather than an empty one made for it.
+    name = collection_name(project_id)
+    with _vectorstore_lock:
+        vectorstore = _vectorstores.get(name)
+    if vectorstore is None:
+        if not create:
+            try:
+                get_chroma_client().get_collection(name)
+            except NotFoundError:
+                return None
+        vectorstore = Chroma(
+            client=get_chroma_client(),
+            collection_name=name,
+            embedding_function=get_embeddings()
+        )
+        with _vectorstore_lock:
+            vectorstore = _vectorstores.setdefault(name, vectorstore)
+    return vectorstore
+
+def drop_project_index(project_id):
+    name = collection_name(project_id)
+    with _vectorstore_lock:
+        _vectorstores.pop(name, None)
     try:
-        try:
-            project = Project.objects.get(id=project_id)
-            files = File.objects.filter(project=project)
-        except Project.DoesNotExist:
-            return False, "Project not found."
+        get_chroma_client().delete_collection(name)
+        print(f"RAG: Dropped vector collection for Project {project_id}.")
+    except Exception as e:
+        # Projects that were never indexed have no collection
+        print(f"RAG: No vector collection dropped for Project {project_id}: {str(e)}")
+
+def warm_up():
+    try:
+        get_chroma_client()
+        get_embeddings().embed_query("warm up")
+        print("RAG: Warm-up complete.")
+    except Exception as e:
+        print(f"RAG Warm-up Error: {str(e)}")
+
+def content_hash(content):
+    # Includes the chunker version so a rule change re-chunks every file
+    return hashlib.sha256(f"{CHUNKING_VERSION}:{content}".encode('utf-8')).hexdigest()
+
+def get_indexed_files(vectorstore):
+    # file_id -> {"hash": ..., "ids": [...]} for chunks already in the store
+    existing = vectorstore.get(include=["metadatas"])
+    indexed = {}
+    for chunk_id, metadata in zip(existing["ids"], existing["metadatas"]):
+        entry = indexed.setdefault(metadata.get("file_id"), {"hash": None, "ids": []})
+        entry["hash"] = metadata.get("content_hash")
+        entry["ids"].append(chunk_id)
+    return indexed
+
+def get_embed_executor():
+    global _embed_executor
+    if _embed_executor is None:
+        with _embeddings_lock:
+            if _embed_executor is None:
+                _embed_executor = ThreadPoolExecutor(max_workers=EMBED_WORKERS, thread_name_prefix='rag-embed')
+    return _embed_executor
+
+def iter_changed_batches(files, indexed, project_id, stats):
+    # Yields (chunks, stale_ids, files_seen) for batches of changed files.
+    # Batches end on file boundaries so a cancelled run never leaves a file
+    # half-indexed under its new hash.
+    chunks, stale_ids, files_seen = [], [], 0
+    for file in files:
+        files_seen += 1
+        file_id = str(file.id)
+        previous = indexed.pop(file_id, None)
+        if not file.content.strip():
+            if previous:
+                stale_ids.extend(previous["ids"])
+            continue
+
+        file_hash = content_hash(file.content)
+        if previous and previous["hash"] == file_hash:
+            stats["unchanged"] += 1
+            continue
+        if previous:
+            stale_ids.extend(previous["ids"])
 
-        if not files.exists():
-            return True, "No files to index."
-
-        documents = []
-        for file in files:
-            if not file.content.strip():
-                continue 
-            
-            ext = file.name.split('.')[-1] if '.' in file.name else "text"
-            
-            doc = Document(
-                page_content=file.content,
+        ext = file.name.split('.')[-1] if '.' in file.name else "text"
+        for chunk in chunk_code(file.content, file.name):
+            chunks.append(Document(
+                page_content=chunk['text'],
                 metadata={
                     "project_id": str(project_id),
-                    "file_id": str(file.id),
+                    "file_id": file_id,
                     "file_name": file.name,
-                    "language": ext
+                    "language": chunk['language'] or ext,
+                    "start_line": chunk['start_line'],
+                    "end_line": chunk['end_line'],
+                    "content_hash": file_hash
                 }
+            ))
+        stats["changed"] += 1
+
+        if len(chunks) >= EMBED_BATCH_SIZE:
+            yield chunks, stale_ids, files_seen
+            chunks, stale_ids = [], []
+
+    if chunks or stale_ids or files_seen:
+        yield chunks, stale_ids, files_seen
+
+def index_project(project_id, progress_callback=None, should_cancel=None):
+    print(f"RAG: Starting indexing for Project {project_id}...")
+
+    def report(percent):
+        if progress_callback:
+            progress_callback(percent)
+
+    def cancelled():
+        return bool(should_cancel and should_cancel())
+    
+    try:
+        if not Project.objects.filter(id=project_id).exists():
+            return False, "Project not found."
+
+        started = time.perf_counter()
+        vectorstore = get_vectorstore(project_id)
+        executor = get_embed_executor()
+        indexed = get_indexed_files(vectorstore)
+
+        project_files = File.objects.filter(project_id=project_id)
+        total_files = max(project_files.count(), 1)
+        files = project_files.only('id', 'name', 'content').order_by('id').iterator(chunk_size=FILE_PAGE_SIZE)
+
+        stats = {"changed": 0, "unchanged": 0, "chunks": 0}
+
+        def embed_and_add(chunks):
+            # Runs on the embed pool; add_texts embeds the batch itself
+            return vectorstore.add_texts(
+                [chunk.page_content for chunk in chunks],
+                metadatas=[chunk.metadata for chunk in chunks],
+                ids=[str(uuid.uuid4()) for _ in chunks]
             )
-            documents.append(doc)
 
-        if not documents:
-            return True, "No content to index."
+        def finish_batch(future, chunks, files_seen):
+            future.result()
+            stats["chunks"] += len(chunks)
+            bump_index_version(project_id)
+            report(int(100 * files_seen / total_files))
 
-        text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=1000,
-            chunk_overlap=200,
-            separators=["\n\n", "\n", " ", ""]
-        )
-        splits = text_splitter.split_documents(documents)
+        # At most EMBED_WORKERS * 2 batches are held in memory at once
+        in_flight = deque()
+        for chunks, stale_ids, files_seen in iter_changed_batches(files, indexed, project_id, stats):
+            if cancelled():
+                for future, _, _ in in_flight:
+                    future.cancel()
+                print(f"RAG: Indexing cancelled for Project {project_id}.")
+                return False, "Indexing cancelled."
 
-        vectorstore = get_vectorstore()
-        vectorstore.add_documents(documents=splits)
-        
-        try:
-            vectorstore.persist() 
-        except AttributeError:
-            pass 
+            if stale_ids:
+                vectorstore.delete(ids=stale_ids)
+                bump_index_version(project_id)
+            if not chunks:
+                report(int(100 * files_seen / total_files))
+                continue
+
+            future = executor.submit(embed_and_add, chunks)
+            in_flight.append((future, chunks, files_seen))
+            while len(in_flight) >= EMBED_WORKERS * 2:
+                finish_batch(*in_flight.popleft())
+
+        while in_flight:
+            finish_batch(*in_flight.popleft())
+
+        # Whatever is left belongs to files that no longer exist
+        stale_ids = [chunk_id for removed in indexed.values() for chunk_id in removed["ids"]]
+        if stale_ids:
+            vectorstore.delete(ids=stale_ids)
+            bump_index_version(project_id)
+
+        # The persistent client writes through; there is nothing to persist()
+        elapsed = time.perf_counter() - started
+        throughput = stats["chunks"] / elapsed if elapsed else 0.0
+        metrics.observe('rag.index_seconds', elapsed)
+        metrics.incr('rag.chunks_embedded', stats["chunks"])
+        metrics.gauge('rag.index_chunks_per_second', throughput)
         
-        print(f"RAG: Successfully indexed {len(splits)} chunks for Project {project_id}.")
-        return True, f"Indexed {len(files)} files."
+        print(f"RAG: Indexed {stats['chunks']} chunks for Project {project_id} in {elapsed:.2f}s ({throughput:.1f} chunks/s; {stats['changed']} changed, {stats['unchanged']} unchanged, {len(indexed)} removed files).")
+        return True, f"Indexed {stats['changed']} changed files ({stats['unchanged']} unchanged, {len(indexed)} removed)."
         
     except Exception as e:
         print(f"RAG Indexing Error: {str(e)}")
@@ -82,66 +266,196 @@ def format_docs(docs):
     formatted_docs = []
     for doc in docs:
         filename = doc.metadata.get("file_name", "Unknown File")
+        if doc.metadata.get("start_line"):
+            filename = f"{filename}:{doc.metadata['start_line']}-{doc.metadata['end_line']}"
         entry = f"File: {filename}\nCode Content:\n{doc.page_content}\n------------------------"
         formatted_docs.append(entry)
     return "\n\n".join(formatted_docs)
 
-def chat_with_project(project_id, user_query):
+def normalize_query(user_query):
+    return " ".join(user_query.lower().split()).rstrip("?.! ")
+
+def get_index_version(project_id):
+    key = f'rag_index_version:{int(project_id)}'
+    version = cache.get(key)
+    if version is None:
+        # Seeded from the clock so a version lost to eviction is never reused
+        cache.add(key, int(time.time() * 1000), timeout=None)
+        version = cache.get(key)
+    return version
+
+def bump_index_version(project_id):
+    get_index_version(project_id)
     try:
-        vectorstore = get_vectorstore()
-        
-        try:
-            project = Project.objects.get(id=project_id)
-            files = File.objects.filter(project=project)
-            file_list = ", ".join([f.name for f in files])
-            project_context = f"Project Name: {project.name}\nFiles in Project: {file_list}"
-        except Project.DoesNotExist:
-            project_context = "Project structure unknown."
-
-        retriever = vectorstore.as_retriever(
-            search_kwargs={
-                "k": 5, 
-                "filter": {"project_id": str(project_id)} 
-            }
-        )
+        return cache.incr(f'rag_index_version:{int(project_id)}')
+    except ValueError:
+        return get_index_version(project_id)
 
-        llm = ChatGoogleGenerativeAI(
-            model="gemini-2.0-flash-lite", 
-            google_api_key=settings.GOOGLE_API_KEY,
-            temperature=0.3
-        )
+def find_cached_answer(project_id, version, normalized_query):
+    with _answer_cache_lock:
+        entry = _answer_cache.get((int(project_id), version, normalized_query))
+    if entry is None:
+        return None
+    metrics.incr('ai.answer_cache_hits')
+    return entry[0]
 
-        template = """You are an expert AI coding assistant named CodeLive AI.
-        
-        Project Overview:
-        {project_context}
-        
-        Use the retrieved code snippets below to answer specific questions about implementation.
-        If the answer is not in the context, say you don't know.
-        
-        Code Context:
-        {context}
-        
-        Question: {question}
-        
-        Answer:"""
-        
-        prompt = ChatPromptTemplate.from_template(template)
+def find_similar_answer(project_id, version, query_embedding):
+    with _answer_cache_lock:
+        candidates = [
+            value for key, value in _answer_cache.items()
+            if key[0] == int(project_id) and key[1] == version
+        ]
+    if not candidates:
+        return None
+
+    query_vector = np.asarray(query_embedding)
+    vectors = np.asarray([embedding for _, embedding in candidates])
+    similarities = vectors @ query_vector / (np.linalg.norm(vectors, axis=1) * np.linalg.norm(query_vector) + 1e-12)
+    best = int(np.argmax(similarities))
+    if similarities[best] < ANSWER_CACHE_SIMILARITY:
+        return None
+    metrics.incr('ai.answer_cache_semantic_hits')
+    return candidates[best][0]
+
+def store_answer(project_id, version, normalized_query, query_embedding, answer):
+    with _answer_cache_lock:
+        _answer_cache[(int(project_id), version, normalized_query)] = (answer, query_embedding)
+
+def lookup_answer(project_id, user_query):
+    # Returns (answer, None) on a cache hit, otherwise (None, pending) where
+    # pending carries what is needed to answer and then cache the result.
+    version = (get_index_version(project_id), get_content_version(project_id))
+    normalized_query = normalize_query(user_query)
+    answer = find_cached_answer(project_id, version, normalized_query)
+    if answer is not None:
+        return answer, None
+
+    query_embedding = get_embeddings().embed_query(user_query)
+    answer = find_similar_answer(project_id, version, query_embedding)
+    if answer is not None:
+        return answer, None
+
+    metrics.incr('ai.answer_cache_misses')
+    return None, (version, normalized_query, query_embedding)
+
+def get_project_context(project_id):
+    return get_project_outline(project_id) or "Project structure unknown."
 
-        rag_chain = (
-            {
-                "context": retriever | format_docs, 
-                "question": RunnablePassthrough(),
-                "project_context": lambda x: project_context 
+def reciprocal_rank_fusion(ranked_lists, k=5, constant=60):
+    # ranked_lists: lists of (key, doc) in rank order; keys identify the same chunk
+    scores = {}
+    docs = {}
+    for ranked in ranked_lists:
+        for rank, (key, doc) in enumerate(ranked, start=1):
+            scores[key] = scores.get(key, 0.0) + 1.0 / (constant + rank)
+            docs.setdefault(key, doc)
+    return [docs[key] for key in sorted(scores, key=scores.get, reverse=True)[:k]]
+
+def fusion_key(doc):
+    # Both indexes chunk with chunk_code, so a line range identifies a chunk;
+    # chunks indexed before line metadata existed fall back to their text.
+    start_line = doc.metadata.get("start_line")
+    return (doc.metadata.get("file_id"), start_line or doc.page_content)
+
+def retrieve_documents(project_id, user_query, query_embedding, k=5):
+    with metrics.timer('rag.vector_search_seconds'):
+        vectorstore = get_vectorstore(project_id, create=False)
+        vector_docs = vectorstore.similarity_search_by_vector(query_embedding, k=RETRIEVAL_CANDIDATES) if vectorstore else []
+    with metrics.timer('rag.lexical_search_seconds'):
+        lexical_hits = get_lexical_index(project_id).search(user_query, k=RETRIEVAL_CANDIDATES)
+
+    lexical_docs = [
+        Document(
+            page_content=chunk['text'],
+            metadata={
+                "file_id": str(chunk['file_id']),
+                "file_name": chunk['file_name'],
+                "start_line": chunk['start_line'],
+                "end_line": chunk['end_line'],
             }
-            | prompt
-            | llm
-            | StrOutputParser()
         )
+        for _, chunk in lexical_hits
+    ]
+    return reciprocal_rank_fusion([
+        [(fusion_key(doc), doc) for doc in vector_docs],
+        [(fusion_key(doc), doc) for doc in lexical_docs],
+    ], k=k)
+
+def build_chain_inputs(project_id, user_query, query_embedding):
+    docs = retrieve_documents(project_id, user_query, query_embedding)
+    return {
+        "context": format_docs(docs),
+        "question": user_query,
+        "project_context": get_project_context(project_id)
+    }
+
+def build_rag_chain():
+    llm = ChatGoogleGenerativeAI(
+        model="gemini-2.0-flash-lite", 
+        google_api_key=settings.GOOGLE_API_KEY,
+        temperature=0.3
+    )
+
+    template = """You are an expert AI coding assistant named CodeLive AI.
+    
+    Project Overview:
+    {project_context}
+    
+    Use the retrieved code snippets below to answer specific questions about implementation.
+    Each snippet is labelled with its file and line range; cite code as file:line.
+    If the answer is not in the context, say you don't know.
+    
+    Code Context:
+    {context}
+    
+    Question: {question}
+    
+    Answer:"""
+    
+    prompt = ChatPromptTemplate.from_template(template)
+
+    return prompt | llm | StrOutputParser()
 
-        answer = rag_chain.invoke(user_query)
+def chat_with_project(project_id, user_query):
+    started = time.perf_counter()
+    try:
+        answer, pending = lookup_answer(project_id, user_query)
+        if pending:
+            version, normalized_query, query_embedding = pending
+            answer = build_rag_chain().invoke(build_chain_inputs(project_id, user_query, query_embedding))
+            store_answer(project_id, version, normalized_query, query_embedding, answer)
         return answer
 
     except Exception as e:
         print(f"AI Error: {str(e)}")
-        return f"I apologize, but I am having trouble connecting to the AI model right now. (Error: {str(e)})"
\ No newline at end of file
+        return f"I apologize, but I am having trouble connecting to the AI model right now. (Error: {str(e)})"
+    finally:
+        metrics.observe('ai.chat_total_seconds', time.perf_counter() - started)
+
+def stream_chat_with_project(project_id, user_query):
+    started = time.perf_counter()
+    time_to_first_token = None
+    try:
+        answer, pending = lookup_answer(project_id, user_query)
+        if pending:
+            version, normalized_query, query_embedding = pending
+            inputs = build_chain_inputs(project_id, user_query, query_embedding)
+            chunks = []
+            for chunk in build_rag_chain().stream(inputs):
+                if not chunk:
+                    continue
+                if time_to_first_token is None:
+                    time_to_first_token = time.perf_counter() - started
+                    metrics.observe('ai.chat_time_to_first_token_seconds', time_to_first_token)
+                chunks.append(chunk)
+                yield chunk
+            store_answer(project_id, version, normalized_query, query_embedding, "".join(chunks))
+        else:
+            time_to_first_token = time.perf_counter() - started
+            metrics.observe('ai.chat_time_to_first_token_seconds', time_to_first_token)
+            yield answer
+    finally:
+        total = time.perf_counter() - started
+        metrics.observe('ai.chat_total_seconds', total)
+        if time_to_first_token is not None:
+            print(f"AI: Streamed answer for Project {project_id} (first token {time_to_first_token:.2f}s, total {total:.2f}s)")
@@ -1,6 +1,6 @@
 from django.contrib.auth.models import User
 from rest_framework import serializers
-from .models import Project, Membership, Folder, File, Documentation, Alert
+from .models import Project, Membership, Folder, File, Documentation, Alert, ChatMessage
 from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
 
 class UserSerializer(serializers.ModelSerializer):
@@ -56,22 +56,56 @@ class MemberSerializer(serializers.ModelSerializer):
         fields = ['id', 'user', 'first_name', 'email', 'role']
         read_only_fields = ['user', 'first_name', 'email']
 
+class ChatMessageSerializer(serializers.ModelSerializer):
+    # Same fields as the live chat_message event
+    username = serializers.CharField(source='user.username', read_only=True)
+
+    class Meta:
+        model = ChatMessage
+        fields = ['id', 'message', 'username', 'user_id', 'timestamp']
+
 class FileSerializer(serializers.ModelSerializer):
     class Meta:
         model = File
         fields = ['id', 'name']
 
+def build_folder_tree(project_id, root_id=None):
+    # Two flat queries for the whole project, nested in memory. Returns the
+    # top-level folders, or the single folder `root_id` with its subtree.
+    folders = list(
+        Folder.objects.filter(project_id=project_id).order_by('id').values_list('id', 'name', 'parent_id')
+    )
+    nodes = {
+        folder_id: {'id': folder_id, 'name': name, 'files': [], 'subfolders': []}
+        for folder_id, name, _ in folders
+    }
+
+    roots = []
+    for folder_id, _, parent_id in folders:
+        if parent_id is None:
+            roots.append(nodes[folder_id])
+        elif parent_id in nodes:
+            nodes[parent_id]['subfolders'].append(nodes[folder_id])
+
+    files = File.objects.filter(project_id=project_id).order_by('id').values_list('id', 'name', 'folder_id')
+    for file_id, name, folder_id in files:
+        if folder_id in nodes:
+            nodes[folder_id]['files'].append({'id': file_id, 'name': name})
+
+    if root_id is None:
+        return roots
+    return nodes.get(root_id)
+
 class FolderSerializer(serializers.ModelSerializer):
     files = FileSerializer(many=True, read_only=True)
-    subfolders = serializers.SerializerMethodField()
+    subfolders = serializers.ListField(child=serializers.DictField(), read_only=True)
 
     class Meta:
         model = Folder
         fields = ['id', 'name', 'files', 'subfolders']
 
-    def get_subfolders(self, obj):
-        subfolders = Folder.objects.filter(parent=obj)
-        return FolderSerializer(subfolders, many=True).data
+    def to_representation(self, instance):
+        return build_folder_tree(instance.project_id, root_id=instance.id)
 
 class FileDetailSerializer(serializers.ModelSerializer):
     class Meta:
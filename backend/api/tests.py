@@ -1,3 +1,1235 @@
-from django.test import TestCase
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from io import StringIO
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+from unittest import mock, skipUnless
+import asyncio
+import importlib.util
+from asgiref.sync import async_to_sync, sync_to_async
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth.models import User
+from django.core.exceptions import ImproperlyConfigured
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+from .models import Project, Membership, Folder, File, ChatMessage
+from .tree_cache import bump_tree_version
+from .lexical import build_index, tokenize
+from .chunking import chunk_code
+from .documents import DocumentBuffer
+from .permissions import OWNER_ROLE, can_edit_project, get_project_role, invalidate_project_role
+from .routing import websocket_urlpatterns
+from .ot import HISTORY_LIMIT, DocumentLog, StaleRevision, apply_ops, diff_ops, transform
+from . import chat_buffer, documents, executions, executors, framing, index_jobs, lexical, rag_service, tree_cache
+from .presence import MemoryPresence, get_presence, schedule_presence_delta
 
-# Create your tests here.
+NOBODY_UID = 65534
+
+LOCAL_BACKENDS = {
+    'CACHES': {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+    'CHANNEL_LAYERS': {'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}},
+    'PRESENCE_REDIS_URL': None,
+    'DOCUMENT_REDIS_URL': None,
+    'INDEX_JOB_REDIS_URL': None,
+}
+
+
+@override_settings(**LOCAL_BACKENDS)
+class FileTreeViewTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='owner@example.com', password='password')
+        self.project = Project.objects.create(name='Tree', owner=self.user)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_tree_shape(self):
+        root = Folder.objects.create(name='root', project=self.project)
+        src = Folder.objects.create(name='src', project=self.project, parent=root)
+        utils = Folder.objects.create(name='utils', project=self.project, parent=src)
+        readme = File.objects.create(name='README.md', project=self.project, folder=root)
+        main = File.objects.create(name='main.py', project=self.project, folder=src)
+
+        response = self.client.get(reverse('file-tree', args=[self.project.id]))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), [{
+            'id': root.id,
+            'name': 'root',
+            'files': [{'id': readme.id, 'name': 'README.md'}],
+            'subfolders': [{
+                'id': src.id,
+                'name': 'src',
+                'files': [{'id': main.id, 'name': 'main.py'}],
+                'subfolders': [{'id': utils.id, 'name': 'utils', 'files': [], 'subfolders': []}],
+            }],
+        }])
+
+    def test_query_budget_is_independent_of_tree_size(self):
+        root = Folder.objects.create(name='root', project=self.project)
+        parent = root
+        for depth in range(20):
+            parent = Folder.objects.create(name=f'dir{depth}', project=self.project, parent=parent)
+            for index in range(5):
+                sibling = Folder.objects.create(name=f'leaf{index}', project=self.project, parent=parent)
+                File.objects.create(name=f'file{index}.py', project=self.project, folder=sibling)
+
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('file-tree', args=[self.project.id]))
+        self.assertEqual(response.status_code, 200)
+
+    def test_conditional_get(self):
+        root = Folder.objects.create(name='root', project=self.project)
+        url = reverse('file-tree', args=[self.project.id])
+
+        first = self.client.get(url)
+        etag = first['ETag']
+
+        with self.assertNumQueries(0):
+            cached = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(cached.status_code, 304)
+
+        File.objects.create(name='new.py', project=self.project, folder=root)
+        bump_tree_version(self.project.id)
+
+        changed = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(changed.status_code, 200)
+        self.assertNotEqual(changed['ETag'], etag)
+        self.assertEqual(changed.json()[0]['files'][0]['name'], 'new.py')
+
+    def test_outline_is_capped_breadth_first(self):
+        root = Folder.objects.create(name='root', project=self.project)
+        for index in range(12):
+            File.objects.create(name=f'file{index}.py', project=self.project, folder=root)
+        parent = root
+        for depth in range(30):
+            parent = Folder.objects.create(name=f'dir{depth}', project=self.project, parent=parent)
+
+        with mock.patch.object(tree_cache, 'OUTLINE_MAX_CHARS', 300):
+            outline = tree_cache.get_project_outline(self.project.id)
+        lines = outline.split('\n')
+        self.assertLessEqual(len('\n'.join(lines[:-1])), 300)
+        self.assertEqual(lines[-1], '... (remaining folders omitted)')
+        self.assertEqual(lines[2], 'root/: ' + ', '.join(f'file{index}.py' for index in range(8)) + ' (+4 more)')
+        self.assertIn('root/dir0/', lines)
+        self.assertNotIn('dir29', outline)
+
+    def test_outline_is_rebuilt_when_the_tree_version_changes(self):
+        root = Folder.objects.create(name='root', project=self.project)
+        outline = tree_cache.get_project_outline(self.project.id)
+        self.assertIn('root/', outline.split('\n'))
+
+        File.objects.create(name='new.py', project=self.project, folder=root)
+        with self.assertNumQueries(0):
+            self.assertEqual(tree_cache.get_project_outline(self.project.id), outline)
+        bump_tree_version(self.project.id)
+        self.assertIn('root/: new.py', tree_cache.get_project_outline(self.project.id).split('\n'))
+
+
+class LexicalIndexTests(SimpleTestCase):
+    def test_identifiers_are_split(self):
+        self.assertEqual(
+            tokenize("getUserName snake_case"),
+            ['getusername', 'get', 'user', 'name', 'snake_case', 'snake', 'case'],
+        )
+
+    def test_search_finds_identifier_and_tracks_removals(self):
+        index = build_index([
+            (1, 'auth.py', 'def check_user_token(token):\n    return verify(token)\n'),
+            (2, 'views.js', 'function renderUserList(users) {\n  return users.map(render);\n}\n'),
+        ])
+
+        results = index.search('where is the user token checked')
+        self.assertEqual(results[0][1]['file_name'], 'auth.py')
+
+        index.remove_file(1)
+        self.assertEqual([chunk['file_id'] for _, chunk in index.search('user token')], [2])
+
+    def test_benchmark_fixture_recall(self):
+        # Matches the results recorded in api/fixtures/retrieval_repo/README.md
+        out = StringIO()
+        call_command('benchmark_retrieval', stdout=out)
+        self.assertIn("Indexed 13 files (14 chunks)", out.getvalue())
+        self.assertIn("lexical: recall@5 1.000 over 41 queries", out.getvalue())
+
+
+@override_settings(**LOCAL_BACKENDS)
+class LexicalIndexVersionTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        lexical._indexes.clear()
+        self.addCleanup(lexical._indexes.clear)
+        self.user = User.objects.create_user(username='searcher@example.com', password='password')
+        self.project = Project.objects.create(name='Search', owner=self.user)
+        folder = Folder.objects.create(name='root', project=self.project)
+        self.file = File.objects.create(
+            name='auth.py', project=self.project, folder=folder, content='def check_token(token):\n    pass\n'
+        )
+
+    def search_files(self, query):
+        return [chunk['file_name'] for _, chunk in lexical.get_lexical_index(self.project.id).search(query)]
+
+    def test_local_edit_patches_the_loaded_index(self):
+        index = lexical.get_lexical_index(self.project.id)
+        lexical.update_file(self.project.id, self.file.id, 'def refresh_session(session):\n    pass\n', 'auth.py')
+        with self.assertNumQueries(0):
+            self.assertIs(lexical.get_lexical_index(self.project.id), index)
+        self.assertEqual(self.search_files('refresh session'), ['auth.py'])
+
+    def test_edit_in_another_worker_rebuilds_the_index(self):
+        index = lexical.get_lexical_index(self.project.id)
+        # Another worker saves the file: the database and the shared version change
+        File.objects.filter(pk=self.file.id).update(content='def refresh_session(session):\n    pass\n')
+        lexical.bump_content_version(self.project.id)
+
+        self.assertEqual(self.search_files('refresh session'), ['auth.py'])
+        self.assertIsNot(lexical.get_lexical_index(self.project.id), index)
+        self.assertEqual(self.search_files('check token'), [])
+
+    def test_file_edits_invalidate_cached_answers(self):
+        embeddings = mock.Mock(embed_query=mock.Mock(return_value=[1.0, 0.0]))
+        self.addCleanup(rag_service._answer_cache.clear)
+        with mock.patch.object(rag_service, 'get_embeddings', return_value=embeddings):
+            answer, pending = rag_service.lookup_answer(self.project.id, 'How are tokens checked?')
+            self.assertIsNone(answer)
+            version, normalized_query, query_embedding = pending
+            rag_service.store_answer(self.project.id, version, normalized_query, query_embedding, 'check_token')
+            self.assertEqual(rag_service.lookup_answer(self.project.id, 'how are tokens checked')[0], 'check_token')
+
+            lexical.update_file(self.project.id, self.file.id, 'def check_token(token):\n    return False\n')
+            self.assertEqual(rag_service.lookup_answer(self.project.id, 'how are tokens checked'), (None, mock.ANY))
+
+
+class FakeEmbeddings:
+    # Deterministic stand-in for the sentence-transformers model
+    def __init__(self):
+        self.batches = []
+
+    def embed_documents(self, texts):
+        self.batches.append(list(texts))
+        return [self.embed_query(text) for text in texts]
+
+    def embed_query(self, text):
+        return [float(len(text)), float(text.count('e')), 1.0]
+
+
+@override_settings(**LOCAL_BACKENDS)
+class VectorIndexTests(TestCase):
+    def setUp(self):
+        import chromadb
+
+        cache.clear()
+        lexical._indexes.clear()
+        self.addCleanup(lexical._indexes.clear)
+        directory = tempfile.mkdtemp(prefix='codelive-chroma-')
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        self.client = chromadb.PersistentClient(path=directory)
+        self.embeddings = FakeEmbeddings()
+        for name, value in (('_chroma_client', self.client), ('_embeddings', self.embeddings)):
+            patcher = mock.patch.object(rag_service, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        rag_service._vectorstores.clear()
+        self.addCleanup(rag_service._vectorstores.clear)
+
+        user = User.objects.create_user(username='indexer@example.com', password='password')
+        self.project = Project.objects.create(name='Vectors', owner=user)
+        self.folder = Folder.objects.create(name='root', project=self.project)
+        self.file = File.objects.create(
+            name='auth.py', project=self.project, folder=self.folder, content='def check_token(token):\n    pass\n'
+        )
+
+    def indexed_chunks(self):
+        stored = rag_service.get_vectorstore(self.project.id).get(include=['metadatas'])
+        return sorted(zip([m['file_id'] for m in stored['metadatas']], stored['ids']))
+
+    def test_query_of_an_unindexed_project_creates_no_collection(self):
+        docs = rag_service.retrieve_documents(self.project.id, 'check token', [1.0, 0.0, 1.0])
+        self.assertEqual([doc.metadata['file_name'] for doc in docs], ['auth.py'])
+        self.assertEqual(self.client.list_collections(), [])
+        self.assertIsNone(rag_service.get_vectorstore(self.project.id, create=False))
+
+    def test_index_writes_chunks_that_queries_find(self):
+        self.assertEqual(rag_service.index_project(self.project.id)[0], True)
+        self.assertEqual([file_id for file_id, _ in self.indexed_chunks()], [str(self.file.id)])
+        vectorstore = rag_service.get_vectorstore(self.project.id, create=False)
+        found, = vectorstore.similarity_search_by_vector(self.embeddings.embed_query(self.file.content), k=1)
+        self.assertEqual(found.metadata['file_name'], 'auth.py')
+
+    def test_reindex_skips_unchanged_files_and_deletes_stale_chunks(self):
+        edited = File.objects.create(name='edit.py', project=self.project, folder=self.folder, content='a = 1')
+        removed = File.objects.create(name='gone.py', project=self.project, folder=self.folder, content='b = 2')
+        rag_service.index_project(self.project.id)
+        before = dict((file_id, chunk_id) for file_id, chunk_id in self.indexed_chunks())
+
+        File.objects.filter(pk=edited.pk).update(content='a = 3')
+        removed.delete()
+        self.embeddings.batches.clear()
+        success, message = rag_service.index_project(self.project.id)
+
+        self.assertTrue(success)
+        self.assertEqual(message, 'Indexed 1 changed files (1 unchanged, 1 removed).')
+        # Only the edited file was embedded again
+        self.assertEqual(self.embeddings.batches, [['a = 3']])
+        after = dict(self.indexed_chunks())
+        self.assertEqual(set(after), {str(self.file.id), str(edited.id)})
+        self.assertEqual(after[str(self.file.id)], before[str(self.file.id)])
+        self.assertNotEqual(after[str(edited.id)], before[str(edited.id)])
+
+    def test_embedding_is_batched_and_keeps_chunk_order(self):
+        File.objects.all().delete()
+        contents = [f'value_{number} = {number}' for number in range(5)]
+        for number, content in enumerate(contents):
+            File.objects.create(name=f'f{number}.py', project=self.project, folder=self.folder, content=content)
+        with mock.patch.object(rag_service, 'EMBED_BATCH_SIZE', 2):
+            self.assertTrue(rag_service.index_project(self.project.id)[0])
+
+        # One embedding call per batch of two chunks, in file order
+        self.assertEqual(self.embeddings.batches, [contents[0:2], contents[2:4], contents[4:]])
+        stored = rag_service.get_vectorstore(self.project.id).get(include=['documents', 'embeddings'])
+        for text, vector in zip(stored['documents'], stored['embeddings']):
+            self.assertEqual(list(vector), self.embeddings.embed_query(text))
+
+
+class ChunkCodeTests(SimpleTestCase):
+    def test_python_chunks_keep_definitions_whole(self):
+        source = (
+            "import os\n"
+            "\n"
+            "@cached\n"
+            "def load(path):\n"
+            "    return open(path).read()\n"
+            "\n"
+            "class Store:\n"
+            "    def get(self, key):\n"
+            "        return key\n"
+        )
+        chunks = chunk_code(source, 'store.py', max_chars=60)
+        self.assertEqual([(c['start_line'], c['end_line']) for c in chunks], [(1, 2), (3, 6), (7, 9)])
+        self.assertTrue(chunks[1]['text'].startswith("@cached\ndef load"))
+
+    def test_java_methods_split_inside_class(self):
+        source = (
+            "public class Counter {\n"
+            "    private int count;\n"
+            "    // Adds one\n"
+            "    public void increment() {\n"
+            "        count += 1;\n"
+            "    }\n"
+            "    public int get() { return count; }\n"
+            "}\n"
+        )
+        chunks = chunk_code(source, 'Counter.java', max_chars=80)
+        self.assertEqual([(c['start_line'], c['end_line']) for c in chunks], [(1, 2), (3, 6), (7, 8)])
+        self.assertEqual({c['language'] for c in chunks}, {'java'})
+
+
+class StubJudge0Handler(BaseHTTPRequestHandler):
+    # Minimal Judge0: a submission reports "Processing" until it has been
+    # polled server.polls_until_done times, then echoes its stdin.
+    def send_json(self, status_code, body):
+        payload = json.dumps(body).encode()
+        self.send_response(status_code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def create(self, submission):
+        token = uuid.uuid4().hex
+        self.server.submissions[token] = {'stdin': submission.get('stdin', ''), 'polls': 0}
+        return token
+
+    def poll(self, token):
+        submission = self.server.submissions.get(token)
+        if submission is None:
+            return None
+        submission['polls'] += 1
+        if submission['polls'] < self.server.polls_until_done:
+            return {'token': token, 'status': {'id': 2, 'description': 'Processing'}}
+        return {
+            'token': token,
+            'stdout': submission['stdin'],
+            'stderr': None,
+            'compile_output': None,
+            'message': None,
+            'status': {'id': 3, 'description': 'Accepted'},
+        }
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        if urlparse(self.path).path.endswith('/batch'):
+            self.send_json(201, [{'token': self.create(entry)} for entry in body['submissions']])
+        else:
+            self.send_json(201, {'token': self.create(body)})
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path.endswith('/batch'):
+            tokens = parse_qs(url.query)['tokens'][0].split(',')
+            return self.send_json(200, {'submissions': [self.poll(token) for token in tokens]})
+        result = self.poll(url.path.rstrip('/').rsplit('/', 1)[-1])
+        if result is None:
+            return self.send_json(404, {'error': 'Not found'})
+        self.send_json(200, result)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@override_settings(**LOCAL_BACKENDS)
+class IndexJobLockTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        index_jobs._job_locks.clear()
+        self.addCleanup(index_jobs._held_locks.clear)
+        executor_patch = mock.patch.object(index_jobs, '_executor')
+        self.executor = executor_patch.start()
+        self.addCleanup(executor_patch.stop)
+        self.locks = index_jobs.get_job_locks()
+
+    def crashed_job(self, job_id):
+        # Left RUNNING by a worker that died; its lock was never renewed
+        cache.set(index_jobs._job_key(5), {**index_jobs._new_job(job_id, 5), 'status': index_jobs.RUNNING})
+        self.locks.acquire(index_jobs._lock_key(5), job_id, 0)
+
+    def test_expired_lock_is_taken_over_once(self):
+        self.crashed_job('crashed')
+        self.assertEqual(index_jobs.get_index_job(5)['status'], index_jobs.FAILED)
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(index_jobs.submit_index_job(5))) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        created = [job for job, was_created in results if was_created]
+        self.assertEqual(len(created), 1)
+        self.assertEqual(self.locks.holder(index_jobs._lock_key(5)), created[0]['id'])
+        self.assertEqual({job['id'] for job, _ in results}, {created[0]['id']})
+        self.assertEqual(self.executor.submit.call_count, 1)
+        self.assertEqual(index_jobs.get_index_job(5)['status'], index_jobs.PENDING)
+
+    def test_lock_of_a_job_still_starting_is_not_stale(self):
+        # Another worker has taken the lock but not saved its job yet
+        self.locks.acquire(index_jobs._lock_key(5), 'starting', index_jobs.LOCK_TTL)
+        job, created = index_jobs.submit_index_job(5)
+        self.assertFalse(created)
+        self.assertEqual(job['id'], 'starting')
+        self.assertEqual(self.locks.holder(index_jobs._lock_key(5)), 'starting')
+
+    def test_heartbeat_keeps_the_lock_of_a_running_job(self):
+        job, created = index_jobs.submit_index_job(5)
+        self.assertTrue(created)
+        with mock.patch.object(index_jobs, 'LOCK_TTL', 0.05):
+            index_jobs._renew_held_locks()
+        time.sleep(0.1)
+        self.assertIsNone(self.locks.holder(index_jobs._lock_key(5)))
+        index_jobs._renew_held_locks()
+        # Renewing a lost lock fails and stops trying
+        self.assertNotIn(5, index_jobs._held_locks)
+
+        job, created = index_jobs.submit_index_job(5)
+        index_jobs._renew_held_locks()
+        self.assertEqual(self.locks.holder(index_jobs._lock_key(5)), job['id'])
+
+    def test_release_only_drops_its_own_lock(self):
+        self.locks.acquire(index_jobs._lock_key(5), 'successor', index_jobs.LOCK_TTL)
+        self.assertFalse(index_jobs._release_lock(5, 'finished'))
+        self.assertEqual(self.locks.holder(index_jobs._lock_key(5)), 'successor')
+        self.assertTrue(index_jobs._release_lock(5, 'successor'))
+        self.assertIsNone(self.locks.holder(index_jobs._lock_key(5)))
+
+    @skipUnless(importlib.util.find_spec('fakeredis'), "fakeredis is not installed")
+    def test_redis_locks_compare_before_changing(self):
+        import fakeredis
+
+        locks = index_jobs.RedisJobLocks('redis://locks.test/0')
+        locks.redis = fakeredis.FakeRedis(decode_responses=True)
+        self.assertTrue(locks.acquire('lock', 'a', 60))
+        self.assertFalse(locks.acquire('lock', 'b', 60))
+        self.assertFalse(locks.refresh('lock', 'b', 60))
+        self.assertFalse(locks.release('lock', 'b'))
+        self.assertTrue(locks.refresh('lock', 'a', 120))
+        self.assertGreater(locks.redis.pttl('lock'), 60_000)
+        self.assertTrue(locks.release('lock', 'a'))
+        self.assertIsNone(locks.holder('lock'))
+
+
+@override_settings(**LOCAL_BACKENDS)
+class ExecutionSlotTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        self.run = {'project_id': 3, 'user_id': 1}
+
+    def active(self):
+        return cache.get(executions._slot_key(self.run))
+
+    def test_each_acquire_extends_the_counter(self):
+        now = time.time()
+        with mock.patch('time.time', return_value=now):
+            executions.acquire_slot(self.run)
+        # A second run starts just before the first one's window would close
+        with mock.patch('time.time', return_value=now + executions.SLOT_TIMEOUT - 1):
+            executions.acquire_slot(self.run)
+        with mock.patch('time.time', return_value=now + executions.SLOT_TIMEOUT + 1):
+            self.assertEqual(self.active(), 2)
+
+    def test_limit_and_release(self):
+        for _ in range(executions.PROJECT_CONCURRENCY):
+            executions.acquire_slot(self.run)
+        with self.assertRaises(executions.ConcurrencyLimitExceeded):
+            executions.acquire_slot(self.run)
+        self.assertEqual(self.active(), executions.PROJECT_CONCURRENCY)
+        executions.release_slot(self.run)
+        self.assertEqual(self.active(), executions.PROJECT_CONCURRENCY - 1)
+
+    def test_release_never_goes_below_zero(self):
+        executions.acquire_slot(self.run)
+        executions.acquire_slot(self.run)
+        # The counter expires and restarts while both runs are still going
+        cache.delete(executions._slot_key(self.run))
+        executions.acquire_slot(self.run)
+        for _ in range(3):
+            executions.release_slot(self.run)
+        self.assertEqual(self.active(), 0)
+
+        for _ in range(executions.PROJECT_CONCURRENCY):
+            executions.acquire_slot(self.run)
+        with self.assertRaises(executions.ConcurrencyLimitExceeded):
+            executions.acquire_slot(self.run)
+
+
+@override_settings(**LOCAL_BACKENDS)
+class CodeExecutionTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.judge0 = ThreadingHTTPServer(('127.0.0.1', 0), StubJudge0Handler)
+        cls.judge0.submissions = {}
+        threading.Thread(target=cls.judge0.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.judge0.shutdown()
+        cls.judge0.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        cache.clear()
+        self.judge0.polls_until_done = 2
+        self.user = User.objects.create_user(username='runner@example.com', password='password')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        settings_override = override_settings(JUDGE0_URL=f'http://127.0.0.1:{self.judge0.server_port}', JUDGE0_API_KEY=None)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        poll_patch = mock.patch.object(executors, 'POLL_INITIAL_DELAY', 0.01)
+        poll_patch.start()
+        self.addCleanup(poll_patch.stop)
+        executions._result_cache.clear()
+
+    def run_code(self, **data):
+        response = self.client.post(reverse('code-execute'), {'language': 'python', 'code': 'print(input())', **data}, format='json')
+        self.assertEqual(response.status_code, 202)
+        return response.data['run']
+
+    def wait_for_run(self, run_id, timeout=5):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            run = self.client.get(reverse('code-execute-detail', args=[run_id])).data['run']
+            if run['status'] in (executions.COMPLETED, executions.FAILED):
+                return run
+            time.sleep(0.02)
+        self.fail(f"Run {run_id} did not finish")
+
+    def test_run_is_polled_in_background(self):
+        run = self.run_code(input='hello')
+        self.assertIn(run['status'], (executions.PENDING, executions.RUNNING))
+
+        run = self.wait_for_run(run['id'])
+        self.assertEqual(run['status'], executions.COMPLETED)
+        self.assertEqual(run['result']['stdout'], 'hello')
+
+    def test_hung_submission_fails_at_deadline(self):
+        self.judge0.polls_until_done = 10 ** 6
+        with mock.patch.object(executions, 'EXECUTION_DEADLINE', 0.2):
+            run = self.wait_for_run(self.run_code()['id'])
+        self.assertEqual(run['status'], executions.FAILED)
+        self.assertIn('did not finish', run['error'])
+
+    def test_batch_runs_every_input_in_order(self):
+        run = self.wait_for_run(self.run_code(inputs=['one', 'two', 'three'])['id'])
+        self.assertEqual(run['status'], executions.COMPLETED)
+        self.assertEqual([result['stdout'] for result in run['results']], ['one', 'two', 'three'])
+
+    def test_concurrent_runs_are_limited(self):
+        self.judge0.polls_until_done = 10 ** 6
+        with mock.patch.object(executions, 'PROJECT_CONCURRENCY', 1), mock.patch.object(executions, 'EXECUTION_DEADLINE', 0.3):
+            first = self.run_code()
+            response = self.client.post(reverse('code-execute'), {'language': 'python', 'code': ''}, format='json')
+            self.assertEqual(response.status_code, 429)
+            self.wait_for_run(first['id'])
+            self.wait_for_run(self.run_code()['id'])
+
+    def test_repeated_run_is_served_from_cache(self):
+        first = self.wait_for_run(self.run_code(input='same')['id'])
+        submitted = len(self.judge0.submissions)
+
+        second = self.run_code(input='same')
+        self.assertEqual(second['status'], executions.COMPLETED)
+        self.assertTrue(second['cached'])
+        self.assertEqual(second['result'], first['result'])
+        self.assertEqual(len(self.judge0.submissions), submitted)
+
+        bypassed = self.run_code(input='same', bypass_cache=True)
+        self.assertFalse(bypassed['cached'])
+        self.wait_for_run(bypassed['id'])
+        self.assertEqual(len(self.judge0.submissions), submitted + 1)
+
+    def test_bypass_cache_is_parsed_as_a_boolean(self):
+        self.wait_for_run(self.run_code(input='same')['id'])
+        self.assertTrue(self.run_code(input='same', bypass_cache='false')['cached'])
+        response = self.client.post(
+            reverse('code-execute'), {'language': 'python', 'code': '', 'bypass_cache': 'maybe'}, format='json'
+        )
+        self.assertEqual(response.status_code, 400)
+
+    def test_runs_are_private_to_requester(self):
+        run = self.run_code()
+        other = APIClient()
+        other.force_authenticate(User.objects.create_user(username='other@example.com', password='password'))
+        self.assertEqual(other.get(reverse('code-execute-detail', args=[run['id']])).status_code, 404)
+        self.wait_for_run(run['id'])
+
+
+@skipUnless(all(map(shutil.which, ['g++', 'unshare', 'prlimit'])), "g++ or util-linux is not installed")
+@skipUnless(os.geteuid() == 0, "running code as another uid needs root")
+class LocalExecutorTests(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.executor = executors.LocalExecutor(
+            workers=1, cpu_seconds=2, wall_seconds=2, max_processes=32, run_as_uid=NOBODY_UID
+        )
+
+    def execute(self, language, code, inputs):
+        return self.executor.execute(language, code, inputs, time.monotonic() + 10)
+
+    def test_python_reads_stdin(self):
+        results = self.execute('python', 'print(input()[::-1])', ['abc', 'xyz'])
+        self.assertEqual([result['stdout'] for result in results], ['cba\n', 'zyx\n'])
+        self.assertEqual({result['status']['id'] for result in results}, {3})
+
+    def test_runaway_program_hits_time_limit(self):
+        result, = self.execute('python', 'while True: pass', [''])
+        self.assertEqual(result['status']['description'], 'Time Limit Exceeded')
+
+    def test_network_is_unreachable(self):
+        code = 'import socket\nsocket.create_connection(("1.1.1.1", 80), timeout=2)'
+        result, = self.execute('python', code, [''])
+        self.assertEqual(result['status']['id'], 11)
+        self.assertIn('unreachable', result['stderr'])
+
+    def test_output_is_capped_while_reading(self):
+        result, = self.execute('python', 'import sys\nsys.stdout.write("x" * 10_000_000)', [''])
+        self.assertEqual(result['status']['id'], 3)
+        self.assertEqual(len(result['stdout']), executors.OUTPUT_LIMIT)
+        self.assertIn('truncated', result['message'])
+
+    def test_fork_bomb_is_contained(self):
+        code = 'import os\nfor _ in range(200):\n    try:\n        os.fork()\n    except OSError:\n        print("refused")\n        break'
+        result, = self.execute('python', code, [''])
+        self.assertIn('refused', result['stdout'] or '')
+
+    def test_refuses_to_run_code_as_root(self):
+        with self.assertRaises(ImproperlyConfigured):
+            executors.LocalExecutor(workers=1, run_as_uid=0)
+
+    def test_refuses_to_run_code_as_the_server(self):
+        # Without a uid of its own, code could write the database and source
+        with override_settings(LOCAL_EXECUTOR_UID=None), mock.patch.object(executors.os, 'geteuid', return_value=1000):
+            with self.assertRaises(ImproperlyConfigured):
+                executors.LocalExecutor(workers=1)
+        with mock.patch.object(executors.os, 'geteuid', return_value=1000):
+            with self.assertRaises(ImproperlyConfigured):
+                executors.LocalExecutor(workers=1, run_as_uid=1000)
+
+    def test_cpp_compile_error_is_reported(self):
+        result, = self.execute('cpp', 'int main( {', [''])
+        self.assertEqual(result['status']['id'], 6)
+        self.assertTrue(result['compile_output'])
+
+
+@override_settings(**LOCAL_BACKENDS)
+class ProjectRoleCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.owner = User.objects.create_user(username='lead@example.com', password='password')
+        self.member = User.objects.create_user(username='member@example.com', password='password')
+        self.project = Project.objects.create(name='Roles', owner=self.owner)
+        self.membership = Membership.objects.create(
+            project=self.project, user=self.member,
+            role=Membership.Role.VIEWER, status=Membership.Status.APPROVED,
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.owner)
+
+    def test_roles_are_served_from_the_cache(self):
+        outsider = User.objects.create_user(username='outsider@example.com', password='password')
+        for user, role in ((self.owner, OWNER_ROLE), (self.member, Membership.Role.VIEWER), (outsider, None)):
+            with self.assertNumQueries(1):
+                self.assertEqual(get_project_role(self.project.id, user.id), role)
+            # Misses are cached too, so an outsider probing a project costs one query
+            with self.assertNumQueries(0):
+                self.assertEqual(get_project_role(self.project.id, user.id), role)
+
+    def test_role_change_invalidates_the_cached_role(self):
+        self.assertFalse(can_edit_project(self.project.id, self.member.id))
+        response = self.client.patch(
+            reverse('membership-detail', args=[self.membership.id]), {'role': Membership.Role.EDITOR}, format='json'
+        )
+        self.assertEqual(response.status_code, 200)
+        with self.assertNumQueries(1):
+            self.assertEqual(get_project_role(self.project.id, self.member.id), Membership.Role.EDITOR)
+        self.assertTrue(can_edit_project(self.project.id, self.member.id))
+
+    def test_member_removal_invalidates_the_cached_role(self):
+        self.assertEqual(get_project_role(self.project.id, self.member.id), Membership.Role.VIEWER)
+        response = self.client.delete(reverse('membership-detail', args=[self.membership.id]))
+        self.assertEqual(response.status_code, 204)
+        self.assertIsNone(get_project_role(self.project.id, self.member.id))
+
+    def test_approval_invalidates_a_cached_miss(self):
+        applicant = User.objects.create_user(username='applicant@example.com', password='password')
+        request = Membership.objects.create(project=self.project, user=applicant)
+        self.assertIsNone(get_project_role(self.project.id, applicant.id))
+        response = self.client.post(
+            reverse('membership-request-action', args=[request.id]), {'action': 'approve'}, format='json'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(get_project_role(self.project.id, applicant.id), Membership.Role.VIEWER)
+
+
+@override_settings(**LOCAL_BACKENDS)
+class ProjectConsumerTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.owner = User.objects.create_user(username='host@example.com', password='password')
+        self.project = Project.objects.create(name='Socket', owner=self.owner)
+        folder = Folder.objects.create(name='root', project=self.project)
+        self.file = File.objects.create(name='secret.py', project=self.project, folder=folder, content='SECRET = 1\n')
+        self.addCleanup(documents.open_documents.clear)
+
+    def communicator(self, user):
+        communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), f'/ws/project/{self.project.id}/')
+        communicator.scope['user'] = user
+        return communicator
+
+    def test_outsider_is_refused(self):
+        outsider = User.objects.create_user(username='outsider@example.com', password='password')
+
+        async def connect():
+            communicator = self.communicator(outsider)
+            connected, _ = await communicator.connect()
+            await communicator.disconnect()
+            return connected
+        self.assertFalse(async_to_sync(connect)())
+
+    def test_member_gets_a_snapshot_until_removed(self):
+        member = User.objects.create_user(username='member@example.com', password='password')
+        membership = Membership.objects.create(
+            project=self.project, user=member, role=Membership.Role.VIEWER, status=Membership.Status.APPROVED,
+        )
+
+        async def session():
+            communicator = self.communicator(member)
+            connected, _ = await communicator.connect()
+            self.assertTrue(connected)
+            self.assertEqual((await communicator.receive_json_from())['can_edit'], False)
+            await communicator.receive_json_from()  # presence snapshot
+
+            await communicator.send_json_to({'type': 'code_open', 'fileId': self.file.id})
+            snapshot = await communicator.receive_json_from()
+            self.assertEqual((snapshot['type'], snapshot['content']), ('code_snapshot', 'SECRET = 1\n'))
+
+            await database_sync_to_async(membership.delete)()
+            invalidate_project_role(self.project.id, member.id)
+            await communicator.send_json_to({'type': 'code_open', 'fileId': self.file.id})
+            self.assertTrue(await communicator.receive_nothing(timeout=0.2))
+            await communicator.disconnect()
+        async_to_sync(session)()
+
+    def test_tree_updates_carry_the_change_and_version(self):
+        client = APIClient()
+        client.force_authenticate(self.owner)
+        folder = self.file.folder
+
+        async def session():
+            communicator = self.communicator(self.owner)
+            connected, _ = await communicator.connect()
+            self.assertTrue(connected)
+            await communicator.receive_json_from()  # can_edit
+            await communicator.receive_json_from()  # presence snapshot
+
+            async def tree_update(method, *args, **kwargs):
+                response = await sync_to_async(getattr(client, method))(*args, format='json', **kwargs)
+                self.assertLess(response.status_code, 300)
+                update = await communicator.receive_json_from()
+                self.assertEqual(update['type'], 'file_tree_update')
+                return update
+
+            created = await tree_update(
+                'post', reverse('file-create'), {'name': 'new.py', 'folder': folder.id, 'project': self.project.id}
+            )
+            file_id = await database_sync_to_async(File.objects.values_list('id', flat=True).get)(name='new.py')
+            self.assertEqual(created['change'], {
+                'action': 'added', 'node_type': 'file', 'id': file_id, 'parent': folder.id, 'name': 'new.py',
+            })
+
+            renamed = await tree_update('patch', reverse('file-detail', args=[file_id]), {'name': 'old.py'})
+            self.assertEqual((renamed['change']['action'], renamed['change']['name']), ('renamed', 'old.py'))
+
+            removed = await tree_update('delete', reverse('file-detail', args=[file_id]))
+            self.assertEqual(removed['change'], {
+                'action': 'removed', 'node_type': 'file', 'id': file_id, 'parent': folder.id, 'name': 'old.py',
+            })
+
+            # Each change moves the tree to a newer version, which the next GET reports
+            versions = [update['version'] for update in (created, renamed, removed)]
+            self.assertEqual(versions, sorted(set(versions)))
+            tree = await sync_to_async(client.get)(reverse('file-tree', args=[self.project.id]))
+            self.assertIn(str(versions[-1]), tree['ETag'])
+            await communicator.disconnect()
+        async_to_sync(session)()
+
+
+@override_settings(**LOCAL_BACKENDS)
+class PresenceTests(SimpleTestCase):
+    def test_user_stays_online_until_last_connection_closes(self):
+        presence = MemoryPresence()
+        async_to_sync(presence.add)('project_1', 'tab-1', 7)
+        async_to_sync(presence.add)('project_1', 'tab-2', 7)
+        async_to_sync(presence.add)('project_1', 'tab-3', 8)
+
+        async_to_sync(presence.remove)('project_1', 'tab-1')
+        self.assertEqual(async_to_sync(presence.active_user_ids)('project_1'), [7, 8])
+
+        async_to_sync(presence.remove)('project_1', 'tab-2')
+        self.assertEqual(async_to_sync(presence.active_user_ids)('project_1'), [8])
+
+    def test_connections_without_heartbeat_expire(self):
+        presence = MemoryPresence()
+        async_to_sync(presence.add)('project_1', 'crashed', 7)
+        with mock.patch('api.presence.time.time', return_value=time.time() + 3600):
+            self.assertEqual(async_to_sync(presence.active_user_ids)('project_1'), [])
+
+    def test_burst_of_changes_is_one_delta(self):
+        async def scenario():
+            layer = get_channel_layer()
+            listener = await layer.new_channel()
+            await layer.group_add('project_42', listener)
+            presence = get_presence()
+            for user_id in (1, 2, 3):
+                await presence.add('project_42', f'tab-{user_id}', user_id)
+                schedule_presence_delta('project_42', user_id)
+            await presence.remove('project_42', 'tab-3')
+            schedule_presence_delta('project_42', 3)
+
+            message = await asyncio.wait_for(layer.receive(listener), timeout=2)
+            with self.assertRaises(asyncio.TimeoutError):
+                await asyncio.wait_for(layer.receive(listener), timeout=0.4)
+            return message
+
+        message = async_to_sync(scenario)()
+        self.assertEqual((message['joined'], message['left']), ([1, 2], [3]))
+
+
+@override_settings(**LOCAL_BACKENDS)
+class ChatBufferTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='chatter@example.com', password='password')
+        self.project = Project.objects.create(name='Chat', owner=self.user)
+        self.addCleanup(chat_buffer.cancel_flush_timer)
+
+    def enqueue(self, project_id, message):
+        async def enqueue():
+            return chat_buffer.enqueue_message(project_id, self.user.id, message)
+        return async_to_sync(enqueue)()
+
+    def test_flush_writes_queued_lines_in_one_batch(self):
+        doomed = Project.objects.create(name='Deleted', owner=self.user)
+        for message in ('first', 'second'):
+            self.enqueue(self.project.id, message)
+        self.enqueue(doomed.id, 'lost')
+        doomed.delete()
+
+        with self.assertNumQueries(3):
+            self.assertEqual(chat_buffer.flush_messages(), 2)
+        self.assertEqual(list(ChatMessage.objects.values_list('message', flat=True)), ['first', 'second'])
+        self.assertEqual(chat_buffer.flush_messages(), 0)
+
+    def test_project_id_from_url_is_persisted(self):
+        # The consumer passes the \w+ URL group through as a string
+        self.enqueue(str(self.project.id), 'from the socket')
+        self.assertEqual(chat_buffer.flush_messages(), 1)
+        self.assertTrue(ChatMessage.objects.filter(project=self.project, message='from the socket').exists())
+
+
+@override_settings(**LOCAL_BACKENDS)
+class ChatHistoryTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='historian@example.com', password='password')
+        self.project = Project.objects.create(name='History', owner=self.user)
+        # Identical timestamps make the id tie-breaker matter
+        stamp = ChatMessage._meta.get_field('timestamp').default()
+        ChatMessage.objects.bulk_create([
+            ChatMessage(project=self.project, user=self.user, message=f'line {i}', timestamp=stamp)
+            for i in range(7)
+        ])
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.url = reverse('chat-history', args=[self.project.id])
+
+    def test_pages_walk_back_through_history(self):
+        # The role lookup, then one query for the page and its usernames
+        with self.assertNumQueries(2):
+            newest = self.client.get(self.url, {'limit': 3}).json()
+        self.assertEqual([m['message'] for m in newest['messages']], ['line 4', 'line 5', 'line 6'])
+        self.assertEqual(newest['messages'][0]['username'], 'historian@example.com')
+        self.assertTrue(newest['has_more'])
+
+        older = self.client.get(self.url, {'limit': 3, 'before': newest['before']}).json()
+        self.assertEqual([m['message'] for m in older['messages']], ['line 1', 'line 2', 'line 3'])
+        oldest = self.client.get(self.url, {'limit': 3, 'before': older['before']}).json()
+        self.assertEqual([m['message'] for m in oldest['messages']], ['line 0'])
+        self.assertFalse(oldest['has_more'])
+
+        newer = self.client.get(self.url, {'limit': 2, 'after': oldest['after']}).json()
+        self.assertEqual([m['message'] for m in newer['messages']], ['line 1', 'line 2'])
+        self.assertTrue(newer['has_more'])
+
+    def test_rejects_outsiders_and_bad_cursors(self):
+        self.assertEqual(self.client.get(self.url, {'before': 'not-a-cursor'}).status_code, 400)
+
+        outsider = User.objects.create_user(username='outsider@example.com', password='password')
+        self.client.force_authenticate(outsider)
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+
+
+class FramingTests(SimpleTestCase):
+    def test_encoding_is_chosen_at_connect(self):
+        self.assertEqual(framing.negotiate({'query_string': b'token=abc&encoding=msgpack'}), framing.MSGPACK)
+        self.assertEqual(framing.negotiate({'query_string': b'token=abc&encoding=xml'}), framing.JSON)
+        self.assertEqual(framing.negotiate({'query_string': b'token=abc'}), framing.JSON)
+
+    def test_group_event_is_encoded_once_per_encoding(self):
+        payload = {'type': 'code_update', 'message': 'x = 1\n' * 1000, 'fileId': 7}
+        event = framing.shared_event({'type': 'broadcast_code'})
+        with mock.patch.object(framing, 'encode', wraps=framing.encode) as encode:
+            json_frames = [framing.frame_for(payload, framing.JSON, event) for _ in range(5)]
+            binary_frames = [framing.frame_for(payload, framing.MSGPACK, event) for _ in range(5)]
+        self.assertEqual(encode.call_count, 2)
+
+        self.assertEqual(json.loads(json_frames[0]), payload)
+        # Large binary bodies are deflated
+        self.assertEqual(binary_frames[0][:1], framing.DEFLATED)
+        self.assertLess(len(binary_frames[0]), len(json_frames[0]) // 10)
+        self.assertEqual(framing.decode(bytes_data=binary_frames[0]), payload)
+
+
+@override_settings(**LOCAL_BACKENDS)
+class AIChatStreamTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='asker@example.com', password='password')
+        self.project = Project.objects.create(name='Ask', owner=self.user)
+        Membership.objects.create(project=self.project, user=self.user, role=Membership.Role.ADMIN, status=Membership.Status.APPROVED)
+        self.token = str(AccessToken.for_user(self.user))
+
+    async def test_chunks_are_sent_before_the_answer_finishes(self):
+        released = threading.Event()
+        finished = []
+
+        def slow_stream(project_id, query):
+            try:
+                yield 'first'
+                released.wait(5)
+                yield 'second'
+            finally:
+                finished.append(True)
+
+        with mock.patch('api.views.stream_chat_with_project', slow_stream):
+            response = await self.async_client.post(
+                reverse('ai-chat', args=[self.project.id]), {'query': 'why?', 'stream': True},
+                content_type='application/json', headers={'Authorization': f'Bearer {self.token}'}
+            )
+            self.assertTrue(response.is_async)
+            events = aiter(response.streaming_content)
+            # The first chunk arrives while the chain is still blocked
+            self.assertIn(b'"first"', await anext(events))
+            released.set()
+            rest = b''.join([event async for event in events])
+        self.assertIn(b'"second"', rest)
+        self.assertIn(b'"done"', rest)
+        self.assertEqual(finished, [True])
+
+
+class OperationalTransformTests(SimpleTestCase):
+    def assertConverges(self, text, a, b):
+        a_after_b, b_after_a = transform(a, b, ops_win_ties=True)
+        left = apply_ops(apply_ops(text, b), a_after_b)
+        right = apply_ops(apply_ops(text, a), b_after_a)
+        self.assertEqual(left, right)
+        return left
+
+    def test_concurrent_inserts(self):
+        text = 'hello world'
+        self.assertEqual(self.assertConverges(text, [insert(5, ',')], [insert(11, '!')]), 'hello, world!')
+        # Same position: the side that wins ties goes first
+        self.assertEqual(self.assertConverges(text, [insert(0, 'A')], [insert(0, 'B')]), 'ABhello world')
+
+    def test_insert_against_delete(self):
+        text = 'hello brave world'
+        self.assertEqual(self.assertConverges(text, [insert(17, '!')], [delete(5, 6)]), 'hello world!')
+        # An insert inside a deleted range lands where the range was
+        self.assertEqual(self.assertConverges(text, [insert(8, 'X')], [delete(5, 6)]), 'helloX world')
+        # A delete spanning an insert keeps the inserted text
+        self.assertEqual(self.assertConverges(text, [delete(5, 6)], [insert(8, 'X')]), 'helloX world')
+
+    def test_concurrent_deletes(self):
+        text = 'abcdefghij'
+        self.assertEqual(self.assertConverges(text, [delete(0, 2)], [delete(8, 2)]), 'cdefgh')
+        self.assertEqual(self.assertConverges(text, [delete(2, 4)], [delete(4, 4)]), 'abij')
+        self.assertEqual(self.assertConverges(text, [delete(3, 2)], [delete(3, 2)]), 'abcfghij')
+
+    def test_rebase_transforms_past_missed_revisions(self):
+        log = DocumentLog(revision=10)
+        text = 'abc'
+        for ops in ([insert(0, 'X')], [delete(2, 1)]):
+            text = apply_ops(text, ops)
+            log.commit(ops)
+        # A client still on revision 10 appends to the original 'abc'
+        rebased = log.rebase(10, [insert(3, 'Z')])
+        self.assertEqual(apply_ops(text, rebased), 'XacZ')
+
+        with self.assertRaises(StaleRevision):
+            log.rebase(11 - HISTORY_LIMIT - 5, [insert(0, 'Y')])
+
+    @override_settings(DOCUMENT_REDIS_URL=None)
+    def test_whole_file_replace_is_committed_as_ops(self):
+        async def replace():
+            buffer = DocumentBuffer(1, 1, 'print(1)\n')
+            base = buffer.revision
+            with mock.patch.object(buffer, 'mark_dirty'):
+                revision, ops = await buffer.replace('print(2)\n')
+                # A client still on the old revision transforms past the replace
+                _, rebased = await buffer.commit(base, [insert(9, '# done\n')])
+            return buffer, base, revision, ops, rebased
+        buffer, base, revision, ops, rebased = async_to_sync(replace)()
+        self.assertEqual(ops, diff_ops('print(1)\n', 'print(2)\n'))
+        self.assertEqual(ops, [delete(6, 1), insert(6, '2')])
+        self.assertEqual(revision, base + 1)
+        self.assertEqual(rebased, [insert(9, '# done\n')])
+        self.assertEqual(buffer.content, 'print(2)\n# done\n')
+
+@override_settings(**LOCAL_BACKENDS)
+class DocumentBufferTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='typist@example.com', password='password')
+        self.project = Project.objects.create(name='Buffers', owner=self.user)
+        folder = Folder.objects.create(name='root', project=self.project)
+        self.file = File.objects.create(name='main.py', project=self.project, folder=folder, content='x = 1\n')
+        self.addCleanup(self.close_documents)
+
+    def close_documents(self):
+        for buffer in documents.open_documents.values():
+            buffer.cancel_flush_timer()
+        documents.open_documents.clear()
+
+    def saved_content(self):
+        self.file.refresh_from_db()
+        return self.file.content
+
+    def test_op_count_threshold_flushes_at_once(self):
+        async def edit():
+            buffer = await documents.open_document(self.file.id, self.project.id, 'tab-1')
+            for _ in range(2):
+                await buffer.commit(buffer.revision, [insert(0, '#')])
+                self.assertIsNotNone(buffer.flush_timer)
+            await buffer.commit(buffer.revision, [insert(0, '#')])
+            # The third op crosses the threshold: no timer, the flush is already queued
+            self.assertIsNone(buffer.flush_timer)
+            await asyncio.sleep(0.1)
+            return buffer
+        with mock.patch.object(documents, 'FLUSH_OP_COUNT', 3):
+            buffer = async_to_sync(edit)()
+        self.assertEqual(buffer.pending_ops, 0)
+        self.assertEqual(self.saved_content(), '###x = 1\n')
+
+    def test_idle_threshold_flushes_after_the_last_edit(self):
+        async def edit():
+            buffer = await documents.open_document(self.file.id, self.project.id, 'tab-1')
+            await buffer.commit(buffer.revision, [insert(0, '#')])
+            await asyncio.sleep(0.1)
+            return buffer
+        with mock.patch.object(documents, 'FLUSH_IDLE_SECONDS', 0.01):
+            buffer = async_to_sync(edit)()
+        self.assertEqual(buffer.pending_ops, 0)
+        self.assertEqual(self.saved_content(), '#x = 1\n')
+
+    def test_release_keeps_the_buffer_until_the_flush_succeeds(self):
+        async def edit_and_release():
+            buffer = await documents.open_document(self.file.id, self.project.id, 'tab-1')
+            await buffer.commit(buffer.revision, [insert(0, '#')])
+            with mock.patch.object(documents, 'write_file_content', side_effect=OSError('database is down')):
+                await documents.release_document(self.file.id, 'tab-1')
+            self.assertIs(documents.open_documents.get(self.file.id), buffer)
+            self.assertEqual(buffer.pending_ops, 1)
+            # The failed flush scheduled a retry
+            self.assertIsNotNone(buffer.flush_timer)
+            self.assertTrue(await buffer.flush())
+        async_to_sync(edit_and_release)()
+        self.assertNotIn(self.file.id, documents.open_documents)
+        self.assertEqual(self.saved_content(), '#x = 1\n')
+
+    def test_release_with_other_sessions_keeps_the_buffer(self):
+        async def release():
+            buffer = await documents.open_document(self.file.id, self.project.id, 'tab-1')
+            await documents.open_document(self.file.id, self.project.id, 'tab-2')
+            await documents.release_document(self.file.id, 'tab-1')
+            self.assertIs(documents.open_documents.get(self.file.id), buffer)
+            await documents.release_document(self.file.id, 'tab-2')
+        async_to_sync(release)()
+        self.assertNotIn(self.file.id, documents.open_documents)
+
+    def test_shutdown_flush_writes_pending_edits(self):
+        async def edit():
+            buffer = await documents.open_document(self.file.id, self.project.id, 'tab-1')
+            await buffer.commit(buffer.revision, [insert(0, '#')])
+            buffer.cancel_flush_timer()
+        async_to_sync(edit)()
+        self.assertEqual(documents.flush_open_documents(), 1)
+        self.assertEqual(self.saved_content(), '#x = 1\n')
+        self.assertEqual(documents.flush_open_documents(), 0)
+
+    def test_rest_save_goes_through_the_open_buffer(self):
+        layer = get_channel_layer()
+        buffer = async_to_sync(documents.open_document)(self.file.id, self.project.id, 'tab-1')
+        async_to_sync(buffer.commit)(buffer.revision, [insert(0, '#')])
+        buffer.cancel_flush_timer()
+        channel = async_to_sync(layer.new_channel)()
+        async_to_sync(layer.group_add)(f'project_{self.project.id}', channel)
+
+        client = APIClient()
+        client.force_authenticate(self.user)
+        url = reverse('file-detail', args=[self.file.id])
+        response = client.patch(url, {'content': 'y = 2'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(buffer.content, 'y = 2')
+        self.assertEqual(client.get(url).data['content'], 'y = 2')
+
+        # Open editors receive the save as ops from nobody in particular
+        event = async_to_sync(layer.receive)(channel)
+        self.assertEqual((event['type'], event['revision'], event['sender_channel']),
+                         ('broadcast_delta', buffer.revision, None))
+        self.assertEqual(apply_ops('#x = 1\n', event['ops']), 'y = 2')
+
+        # The buffer's next flush keeps the saved content
+        async_to_sync(buffer.commit)(buffer.revision, [insert(0, '#')])
+        buffer.cancel_flush_timer()
+        self.assertEqual(documents.flush_open_documents(), 1)
+        self.assertEqual(self.saved_content(), '#y = 2')
+
+
+@skipUnless(importlib.util.find_spec('fakeredis'), "fakeredis is not installed")
+@override_settings(**{**LOCAL_BACKENDS, 'DOCUMENT_REDIS_URL': 'redis://documents.test/0'})
+class SharedDocumentStoreTests(TestCase):
+    # Two buffers for one file stand in for two WebSocket workers
+    def setUp(self):
+        import fakeredis
+        from fakeredis import aioredis as fake_aioredis
+
+        cache.clear()
+        server = fakeredis.FakeServer()
+        for name, client in (
+            ('client', lambda store: fake_aioredis.FakeRedis(server=server, decode_responses=True)),
+            ('blocking_client', lambda store: fakeredis.FakeRedis(server=server, decode_responses=True)),
+        ):
+            patcher = mock.patch.object(documents.RedisDocumentStore, name, client)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.addCleanup(documents._stores.clear)
+
+        user = User.objects.create_user(username='pair@example.com', password='password')
+        self.project = Project.objects.create(name='Pair', owner=user)
+        folder = Folder.objects.create(name='root', project=self.project)
+        self.file = File.objects.create(name='main.py', project=self.project, folder=folder, content='x = 1\n')
+
+    def worker_buffer(self, content):
+        buffer = DocumentBuffer(self.file.id, self.project.id, content)
+        buffer.mark_dirty = mock.Mock()
+        return buffer
+
+    def test_workers_share_one_revision_sequence(self):
+        async def edit():
+            first = self.worker_buffer('x = 1\n')
+            await documents.get_document_store().load(first)
+            base = first.revision
+            await first.commit(base, [insert(0, '# a\n')])
+
+            # Opened later from a stale database row: adopts the shared copy
+            second = self.worker_buffer('stale\n')
+            await asyncio.sleep(0.002)
+            await documents.get_document_store().load(second)
+            self.assertEqual((second.revision, second.content), (base + 1, '# a\nx = 1\n'))
+
+            # Concurrent edits made against the same base revision converge
+            await first.commit(base + 1, [insert(10, 'y = 2\n')])
+            revision, ops = await second.commit(base + 1, [insert(0, '# b\n')])
+            self.assertEqual((revision, ops), (base + 3, [insert(0, '# b\n')]))
+            with self.assertRaises(StaleRevision):
+                await second.commit(base - 1, [insert(0, '!')])
+
+            self.assertEqual(await first.snapshot(), await second.snapshot())
+            self.assertTrue(await documents.get_document_store().flush(first))
+            return (await second.snapshot())[1]
+        content = async_to_sync(edit)()
+        self.assertEqual(content, '# b\n# a\nx = 1\ny = 2\n')
+        # The flush wrote the shared content, including the other worker's edit
+        self.file.refresh_from_db()
+        self.assertEqual(self.file.content, content)
+        self.assertEqual(documents.get_live_content(self.file.id), content)
+
+    def test_rest_save_reaches_a_document_open_in_another_worker(self):
+        async def save():
+            other = self.worker_buffer('x = 1\n')
+            await documents.get_document_store().load(other)
+            await other.commit(other.revision, [insert(0, '#')])
+            self.assertIsNone(await documents.replace_live_content(self.file.id + 1, self.project.id, 'z'))
+            revision = await documents.replace_live_content(self.file.id, self.project.id, 'y = 2\n')
+            self.assertEqual(await other.snapshot(), (revision, 'y = 2\n'))
+        async_to_sync(save)()
+        self.assertEqual(documents.get_live_content(self.file.id), 'y = 2\n')
+
+
+def insert(pos, text):
+    return {'type': 'insert', 'pos': pos, 'text': text}
+
+
+def delete(pos, length):
+    return {'type': 'delete', 'pos': pos, 'length': length}
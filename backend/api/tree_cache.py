@@ -0,0 +1,75 @@
+import time
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.renderers import JSONRenderer
+from .models import Project
+from .serializers import build_folder_tree
+
+TREE_CACHE_TIMEOUT = getattr(settings, 'FILE_TREE_CACHE_TIMEOUT', 3600)
+OUTLINE_MAX_CHARS = getattr(settings, 'PROJECT_OUTLINE_MAX_CHARS', 2000)
+OUTLINE_FILES_PER_FOLDER = 8
+
+def tree_version_key(project_id):
+    return f'file_tree_version:{int(project_id)}'
+
+def get_tree_version(project_id):
+    key = tree_version_key(project_id)
+    version = cache.get(key)
+    if version is None:
+        # Seeded from the clock so a version lost to eviction is never reused
+        cache.add(key, int(time.time() * 1000), timeout=None)
+        version = cache.get(key)
+    return version
+
+def bump_tree_version(project_id):
+    get_tree_version(project_id)
+    try:
+        return cache.incr(tree_version_key(project_id))
+    except ValueError:
+        return get_tree_version(project_id)
+
+def get_tree_etag(project_id, version):
+    return f'"tree-{int(project_id)}-{version}"'
+
+def get_rendered_tree(project_id, version):
+    key = f'file_tree:{int(project_id)}:{version}'
+    rendered = cache.get(key)
+    if rendered is None:
+        rendered = JSONRenderer().render(build_folder_tree(project_id))
+        cache.set(key, rendered, TREE_CACHE_TIMEOUT)
+    return rendered
+
+def build_project_outline(project_name, tree):
+    # Breadth-first so the top of the tree survives the size cap
+    lines = [f"Project Name: {project_name}", "Project Structure:"]
+    size = sum(len(line) + 1 for line in lines)
+    queue = [(folder, f"{folder['name']}/") for folder in tree]
+    index = 0
+    while index < len(queue):
+        folder, path = queue[index]
+        file_names = [f['name'] for f in folder['files']]
+        shown = ", ".join(file_names[:OUTLINE_FILES_PER_FOLDER])
+        if len(file_names) > OUTLINE_FILES_PER_FOLDER:
+            shown += f" (+{len(file_names) - OUTLINE_FILES_PER_FOLDER} more)"
+        line = f"{path}: {shown}" if shown else path
+
+        if size + len(line) + 1 > OUTLINE_MAX_CHARS:
+            lines.append("... (remaining folders omitted)")
+            break
+        lines.append(line)
+        size += len(line) + 1
+        queue.extend((subfolder, f"{path}{subfolder['name']}/") for subfolder in folder['subfolders'])
+        index += 1
+    return "\n".join(lines)
+
+def get_project_outline(project_id):
+    version = get_tree_version(project_id)
+    key = f'project_outline:{int(project_id)}:{version}'
+    outline = cache.get(key)
+    if outline is None:
+        project_name = Project.objects.filter(id=project_id).values_list('name', flat=True).first()
+        if project_name is None:
+            return None
+        outline = build_project_outline(project_name, build_folder_tree(project_id))
+        cache.set(key, outline, TREE_CACHE_TIMEOUT)
+    return outline
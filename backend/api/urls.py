@@ -7,18 +7,19 @@ from .views import ProjectDetailView
 from .views import FileDetailView
 from .views import FileCreateView, FolderCreateView
 from .views import FolderDetailView
-from .views import CodeExecutionView
+from .views import CodeExecutionView, CodeExecutionDetailView
 from .views import JoinProjectView
 from .views import MembershipDetailView
 from .views import ProjectTerminateView
 from .views import MembershipRequestListView, MembershipRequestActionView
 from .views import (
     DashboardStatsView,
+    MetricsView,
     DocumentationListCreateView, 
     DocumentationRetrieveUpdateDestroyView,
     ProjectPreviewView
 )
-from .views import AIIndexProjectView, AIChatView
+from .views import AIIndexProjectView, AIChatView, ChatHistoryView
 from .views import AlertListCreateView, AlertDetailView
 
 urlpatterns = [
@@ -26,6 +27,7 @@ urlpatterns = [
     path('token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
     path('register/', CreateUserView.as_view(), name='register'),
     path('dashboard-stats/', DashboardStatsView.as_view(), name='dashboard-stats'),
+    path('metrics/', MetricsView.as_view(), name='metrics'),
     path('projects/', ProjectListCreateView.as_view(), name='project-list-create'),
     path("projects/<int:project_id>/members/", MemberListView.as_view(), name="member-list"),
     path("projects/<int:project_id>/files/", FileTreeView.as_view(), name="file-tree"),
@@ -35,6 +37,7 @@ urlpatterns = [
     path("folders/create/", FolderCreateView.as_view(), name="folder-create"),
     path("folders/<int:pk>/", FolderDetailView.as_view(), name="folder-detail"),
     path("execute/", CodeExecutionView.as_view(), name="code-execute"),
+    path("execute/<str:run_id>/", CodeExecutionDetailView.as_view(), name="code-execute-detail"),
     path("projects/join/", JoinProjectView.as_view(), name="project-join"),
     path("memberships/<int:pk>/", MembershipDetailView.as_view(), name="membership-detail"),
     path("projects/<int:pk>/terminate/", ProjectTerminateView.as_view(), name="project-terminate"),
@@ -42,6 +45,7 @@ urlpatterns = [
     path("requests/<int:membership_id>/action/", MembershipRequestActionView.as_view(), name="membership-request-action"),
     path("projects/<int:project_id>/documentation/", DocumentationListCreateView.as_view(), name="project-documentation-list-create"),
     path("projects/<int:project_id>/documentation/<int:pk>/", DocumentationRetrieveUpdateDestroyView.as_view(), name="project-documentation-detail"),
+    path("projects/<int:project_id>/chat/", ChatHistoryView.as_view(), name="chat-history"),
     path("projects/<int:project_id>/ai/index/", AIIndexProjectView.as_view(), name="ai-index-project"),
     path("projects/<int:project_id>/ai/chat/", AIChatView.as_view(), name="ai-chat"),
     path("projects/<int:project_id>/alerts/", AlertListCreateView.as_view(), name="project-alerts"),
@@ -1,30 +1,38 @@
+import base64
+import json
 import mimetypes
-from django.http import HttpResponse
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils.http import parse_etags
+from django.utils.dateparse import parse_datetime
+from django.db.models import Q
 from rest_framework_simplejwt.authentication import JWTAuthentication
 from rest_framework.exceptions import AuthenticationFailed
 from django.views.decorators.clickjacking import xframe_options_exempt
 from django.utils.decorators import method_decorator
-from django.conf import settings
 from django.contrib.auth.models import User
-from rest_framework import generics, status
-from rest_framework.permissions import IsAuthenticated
+from rest_framework import generics, serializers, status
+from rest_framework.permissions import IsAuthenticated, IsAdminUser
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework_simplejwt.views import TokenObtainPairView
-from asgiref.sync import async_to_sync
+from asgiref.sync import async_to_sync, sync_to_async
 from channels.layers import get_channel_layer
-import requests
-import os
-import time
 
-from .models import Project, Membership, Folder, File, Documentation, Alert
+from .models import Project, Membership, Folder, File, Documentation, Alert, ChatMessage
 from .serializers import (
     UserSerializer, ProjectSerializer, MyTokenObtainPairSerializer,
     MemberSerializer, FolderSerializer, FileDetailSerializer,
-    FileCreateSerializer, FolderCreateSerializer, DocumentationSerializer, DocumentationListSerializer, AlertSerializer
+    FileCreateSerializer, FolderCreateSerializer, DocumentationSerializer, DocumentationListSerializer, AlertSerializer,
+    ChatMessageSerializer
 )
-from .permissions import IsProjectOwner, IsEditorOrOwner
-from .rag_service import index_project, chat_with_project 
+from .permissions import IsProjectOwner, IsEditorOrOwner, get_project_role, invalidate_project_role
+from .rag_service import chat_with_project, stream_chat_with_project, drop_project_index
+from .index_jobs import submit_index_job, get_index_job, cancel_index_job
+from .executions import LANGUAGE_IDS, BATCH_LIMIT, ConcurrencyLimitExceeded, submit_run, get_run
+from . import metrics, lexical
+from .documents import get_live_content, replace_live_content
+from .tree_cache import get_tree_version, bump_tree_version, get_tree_etag, get_rendered_tree
+from .framing import shared_event
 
 
 # Helper functions
@@ -37,20 +45,39 @@ def send_collaborator_update_signal(project_id, message, removed_user_id=None):
     if removed_user_id:
         payload['removed_user_id'] = removed_user_id
     
-    async_to_sync(channel_layer.group_send)(f'project_{project_id}', payload)
+    async_to_sync(channel_layer.group_send)(f'project_{project_id}', shared_event(payload))
 
-def send_file_tree_update_signal(project_id, message):
+def send_permission_update_signal(project_id, user_id):
+    invalidate_project_role(project_id, user_id)
     channel_layer = get_channel_layer()
     async_to_sync(channel_layer.group_send)(
         f'project_{project_id}',
-        {'type': 'file_tree_update', 'message': message}
+        {'type': 'permission_update', 'user_id': user_id}
+    )
+
+def tree_change(action, node):
+    is_file = isinstance(node, File)
+    return {
+        'action': action,
+        'node_type': 'file' if is_file else 'folder',
+        'id': node.id,
+        'parent': node.folder_id if is_file else node.parent_id,
+        'name': node.name,
+    }
+
+def send_file_tree_update_signal(project_id, message, change=None):
+    version = bump_tree_version(project_id)
+    channel_layer = get_channel_layer()
+    async_to_sync(channel_layer.group_send)(
+        f'project_{project_id}',
+        shared_event({'type': 'file_tree_update', 'message': message, 'version': version, 'change': change})
     )
 
 def send_doc_list_update_signal(project_id, message):
     channel_layer = get_channel_layer()
     async_to_sync(channel_layer.group_send)(
         f'project_{project_id}',
-        {'type': 'doc_list_update', 'message': message}
+        shared_event({'type': 'doc_list_update', 'message': message})
     )
 
 def send_doc_content_update_signal(project_id, document_id, updated_data):
@@ -58,14 +85,14 @@ def send_doc_content_update_signal(project_id, document_id, updated_data):
     channel_layer = get_channel_layer()
     async_to_sync(channel_layer.group_send)(
         f'project_{project_id}',
-        {
+        shared_event({
             'type': 'doc_content_update',
             'documentId': document_id,
             'updater_username': updated_data.get('last_updated_by_username', 'N/A'),
             'updated_at': updated_data.get('updated_at', None).isoformat() if updated_data.get('updated_at') else None,
             'title': updated_data.get('title'),
             'content': updated_data.get('content')
-        }
+        })
     )
 
 def send_alert_signal(project_id, message):
@@ -74,11 +101,11 @@ def send_alert_signal(project_id, message):
     channel_layer = get_channel_layer()
     async_to_sync(channel_layer.group_send)(
         f'project_{project_id}',
-        {
+        shared_event({
             'type': 'alert_update', 
             'message': message,
             'unresolved_count': unresolved_count 
-        }
+        })
     )
 
 # Authentication Views
@@ -120,6 +147,12 @@ class ProjectTerminateView(generics.DestroyAPIView):
     serializer_class = ProjectSerializer
     permission_classes = [IsAuthenticated, IsProjectOwner]
 
+    def perform_destroy(self, instance):
+        project_id = instance.id
+        instance.delete()
+        drop_project_index(project_id)
+        lexical.drop_project(project_id)
+
 
 # Membership Views
 class MemberListView(generics.ListAPIView):
@@ -175,6 +208,7 @@ class MembershipDetailView(generics.RetrieveUpdateDestroyAPIView):
         
         response = super().update(request, *args, **kwargs)
         if response.status_code == 200:
+            send_permission_update_signal(project.id, membership.user_id)
             send_collaborator_update_signal(project.id, 'A member role has been updated.')
         return response
 
@@ -193,6 +227,7 @@ class MembershipDetailView(generics.RetrieveUpdateDestroyAPIView):
 
         self.perform_destroy(membership)
 
+        send_permission_update_signal(project_id_for_signal, removed_user_id)
         send_collaborator_update_signal(
             project_id=project_id_for_signal,
             message='A member has left or been removed.',
@@ -229,6 +264,7 @@ class MembershipRequestActionView(APIView):
             membership.status = Membership.Status.APPROVED
             membership.save()
             
+            send_permission_update_signal(project.id, membership.user_id)
             send_collaborator_update_signal(project.id, f"{membership.user.username} has been approved.")
             
             project_data = ProjectSerializer(project).data
@@ -244,6 +280,7 @@ class MembershipRequestActionView(APIView):
         
         elif action == 'reject':
             membership.delete()
+            send_permission_update_signal(project.id, membership.user_id)
             send_collaborator_update_signal(project.id, f"A join request has been rejected.")
             return Response({'message': 'Membership rejected and deleted.'}, status=status.HTTP_204_NO_CONTENT)
         
@@ -255,9 +292,17 @@ class FileTreeView(APIView):
     
     def get(self, request, project_id):
         try:
-            top_level_folders = Folder.objects.filter(project_id=project_id, parent__isnull=True)
-            serializer = FolderSerializer(top_level_folders, many=True)
-            return Response(serializer.data)
+            version = get_tree_version(project_id)
+            etag = get_tree_etag(project_id, version)
+            client_etags = parse_etags(request.headers.get('If-None-Match', ''))
+            if etag in client_etags or '*' in client_etags:
+                response = HttpResponse(status=status.HTTP_304_NOT_MODIFIED)
+            else:
+                response = HttpResponse(get_rendered_tree(project_id, version), content_type='application/json')
+            response['ETag'] = etag
+            response['X-Tree-Version'] = str(version)
+            response['Cache-Control'] = 'private, no-cache'
+            return response
         except Exception as e:
             return Response({'error': str(e)}, status=500)
 
@@ -268,17 +313,40 @@ class FileCreateView(generics.CreateAPIView):
 
     def perform_create(self, serializer):
         new_file = serializer.save()
-        send_file_tree_update_signal(new_file.project.id, 'A file has been created.')
+        lexical.update_file(new_file.project_id, new_file.id, new_file.content, new_file.name)
+        send_file_tree_update_signal(new_file.project.id, 'A file has been created.', tree_change('added', new_file))
 
 class FileDetailView(generics.RetrieveUpdateDestroyAPIView):
     serializer_class = FileDetailSerializer
     permission_classes = [IsAuthenticated, IsEditorOrOwner]
     queryset = File.objects.all()
 
+    def get_object(self):
+        instance = super().get_object()
+        live_content = get_live_content(instance.id)
+        if live_content is not None:
+            instance.content = live_content
+        return instance
+
+    def perform_update(self, serializer):
+        previous_name, previous_folder_id = serializer.instance.name, serializer.instance.folder_id
+        instance = serializer.save()
+        if 'content' in serializer.validated_data:
+            async_to_sync(replace_live_content)(instance.id, instance.project_id, instance.content)
+        lexical.update_file(instance.project_id, instance.id, instance.content, instance.name)
+        if instance.folder_id != previous_folder_id:
+            send_file_tree_update_signal(instance.project_id, 'A file has been moved.', tree_change('moved', instance))
+        elif instance.name != previous_name:
+            send_file_tree_update_signal(instance.project_id, 'A file has been renamed.', tree_change('renamed', instance))
+
     def perform_destroy(self, instance):
         project_id = instance.project.id
+        change = tree_change('removed', instance)
+        file_id = instance.id
         instance.delete()
-        send_file_tree_update_signal(project_id, 'A file has been deleted.')
+        # After the delete, so no worker can rebuild an index that still has it
+        lexical.remove_file(project_id, file_id)
+        send_file_tree_update_signal(project_id, 'A file has been deleted.', change)
 
 class FolderCreateView(generics.CreateAPIView):
     queryset = Folder.objects.all()
@@ -287,7 +355,7 @@ class FolderCreateView(generics.CreateAPIView):
 
     def perform_create(self, serializer):
         new_folder = serializer.save()
-        send_file_tree_update_signal(new_folder.project.id, 'A folder has been created.')
+        send_file_tree_update_signal(new_folder.project.id, 'A folder has been created.', tree_change('added', new_folder))
 
 class FolderDetailView(generics.RetrieveDestroyAPIView):
     serializer_class = FolderSerializer
@@ -296,8 +364,10 @@ class FolderDetailView(generics.RetrieveDestroyAPIView):
 
     def perform_destroy(self, instance):
         project_id = instance.project.id
+        change = tree_change('removed', instance)
         instance.delete()
-        send_file_tree_update_signal(project_id, 'A folder has been deleted.')
+        lexical.drop_project(project_id)
+        send_file_tree_update_signal(project_id, 'A folder has been deleted.', change)
 
 
 # Code Execution View
@@ -307,48 +377,115 @@ class CodeExecutionView(APIView):
     def post(self, request, *args, **kwargs):
         language = request.data.get('language', 'python')
         code = request.data.get('code', '')
+        project_id = request.data.get('project_id')
+        # "inputs" runs the code once per stdin in a single Judge0 batch
+        inputs = request.data.get('inputs')
 
-        language_map = {
-            "python": 71,
-            "javascript": 63,
-            "cpp": 54,
-            "java": 62,
-        }
-        language_id = language_map.get(language)
-        if not language_id:
+        if language not in LANGUAGE_IDS:
             return Response({"error": "Unsupported language"}, status=status.HTTP_400_BAD_REQUEST)
+        if inputs is not None and (
+            not isinstance(inputs, list) or not 0 < len(inputs) <= BATCH_LIMIT
+            or not all(isinstance(stdin, str) for stdin in inputs)
+        ):
+            return Response({"error": f"inputs must be a list of 1 to {BATCH_LIMIT} strings"}, status=status.HTTP_400_BAD_REQUEST)
+        # Form posts send "false" as a string, which plain truthiness reads as true
+        try:
+            bypass_cache = serializers.BooleanField().to_internal_value(request.data.get('bypass_cache', False))
+        except serializers.ValidationError:
+            return Response({"error": "bypass_cache must be a boolean"}, status=status.HTTP_400_BAD_REQUEST)
 
-        url = "https://judge0-ce.p.rapidapi.com/submissions"
-        payload = {
-            "language_id": language_id,
-            "source_code": code,
-            "stdin": request.data.get('input', '')
-        }
-        headers = {
-            "content-type": "application/json",
-            "X-RapidAPI-Key": settings.JUDGE0_API_KEY,
-            "X-RapidAPI-Host": "judge0-ce.p.rapidapi.com"
-        }
+        # Results are pushed over the project socket, so only members may name a project
+        if project_id and get_project_role(project_id, request.user.id) is None:
+            return Response({"error": "Permission denied"}, status=status.HTTP_403_FORBIDDEN)
 
         try:
-            response = requests.post(url, json=payload, headers=headers)
-            response.raise_for_status()
-            submission_token = response.json().get('token')
-            if not submission_token:
-                return Response({"error": "Failed to get submission token"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+            run = submit_run(
+                request.user.id, project_id, language, code,
+                inputs if inputs is not None else request.data.get('input', ''),
+                use_cache=not bypass_cache
+            )
+        except ConcurrencyLimitExceeded as e:
+            return Response({"error": str(e)}, status=status.HTTP_429_TOO_MANY_REQUESTS)
+        return Response({'run': run}, status=status.HTTP_202_ACCEPTED)
+
+class CodeExecutionDetailView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, run_id, *args, **kwargs):
+        run = get_run(run_id)
+        if not run or run['user_id'] != request.user.id:
+            return Response({"error": "Run not found"}, status=status.HTTP_404_NOT_FOUND)
+        return Response({'run': run})
+
+# Chat history
+
+CHAT_PAGE_SIZE = 50
+CHAT_MAX_PAGE_SIZE = 200
+
+def encode_chat_cursor(message):
+    raw = f"{message.timestamp.isoformat()}|{message.id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def decode_chat_cursor(cursor):
+    try:
+        timestamp, message_id = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+        timestamp = parse_datetime(timestamp)
+        message_id = int(message_id)
+    except (ValueError, UnicodeError):
+        raise ValueError("Invalid cursor")
+    if timestamp is None:
+        raise ValueError("Invalid cursor")
+    return timestamp, message_id
+
+class ChatHistoryView(APIView):
+    # Keyset pages over (timestamp, id): every page is an index range scan
+    # of LIMIT+1 rows, so the newest page costs the same on a project with a
+    # hundred messages or a million. Without a cursor the newest page is
+    # returned; "before" pages back through older messages and "after"
+    # catches up on newer ones. Messages are always in chronological order.
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, project_id):
+        if get_project_role(project_id, request.user.id) is None:
+            return Response({'error': 'Permission denied'}, status=status.HTTP_403_FORBIDDEN)
+
+        before = request.query_params.get('before')
+        after = request.query_params.get('after')
+        if before and after:
+            return Response({'error': 'Use either before or after, not both'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            limit = min(max(int(request.query_params.get('limit', CHAT_PAGE_SIZE)), 1), CHAT_MAX_PAGE_SIZE)
+            cursor = decode_chat_cursor(before or after) if before or after else None
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        messages = ChatMessage.objects.filter(project_id=project_id).select_related('user').only(
+            'id', 'message', 'timestamp', 'user__username'
+        )
+        if after:
+            timestamp, message_id = cursor
+            messages = messages.filter(
+                Q(timestamp__gt=timestamp) | Q(timestamp=timestamp, id__gt=message_id)
+            ).order_by('timestamp', 'id')
+        else:
+            if cursor:
+                timestamp, message_id = cursor
+                messages = messages.filter(Q(timestamp__lt=timestamp) | Q(timestamp=timestamp, id__lt=message_id))
+            messages = messages.order_by('-timestamp', '-id')
+
+        page = list(messages[:limit + 1])
+        has_more = len(page) > limit
+        page = page[:limit]
+        if not after:
+            page.reverse()
+
+        return Response({
+            'messages': ChatMessageSerializer(page, many=True).data,
+            'has_more': has_more,
+            'before': encode_chat_cursor(page[0]) if page else before,
+            'after': encode_chat_cursor(page[-1]) if page else after,
+        })
 
-            result_url = f"{url}/{submission_token}"
-            while True:
-                result_response = requests.get(result_url, headers=headers)
-                result_response.raise_for_status()
-                result_data = result_response.json()
-                if result_data.get('status', {}).get('id', 0) > 2: 
-                    return Response(result_data)
-                time.sleep(0.2) 
-
-        except requests.exceptions.RequestException as e:
-            return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-        
 # dashbord view
 
 class DashboardStatsView(APIView):
@@ -376,6 +513,12 @@ class DashboardStatsView(APIView):
             'total_files': total_files 
         }
         return Response(data)
+
+class MetricsView(APIView):
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, *args, **kwargs):
+        return Response(metrics.snapshot())
     
 #documentation view
 
@@ -454,19 +597,43 @@ class DocumentationListCreateView(generics.ListCreateAPIView):
 class AIIndexProjectView(APIView):
     permission_classes = [IsAuthenticated]
 
-    def post(self, request, project_id):
+    def check_membership(self, request, project_id):
         try:
             project = Project.objects.get(id=project_id)
             if not Membership.objects.filter(project=project, user=request.user, status=Membership.Status.APPROVED).exists():
                 return Response({'error': 'Permission denied'}, status=status.HTTP_403_FORBIDDEN)
         except Project.DoesNotExist:
             return Response({'error': 'Project not found'}, status=status.HTTP_404_NOT_FOUND)
+        return None
 
-        success, message = index_project(project_id)
-        if success:
-            return Response({'message': message})
-        else:
-            return Response({'error': message}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+    def get(self, request, project_id):
+        error_response = self.check_membership(request, project_id)
+        if error_response:
+            return error_response
+
+        job = get_index_job(project_id)
+        if not job:
+            return Response({'error': 'No indexing job found.'}, status=status.HTTP_404_NOT_FOUND)
+        return Response({'job': job})
+
+    def post(self, request, project_id):
+        error_response = self.check_membership(request, project_id)
+        if error_response:
+            return error_response
+
+        job, created = submit_index_job(project_id)
+        message = 'Indexing started.' if created else 'Indexing is already in progress.'
+        return Response({'message': message, 'job': job}, status=status.HTTP_202_ACCEPTED)
+
+    def delete(self, request, project_id):
+        error_response = self.check_membership(request, project_id)
+        if error_response:
+            return error_response
+
+        job = cancel_index_job(project_id)
+        if not job:
+            return Response({'error': 'No indexing job found.'}, status=status.HTTP_404_NOT_FOUND)
+        return Response({'message': 'Cancellation requested.', 'job': job}, status=status.HTTP_202_ACCEPTED)
 
 class AIChatView(APIView):
     permission_classes = [IsAuthenticated]
@@ -479,12 +646,38 @@ class AIChatView(APIView):
         if not Membership.objects.filter(project_id=project_id, user=request.user, status=Membership.Status.APPROVED).exists():
              return Response({'error': 'Permission denied'}, status=status.HTTP_403_FORBIDDEN)
 
+        if request.data.get('stream'):
+            response = StreamingHttpResponse(self.event_stream(project_id, query), content_type='text/event-stream')
+            response['Cache-Control'] = 'no-cache'
+            response['X-Accel-Buffering'] = 'no'
+            return response
+
         try:
             answer = chat_with_project(project_id, query)
             return Response({'answer': answer})
         except Exception as e:
             print(f"AI Error: {str(e)}")
             return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    async def event_stream(self, project_id, query):
+        # An async iterator, so Daphne sends each chunk as it arrives; Django
+        # reads a sync iterator to the end before sending anything under ASGI.
+        # The chain itself is sync and is stepped one chunk at a time.
+        chunks = stream_chat_with_project(project_id, query)
+        next_chunk = sync_to_async(next)
+        try:
+            while True:
+                chunk = await next_chunk(chunks, None)
+                if chunk is None:
+                    break
+                yield f"data: {json.dumps({'type': 'chunk', 'text': chunk})}\n\n"
+            yield f"data: {json.dumps({'type': 'done'})}\n\n"
+        except Exception as e:
+            print(f"AI Error: {str(e)}")
+            yield f"data: {json.dumps({'type': 'error', 'error': str(e)})}\n\n"
+        finally:
+            # Records the latency metrics even when the client goes away early
+            await sync_to_async(chunks.close)()
         
 # Alert Views
 class AlertListCreateView(generics.ListCreateAPIView):
@@ -13,4 +13,11 @@ application = ProtocolTypeRouter({
             api.routing.websocket_urlpatterns
         )
     ),
-})
\ No newline at end of file
+})
+
+from django.conf import settings
+
+if settings.RAG_WARMUP_ON_STARTUP:
+    import threading
+    from api.rag_service import warm_up
+    threading.Thread(target=warm_up, name='rag-warmup', daemon=True).start()
@@ -133,6 +133,7 @@ SITE_ID = 1
 
 # CORS Settings
 CORS_ALLOWED_ORIGINS = os.environ.get('CORS_ALLOWED_ORIGINS', 'http://localhost:5173').split(',')
+CORS_EXPOSE_HEADERS = ['ETag', 'X-Tree-Version']
 CSRF_TRUSTED_ORIGINS = os.environ.get('CSRF_TRUSTED_ORIGINS', 'http://localhost:5173').split(',')
 
 # Django REST Framework Settings
@@ -233,12 +234,88 @@ CHANNEL_LAYERS = {
     },
 }
 
+# Live editing buffers are written back to File.content after this many
+# seconds without edits, or after this many edits, whichever comes first.
+CODE_BUFFER_FLUSH_IDLE_SECONDS = float(os.environ.get('CODE_BUFFER_FLUSH_IDLE_SECONDS', 2.0))
+CODE_BUFFER_FLUSH_OP_COUNT = int(os.environ.get('CODE_BUFFER_FLUSH_OP_COUNT', 100))
+CODE_BUFFER_TTL_SECONDS = int(os.environ.get('CODE_BUFFER_TTL_SECONDS', 24 * 3600))
+# Shared state of files open in the editor, so every WebSocket worker edits
+# the same copy; leave empty to keep it in process memory (one worker only)
+DOCUMENT_REDIS_URL = os.environ.get('DOCUMENT_REDIS_URL', f"redis://{REDIS_HOST}:{int(REDIS_PORT)}/3")
+
+# Chat lines are saved in batches of this size, or this many seconds after
+# the first unsaved line.
+CHAT_FLUSH_SIZE = int(os.environ.get('CHAT_FLUSH_SIZE', 50))
+CHAT_FLUSH_INTERVAL = float(os.environ.get('CHAT_FLUSH_INTERVAL', 1.0))
+
+# WebSocket framing: MessagePack frames at least this large are deflated
+WS_COMPRESS_MIN_BYTES = int(os.environ.get('WS_COMPRESS_MIN_BYTES', 2048))
+
+# Shared cache (project roles, etc.) so every worker sees the same entries
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.redis.RedisCache",
+        "LOCATION": f"redis://{REDIS_HOST}:{int(REDIS_PORT)}/1",
+    },
+}
+
+# Shared WebSocket presence; leave empty to keep presence in process memory
+PRESENCE_REDIS_URL = os.environ.get('PRESENCE_REDIS_URL', f"redis://{REDIS_HOST}:{int(REDIS_PORT)}/2")
+PRESENCE_HEARTBEAT_SECONDS = 30
+PRESENCE_TTL_SECONDS = 90
+PRESENCE_BROADCAST_INTERVAL_MS = 250
+
+PROJECT_ROLE_CACHE_TIMEOUT = int(os.environ.get('PROJECT_ROLE_CACHE_TIMEOUT', 300))
+FILE_TREE_CACHE_TIMEOUT = int(os.environ.get('FILE_TREE_CACHE_TIMEOUT', 3600))
+PROJECT_OUTLINE_MAX_CHARS = int(os.environ.get('PROJECT_OUTLINE_MAX_CHARS', 2000))
+
 ACCOUNT_ADAPTER = 'api.adapters.CustomAccountAdapter'
 
 SOCIALACCOUNT_ADAPTER = 'api.adapters.CustomSocialAccountAdapter'
 
+# "judge0" (remote API) or "local" (sandboxed subprocesses on this host)
+CODE_EXECUTOR = os.environ.get('CODE_EXECUTOR', 'judge0')
+LOCAL_EXECUTOR_CPU_SECONDS = int(os.environ.get('LOCAL_EXECUTOR_CPU_SECONDS', 5))
+LOCAL_EXECUTOR_MEMORY_MB = int(os.environ.get('LOCAL_EXECUTOR_MEMORY_MB', 256))
+LOCAL_EXECUTOR_WALL_SECONDS = float(os.environ.get('LOCAL_EXECUTOR_WALL_SECONDS', 10))
+LOCAL_EXECUTOR_MAX_PROCESSES = int(os.environ.get('LOCAL_EXECUTOR_MAX_PROCESSES', 64))
+# Unprivileged uid, other than the server's own, to run programs as; required
+# by the local executor, which then needs the server to start as root
+LOCAL_EXECUTOR_UID = int(os.environ['LOCAL_EXECUTOR_UID']) if os.environ.get('LOCAL_EXECUTOR_UID') else None
+
 JUDGE0_API_KEY = os.environ.get('JUDGE0_API_KEY')
+JUDGE0_URL = os.environ.get('JUDGE0_URL', 'https://judge0-ce.p.rapidapi.com')
+CODE_EXECUTION_WORKERS = int(os.environ.get('CODE_EXECUTION_WORKERS', 8))
+CODE_EXECUTION_DEADLINE = float(os.environ.get('CODE_EXECUTION_DEADLINE', 30))
+CODE_EXECUTION_POLL_INITIAL = 0.2
+CODE_EXECUTION_POLL_MAX = 2.0
+CODE_EXECUTION_RESULT_TTL = 600
+CODE_EXECUTION_PROJECT_CONCURRENCY = int(os.environ.get('CODE_EXECUTION_PROJECT_CONCURRENCY', 4))
+CODE_EXECUTION_CACHE_SIZE = int(os.environ.get('CODE_EXECUTION_CACHE_SIZE', 1024))
+CODE_EXECUTION_CACHE_TTL = int(os.environ.get('CODE_EXECUTION_CACHE_TTL', 3600))
 
 LOGIN_REDIRECT_URL = "http://localhost:5173/dashboard"
 
-GOOGLE_API_KEY = os.environ.get('GOOGLE_API_KEY')
\ No newline at end of file
+GOOGLE_API_KEY = os.environ.get('GOOGLE_API_KEY')
+
+# Load the embedding model when the ASGI app starts instead of on first use
+RAG_WARMUP_ON_STARTUP = os.environ.get('RAG_WARMUP_ON_STARTUP', 'False') == 'True'
+
+# Background RAG indexing
+RAG_INDEX_WORKERS = int(os.environ.get('RAG_INDEX_WORKERS', 2))
+RAG_INDEX_JOB_TIMEOUT = int(os.environ.get('RAG_INDEX_JOB_TIMEOUT', 3600))
+# Per-project indexing locks; a job's lock expires three heartbeats after its
+# worker stops renewing it. Leave the URL empty for in-process locks.
+INDEX_JOB_REDIS_URL = os.environ.get('INDEX_JOB_REDIS_URL', f"redis://{REDIS_HOST}:{int(REDIS_PORT)}/4")
+RAG_INDEX_HEARTBEAT_SECONDS = int(os.environ.get('RAG_INDEX_HEARTBEAT_SECONDS', 30))
+RAG_EMBED_BATCH_SIZE = int(os.environ.get('RAG_EMBED_BATCH_SIZE', 64))
+RAG_EMBED_WORKERS = int(os.environ.get('RAG_EMBED_WORKERS', 2))
+RAG_FILE_PAGE_SIZE = int(os.environ.get('RAG_FILE_PAGE_SIZE', 100))
+RAG_VECTORSTORE_HANDLES = int(os.environ.get('RAG_VECTORSTORE_HANDLES', 32))
+RAG_RETRIEVAL_CANDIDATES = int(os.environ.get('RAG_RETRIEVAL_CANDIDATES', 10))
+LEXICAL_INDEX_HANDLES = int(os.environ.get('LEXICAL_INDEX_HANDLES', 32))
+
+# AI answer cache
+AI_ANSWER_CACHE_SIZE = int(os.environ.get('AI_ANSWER_CACHE_SIZE', 512))
+AI_ANSWER_CACHE_TTL = int(os.environ.get('AI_ANSWER_CACHE_TTL', 3600))
+AI_ANSWER_CACHE_SIMILARITY = float(os.environ.get('AI_ANSWER_CACHE_SIMILARITY', 0.95))
\ No newline at end of file
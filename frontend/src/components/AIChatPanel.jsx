@@ -13,7 +13,13 @@ const AIChatPanel = ({ projectId }) => {
     const handleIndexProject = async () => {
         setIsIndexing(true);
         try {
-            await axiosInstance.post(`/api/projects/${projectId}/ai/index/`);
+            const response = await axiosInstance.post(`/api/projects/${projectId}/ai/index/`);
+            let job = response.data.job;
+            while (job.status === 'PENDING' || job.status === 'RUNNING') {
+                await new Promise(resolve => setTimeout(resolve, 2000));
+                job = (await axiosInstance.get(`/api/projects/${projectId}/ai/index/`)).data.job;
+            }
+            if (job.status !== 'COMPLETED') throw new Error(job.message);
             setMessages(prev => [...prev, { sender: 'ai', text: '✅ Project successfully indexed! I now understand your latest code.' }]);
         } catch (error) {
             console.error("Indexing failed:", error);
@@ -2,7 +2,7 @@ import React, { useState, useEffect, useRef } from 'react';
 import { FaPaperPlane } from 'react-icons/fa';
 import { VscCommentDiscussion } from 'react-icons/vsc';
 
-const ChatPanel = ({ messages, onSendMessage, currentUser }) => {
+const ChatPanel = ({ messages, onSendMessage, currentUser, onLoadOlder }) => {
   const [newMessage, setNewMessage] = useState('');
   const messagesEndRef = useRef(null);
 
@@ -10,9 +10,11 @@ const ChatPanel = ({ messages, onSendMessage, currentUser }) => {
     messagesEndRef.current?.scrollIntoView({ behavior: "smooth" });
   };
 
+  // Only new lines at the bottom scroll; loading older history keeps the view where it is
+  const lastMessage = messages[messages.length - 1];
   useEffect(() => {
     scrollToBottom();
-  }, [messages]);
+  }, [lastMessage]);
 
   const handleSubmit = (e) => {
     e.preventDefault();
@@ -33,12 +35,20 @@ const ChatPanel = ({ messages, onSendMessage, currentUser }) => {
       </div>
 
       <div className="flex-grow p-4 overflow-y-auto space-y-4 scrollbar-hide">
-        {messages.map((msg, index) => {
+        {onLoadOlder && (
+          <button
+            onClick={onLoadOlder}
+            className="w-full text-xs text-gray-400 hover:text-white py-1"
+          >
+            Load earlier messages
+          </button>
+        )}
+        {messages.map((msg) => {
           const isFromMe = msg.user_id === myUserId;
 
           return (
             <div
-              key={index}
+              key={msg.id ?? `${msg.user_id}-${msg.timestamp}`}
               className={`flex flex-col mb-4 ${
                 isFromMe ? 'items-end' : 'items-start'
               }`}
@@ -6,6 +6,7 @@ import axiosInstance from '../utils/axiosInstance';
 import { FaArrowLeft, FaSave } from 'react-icons/fa';
 import AuthContext from '../context/AuthContext';
 import { jwtDecode } from 'jwt-decode';
+import { SOCKET_ENCODING, createFrameReader } from '../utils/socketFrames';
 
 // Custom styles for Quill editor
 const quillStyle = `
@@ -101,15 +102,15 @@ const DocumentationEditorPage = () => {
             }
 
             console.log("Attempting WebSocket connection (Docs)...");
-            const wsUrl = `${wsBaseUrl}/ws/project/${projectId}/?token=${currentAuthTokens.access}`;
+            const wsUrl = `${wsBaseUrl}/ws/project/${projectId}/?token=${currentAuthTokens.access}&encoding=${SOCKET_ENCODING}`;
             socketRef.current = new WebSocket(wsUrl);
+            socketRef.current.binaryType = 'arraybuffer';
 
             socketRef.current.onopen = () => {
                 console.log("WebSocket connection established (Docs).");
             };
 
-            socketRef.current.onmessage = (event) => {
-                const data = JSON.parse(event.data);
+            socketRef.current.onmessage = createFrameReader((data) => {
                 console.log("DocEditor WS Message Received:", data);
 
                 if (data.type === 'doc_content_update' && data.documentId === parseInt(documentId)) {
@@ -129,7 +130,7 @@ const DocumentationEditorPage = () => {
                 } else if (data.type === 'doc_content_update') {
                     console.log(`DocEditor received remote save update for DIFFERENT document (ID: ${data.documentId})`);
                 }
-            };
+            });
 
             socketRef.current.onerror = (error) => {
                 console.error('WebSocket error (Docs):', error);
@@ -7,6 +7,9 @@ import FileExplorer from '../components/FileExplorer';
 import ChatPanel from '../components/ChatPanel';
 import AlertsPanel from '../components/AlertsPanel';
 import axiosInstance from '../utils/axiosInstance';
+import { applyPresenceDelta } from '../utils/presence';
+import { SOCKET_ENCODING, createFrameReader } from '../utils/socketFrames';
+import { DocumentSync } from '../utils/ot';
 import { VscClose, VscRefresh, VscLinkExternal, VscKebabVertical, VscTerminal } from 'react-icons/vsc';
 import AuthContext from '../context/AuthContext';
 import AIChatPanel from '../components/AIChatPanel';
@@ -206,6 +209,19 @@ const EditorActions = ({ onShowOutput, onShowPreview, isPreviewEnabled }) => {
     );
 };
 
+const formatExecutionResult = (run) => {
+    if (run.status === 'FAILED') {
+        return `Execution failed: ${run.error || 'unknown error'}`;
+    }
+    const { stdout, stderr, compile_output, message, status } = run.result || {};
+    let result = '';
+    if (stdout) result += stdout;
+    if (stderr) result += `Error:\n${stderr}`;
+    if (compile_output) result += `Compile Error:\n${compile_output}`;
+    if (message) result += `Message:\n${message}`;
+    return result || `Execution finished with status: ${status?.description || 'unknown'}`;
+};
+
 const EditorPage = () => {
     const { projectId } = useParams();
     const [project, setProject] = useState(null);
@@ -217,6 +233,7 @@ const EditorPage = () => {
     const [inputHistory, setInputHistory] = useState([]);
     const [isExecuting, setIsExecuting] = useState(false);
     const [messages, setMessages] = useState([]);
+    const [olderChatCursor, setOlderChatCursor] = useState(null);
     const [allMembers, setAllMembers] = useState([]);
     const [explorerRefreshKey, setExplorerRefreshKey] = useState(0);
     const [alertRefreshKey, setAlertRefreshKey] = useState(0);
@@ -226,6 +243,9 @@ const EditorPage = () => {
     const [hasUnreadChat, setHasUnreadChat] = useState(false);
     const socketRef = useRef(null);
     const saveTimeoutRef = useRef(null);
+    const pendingRunRef = useRef(null);
+    // fileId -> DocumentSync for files edited over the socket
+    const docSyncsRef = useRef({});
     const { authTokens, user } = useContext(AuthContext);
 
     const executableLanguages = ['python', 'javascript', 'cpp', 'java'];
@@ -240,27 +260,50 @@ const EditorPage = () => {
             .then(res => setAllMembers(res.data))
             .catch(err => console.error("Failed to fetch all members", err));
 
+        axiosInstance.get(`/api/projects/${projectId}/chat/`)
+            .then(res => {
+                const history = res.data.messages;
+                const newest = history[history.length - 1];
+                // Lines that arrived over the socket while this loaded may already be in the page
+                setMessages(prevMessages => [
+                    ...history,
+                    ...prevMessages.filter(msg => !newest || Date.parse(msg.timestamp) > Date.parse(newest.timestamp))
+                ]);
+                setOlderChatCursor(res.data.has_more ? res.data.before : null);
+            })
+            .catch(err => console.error("Failed to fetch chat history", err));
+
         if (authTokens) {
             const socket = new WebSocket(
-                `${wsBaseUrl}/ws/project/${projectId}/?token=${authTokens.access}`
+                `${wsBaseUrl}/ws/project/${projectId}/?token=${authTokens.access}&encoding=${SOCKET_ENCODING}`
             );
+            socket.binaryType = 'arraybuffer';
 
             socketRef.current = socket;
 
-            socket.onopen = () => console.log("WebSocket connection established");
-
-            socket.onmessage = (event) => {
-                const data = JSON.parse(event.data);
-                if (data.type === 'code_update') {
-                    setOpenFiles(prevOpenFiles => {
-                        const isFileOpen = prevOpenFiles.some(f => f.id === data.fileId);
-                        if (isFileOpen) {
-                            return prevOpenFiles.map(f =>
-                                f.id === data.fileId ? { ...f, content: data.message } : f
-                            );
-                        }
-                        return prevOpenFiles;
-                    });
+            socket.onopen = () => {
+                console.log("WebSocket connection established");
+                Object.keys(docSyncsRef.current).forEach(fileId => {
+                    socket.send(JSON.stringify({ 'type': 'code_open', 'fileId': Number(fileId) }));
+                });
+            };
+
+            socket.onmessage = createFrameReader((data) => {
+                const docSync = docSyncsRef.current[data.fileId];
+                if (data.type === 'code_snapshot') {
+                    if (docSync) {
+                        setFileContent(data.fileId, docSync.snapshot(data.revision, data.content), { synced: true });
+                    }
+                } else if (data.type === 'code_delta' || data.type === 'code_delta_ack') {
+                    if (!docSync) return;
+                    const content = data.type === 'code_delta'
+                        ? docSync.remote(data.revision, data.ops)
+                        : docSync.ack(data.revision);
+                    if (content != null) setFileContent(data.fileId, content);
+                    if (docSync.needsResync) resyncDocument(data.fileId);
+                } else if (data.type === 'code_resync') {
+                    // Too far behind to transform; start again from a fresh snapshot
+                    if (docSync) resyncDocument(data.fileId);
                 } else if (data.type === 'chat_message') {
                     setMessages(prevMessages => [...prevMessages, data]);
                     
@@ -282,14 +325,38 @@ const EditorPage = () => {
                 else if (data.type === 'presence_update') {
                     setActiveCollaboratorIds(data.active_user_ids || []);
                 }
-            };
+                else if (data.type === 'presence_delta') {
+                    setActiveCollaboratorIds(prevIds => applyPresenceDelta(prevIds, data));
+                }
+                else if (data.type === 'execution_result') {
+                    finishRun(data.run);
+                }
+            });
 
-            socket.onclose = () => console.log("WebSocket connection closed");
+            socket.onclose = () => {
+                console.log("WebSocket connection closed");
+                // Without the socket, edits fall back to saving over REST
+                docSyncsRef.current = {};
+                setOpenFiles(prevFiles => prevFiles.map(f => ({ ...f, synced: undefined })));
+            };
 
-            return () => socket.close();
+            return () => {
+                socket.close();
+                if (pendingRunRef.current) clearInterval(pendingRunRef.current.pollTimer);
+            };
         }
     }, [projectId, authTokens]);
 
+    const loadOlderMessages = () => {
+        if (!olderChatCursor) return;
+        axiosInstance.get(`/api/projects/${projectId}/chat/`, { params: { before: olderChatCursor } })
+            .then(res => {
+                setMessages(prevMessages => [...res.data.messages, ...prevMessages]);
+                setOlderChatCursor(res.data.has_more ? res.data.before : null);
+            })
+            .catch(err => console.error("Failed to fetch older chat messages", err));
+    };
+
     const handleTabChange = (tab) => {
         setActiveActivityBarTab(tab);
         if (tab === 'alerts') {
@@ -340,6 +407,34 @@ const EditorPage = () => {
         }
     };
 
+    const setFileContent = (fileId, content, extra = {}) => {
+        setOpenFiles(prevFiles =>
+            prevFiles.map(f => f.id === fileId ? { ...f, content, ...extra } : f)
+        );
+    };
+
+    const sendSocketMessage = (message) => {
+        if (socketRef.current?.readyState !== WebSocket.OPEN) return false;
+        socketRef.current.send(JSON.stringify(message));
+        return true;
+    };
+
+    const resyncDocument = (fileId) => {
+        const docSync = docSyncsRef.current[fileId];
+        docSync.resync();
+        setFileContent(fileId, docSync.content, { synced: false });
+        sendSocketMessage({ 'type': 'code_open', 'fileId': fileId });
+    };
+
+    const openDocumentSync = (fileId) => {
+        docSyncsRef.current[fileId] = new DocumentSync((revision, ops) => {
+            sendSocketMessage({ 'type': 'code_delta', 'fileId': fileId, 'revision': revision, 'ops': ops });
+        });
+        // The snapshot reply makes the file editable; if the socket is not
+        // open yet, onopen asks for it
+        return sendSocketMessage({ 'type': 'code_open', 'fileId': fileId }) || socketRef.current?.readyState === WebSocket.CONNECTING;
+    };
+
     const handleFileSelect = (fileId) => {
         const existingFile = openFiles.find(f => f.id === fileId);
         if (existingFile) {
@@ -352,6 +447,7 @@ const EditorPage = () => {
                     content: res.data.content,
                     language: getLanguageFromFile(res.data.name),
                 };
+                if (openDocumentSync(newFile.id)) newFile.synced = false;
                 setOpenFiles(prev => [...prev, newFile]);
                 setActiveFileId(newFile.id);
             }).catch(err => {
@@ -362,6 +458,10 @@ const EditorPage = () => {
 
     const handleCloseFile = (fileIdToClose) => {
         const fileToClose = openFiles.find(f => f.id === fileIdToClose);
+        if (docSyncsRef.current[fileIdToClose]) {
+            delete docSyncsRef.current[fileIdToClose];
+            sendSocketMessage({ 'type': 'code_close', 'fileId': fileIdToClose });
+        }
         setOpenFiles(prevFiles => prevFiles.filter(f => f.id !== fileIdToClose));
         if (activeFileId === fileIdToClose) {
             if (openFiles.length > 1) {
@@ -384,15 +484,15 @@ const EditorPage = () => {
                 prevFiles.map(f => f.id === activeFileId ? { ...f, content: value } : f)
             );
 
-            if (socketRef.current?.readyState === WebSocket.OPEN) {
-                socketRef.current.send(JSON.stringify({
-                    'type': 'code_update',
-                    'message': value,
-                    'fileId': activeFileId
-                }));
+            if (saveTimeoutRef.current) clearTimeout(saveTimeoutRef.current);
+
+            // Socket edits go out as ops; the server buffers and persists them.
+            const docSync = docSyncsRef.current[activeFileId];
+            if (docSync?.ready && socketRef.current?.readyState === WebSocket.OPEN) {
+                docSync.localChange(value);
+                return;
             }
 
-            if (saveTimeoutRef.current) clearTimeout(saveTimeoutRef.current);
             const valueToSave = value;
             const fileIdToSave = activeFileId;
             saveTimeoutRef.current = setTimeout(() => {
@@ -414,6 +514,14 @@ const EditorPage = () => {
         setCurrentTerminalInput('');
     };
 
+    const finishRun = (run) => {
+        if (!pendingRunRef.current || pendingRunRef.current.id !== run.id) return;
+        clearInterval(pendingRunRef.current.pollTimer);
+        pendingRunRef.current = null;
+        setTerminalLines([{ type: 'output', content: formatExecutionResult(run) }]);
+        setIsExecuting(false);
+    };
+
     const handleRunCode = async () => {
         const activeFile = openFiles.find(f => f.id === activeFileId);
         if (!activeFile) return;
@@ -422,28 +530,38 @@ const EditorPage = () => {
         setTerminalLines([{ type: 'output', content: 'Executing...' }]);
         
         const stdin = inputHistory.join('\n');
+        setInputHistory([]);
+        setCurrentTerminalInput('');
         try {
             const response = await axiosInstance.post('/api/execute/', {
                 language: activeFile.language,
                 code: activeFile.content,
-                input: stdin
+                input: stdin,
+                project_id: projectId
             });
-            
-            const { stdout, stderr, compile_output, message, status } = response.data;
-            let result = '';
-            if (stdout) result += stdout;
-            if (stderr) result += `Error:\n${stderr}`;
-            if (compile_output) result += `Compile Error:\n${compile_output}`;
-            if (message) result += `Message:\n${message}`;
-            
-            setTerminalLines([{ type: 'output', content: result || `Execution finished with status: ${status?.description || 'unknown'}` }]);
+
+            // The result normally arrives over the project socket; polling
+            // covers a socket that dropped while the program ran.
+            const { run } = response.data;
+            if (run.status === 'COMPLETED') {
+                setTerminalLines([{ type: 'output', content: formatExecutionResult(run) }]);
+                setIsExecuting(false);
+                return;
+            }
+            const pollTimer = setInterval(async () => {
+                try {
+                    const res = await axiosInstance.get(`/api/execute/${run.id}/`);
+                    if (['COMPLETED', 'FAILED'].includes(res.data.run.status)) {
+                        finishRun(res.data.run);
+                    }
+                } catch (error) {
+                    finishRun({ ...run, status: 'FAILED', error: 'Lost track of the running program.' });
+                }
+            }, 3000);
+            pendingRunRef.current = { id: run.id, pollTimer };
         } catch (error) {
             setTerminalLines([{ type: 'output', content: "An error occurred while executing the code." }]);
-        }
-        finally {
             setIsExecuting(false);
-            setInputHistory([]);
-            setCurrentTerminalInput('');
         }
     };
 
@@ -480,7 +598,12 @@ const EditorPage = () => {
                         <FileExplorer projectId={projectId} onFileSelect={handleFileSelect} refreshKey={explorerRefreshKey} canEdit={canEdit} />
                     )}
                     {activeActivityBarTab === 'chat' && (
-                        <ChatPanel messages={enrichedMessages} onSendMessage={handleSendMessage} currentUser={user} />
+                        <ChatPanel
+                            messages={enrichedMessages}
+                            onSendMessage={handleSendMessage}
+                            currentUser={user}
+                            onLoadOlder={olderChatCursor ? loadOlderMessages : null}
+                        />
                     )}
                     
                     {activeActivityBarTab === 'ai_chat' && (
@@ -535,7 +658,8 @@ const EditorPage = () => {
                                     value={activeFile.content ?? ''}
                                     onChange={handleEditorChange}
                                     options={{
-                                        readOnly: !canEdit,
+                                        // Read-only until the live snapshot arrives
+                                        readOnly: !canEdit || activeFile.synced === false,
                                         minimap: { enabled: false }
                                     }}
                                 />
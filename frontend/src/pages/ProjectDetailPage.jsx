@@ -2,6 +2,7 @@ import React, { useState, useEffect, useContext } from 'react';
 import { FaCode, FaSignOutAlt, FaUserClock, FaFileAlt, FaEdit, FaPlus, FaTrash } from 'react-icons/fa';
 import { useParams, Link, useNavigate } from 'react-router-dom';
 import axiosInstance from '../utils/axiosInstance';
+import { applyPresenceDelta } from '../utils/presence';
 import CollaboratorsTab from '../components/CollaboratorsTab';
 import SettingsTab from '../components/SettingsTab';
 import InviteModal from '../components/InviteModal';
@@ -114,6 +115,10 @@ const ProjectDetailPage = () => {
                 if (data.type === 'presence_update') {
                     setActiveMembers(data.active_user_ids);
                 }
+
+                if (data.type === 'presence_delta') {
+                    setActiveMembers(prevIds => applyPresenceDelta(prevIds, data));
+                }
                 
                 if (data.type === 'collaborator_update') {
                     console.log("Received 'collaborator_update' signal:", data);
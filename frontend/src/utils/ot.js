@@ -0,0 +1,213 @@
+// Client half of the operational transform in backend/api/ot.py. Ops are
+//   { type: 'insert', pos, text } and { type: 'delete', pos, length }
+// applied in order. Positions and lengths count Unicode code points, like
+// Python string indices, not UTF-16 units.
+
+const isHighSurrogate = (code) => code >= 0xd800 && code <= 0xdbff;
+const isLowSurrogate = (code) => code >= 0xdc00 && code <= 0xdfff;
+
+const codePointLength = (text, end = text.length) => {
+    let length = 0;
+    for (let i = 0; i < end; i++) {
+        if (!isLowSurrogate(text.charCodeAt(i)) || i === 0 || !isHighSurrogate(text.charCodeAt(i - 1))) length++;
+    }
+    return length;
+};
+
+// UTF-16 index of code point `pos`
+const unitIndex = (text, pos) => {
+    let index = 0;
+    for (let seen = 0; seen < pos; seen++) {
+        if (index >= text.length) throw new Error('Position is past the end of the document');
+        index += isHighSurrogate(text.charCodeAt(index)) && isLowSurrogate(text.charCodeAt(index + 1)) ? 2 : 1;
+    }
+    return index;
+};
+
+export const applyOps = (text, ops) => {
+    for (const op of ops) {
+        const start = unitIndex(text, op.pos);
+        if (op.type === 'insert') {
+            text = text.slice(0, start) + op.text + text.slice(start);
+        } else {
+            text = text.slice(0, start) + text.slice(start + (unitIndex(text.slice(start), op.length)));
+        }
+    }
+    return text;
+};
+
+const insertOp = (pos, text) => ({ type: 'insert', pos, text });
+const deleteOps = (pos, length) => (length > 0 ? [{ type: 'delete', pos, length }] : []);
+
+// Ops turning `oldText` into `newText`: one delete and one insert between the
+// common prefix and suffix, never splitting a surrogate pair.
+export const diffOps = (oldText, newText) => {
+    const limit = Math.min(oldText.length, newText.length);
+    let prefix = 0;
+    while (prefix < limit && oldText.charCodeAt(prefix) === newText.charCodeAt(prefix)) prefix++;
+    if (prefix > 0 && isHighSurrogate(oldText.charCodeAt(prefix - 1))) prefix--;
+
+    let suffix = 0;
+    while (
+        suffix < limit - prefix &&
+        oldText.charCodeAt(oldText.length - 1 - suffix) === newText.charCodeAt(newText.length - 1 - suffix)
+    ) suffix++;
+    if (suffix > 0 && isLowSurrogate(oldText.charCodeAt(oldText.length - suffix))) suffix--;
+
+    const pos = codePointLength(oldText, prefix);
+    const removed = oldText.slice(prefix, oldText.length - suffix);
+    const inserted = newText.slice(prefix, newText.length - suffix);
+    const ops = deleteOps(pos, codePointLength(removed));
+    if (inserted) ops.push(insertOp(pos, inserted));
+    return ops;
+};
+
+const transformOp = (op, other, opWinsTie) => {
+    if (op.type === 'insert') {
+        if (other.type === 'insert') {
+            if (op.pos < other.pos || (op.pos === other.pos && opWinsTie)) return [op];
+            return [insertOp(op.pos + codePointLength(other.text), op.text)];
+        }
+        const delStart = other.pos;
+        const delEnd = other.pos + other.length;
+        if (op.pos <= delStart) return [op];
+        if (op.pos >= delEnd) return [insertOp(op.pos - other.length, op.text)];
+        return [insertOp(delStart, op.text)];
+    }
+
+    const start = op.pos;
+    const end = op.pos + op.length;
+    if (other.type === 'insert') {
+        const insLength = codePointLength(other.text);
+        if (other.pos <= start) return deleteOps(start + insLength, op.length);
+        if (other.pos >= end) return [op];
+        const head = other.pos - start;
+        return [...deleteOps(start, head), ...deleteOps(start + insLength, op.length - head)];
+    }
+
+    const otherStart = other.pos;
+    const otherEnd = other.pos + other.length;
+    if (end <= otherStart) return [op];
+    if (start >= otherEnd) return deleteOps(start - other.length, op.length);
+    const overlap = Math.min(end, otherEnd) - Math.max(start, otherStart);
+    return deleteOps(Math.min(start, otherStart), op.length - overlap);
+};
+
+// Transform two concurrent op lists; returns [ops', against']
+export const transform = (ops, against, opsWinTies = false) => {
+    if (!ops.length || !against.length) return [ops, against];
+
+    if (ops.length === 1 && against.length === 1) {
+        return [transformOp(ops[0], against[0], opsWinTies), transformOp(against[0], ops[0], !opsWinTies)];
+    }
+
+    if (ops.length > 1) {
+        const [head, againstAfterHead] = transform(ops.slice(0, 1), against, opsWinTies);
+        const [tail, againstAfterTail] = transform(ops.slice(1), againstAfterHead, opsWinTies);
+        return [[...head, ...tail], againstAfterTail];
+    }
+
+    const [opsAfterHead, head] = transform(ops, against.slice(0, 1), opsWinTies);
+    const [opsAfterTail, tail] = transform(opsAfterHead, against.slice(1), opsWinTies);
+    return [opsAfterTail, [...head, ...tail]];
+};
+
+// Remote deltas and acks waiting on a missing revision; past this many the
+// gap is not going to fill and the file is reloaded from a snapshot
+const MAX_WAITING = 100;
+
+// Keeps one open file in step with the server: at most one delta is in flight
+// at a time, local edits made meanwhile are queued, and remote deltas are
+// transformed past both before being applied. Remote ops were applied on the
+// server first, so they win ties, matching DocumentLog.rebase. Deltas
+// committed through different server workers can arrive out of order, so
+// deltas and acks are applied strictly by revision.
+export class DocumentSync {
+    constructor(sendDelta) {
+        this.sendDelta = sendDelta;
+        this.revision = null;
+        this.content = null;
+        this.inflight = null;
+        this.queued = null;
+        // revision -> remote ops, or null for the ack of our own delta
+        this.waiting = new Map();
+    }
+
+    get ready() {
+        return this.revision !== null;
+    }
+
+    get needsResync() {
+        return this.ready && this.waiting.size > MAX_WAITING;
+    }
+
+    snapshot(revision, content) {
+        this.revision = revision;
+        this.content = content;
+        this.inflight = null;
+        this.queued = null;
+        for (const waitingRevision of this.waiting.keys()) {
+            if (waitingRevision <= revision) this.waiting.delete(waitingRevision);
+        }
+        this.drain();
+        return this.content;
+    }
+
+    // Events that arrive before the next snapshot are kept, since the
+    // snapshot may be older than they are
+    resync() {
+        this.revision = null;
+        this.inflight = null;
+        this.queued = null;
+    }
+
+    localChange(value) {
+        if (!this.ready) return;
+        const ops = diffOps(this.content, value);
+        this.content = value;
+        if (!ops.length) return;
+        if (this.inflight) {
+            this.queued = [...(this.queued || []), ...ops];
+        } else {
+            this.inflight = ops;
+            this.sendDelta(this.revision, ops);
+        }
+    }
+
+    // Both return the new content if the document changed, otherwise null
+    ack(revision) {
+        return this.receive(revision, null);
+    }
+
+    remote(revision, ops) {
+        return this.receive(revision, ops);
+    }
+
+    receive(revision, ops) {
+        if (this.ready && revision <= this.revision) return null;
+        if (this.waiting.size > MAX_WAITING) this.waiting.delete(Math.min(...this.waiting.keys()));
+        this.waiting.set(revision, ops);
+        return this.drain() ? this.content : null;
+    }
+
+    drain() {
+        let changed = false;
+        while (this.ready && this.waiting.has(this.revision + 1)) {
+            const ops = this.waiting.get(this.revision + 1);
+            this.waiting.delete(this.revision + 1);
+            this.revision += 1;
+            if (ops === null) {
+                this.inflight = this.queued;
+                this.queued = null;
+                if (this.inflight) this.sendDelta(this.revision, this.inflight);
+            } else {
+                let incoming = ops;
+                if (this.inflight) [incoming, this.inflight] = transform(incoming, this.inflight, true);
+                if (this.queued) [incoming, this.queued] = transform(incoming, this.queued, true);
+                this.content = applyOps(this.content, incoming);
+                changed = true;
+            }
+        }
+        return changed;
+    }
+}
@@ -0,0 +1,7 @@
+// Applies a presence_delta ({ joined, left }) to a list of active user ids.
+export const applyPresenceDelta = (activeIds, { joined = [], left = [] }) => {
+    const ids = new Set(activeIds);
+    joined.forEach(id => ids.add(id));
+    left.forEach(id => ids.delete(id));
+    return [...ids];
+};
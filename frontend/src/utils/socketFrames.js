@@ -0,0 +1,34 @@
+import { decode } from '@msgpack/msgpack';
+
+// Decoding for project socket frames. Sockets opened with ?encoding=msgpack
+// receive binary frames: one flag byte (0 plain, 1 zlib-deflated) followed by
+// a MessagePack body. Everything else is JSON text. JSON is the default; set
+// VITE_WS_ENCODING=msgpack to opt in to binary frames.
+
+export const SOCKET_ENCODING = import.meta.env.VITE_WS_ENCODING || 'json';
+
+const DEFLATED = 1;
+
+const inflate = async (bytes) => {
+    const stream = new Blob([bytes]).stream().pipeThrough(new DecompressionStream('deflate'));
+    return new Uint8Array(await new Response(stream).arrayBuffer());
+};
+
+export const decodeFrame = async (data) => {
+    if (typeof data === 'string') return JSON.parse(data);
+    const frame = new Uint8Array(data);
+    const body = frame.subarray(1);
+    return decode(frame[0] === DEFLATED ? await inflate(body) : body);
+};
+
+// Binary frames may need an async inflate; chaining keeps messages in the
+// order they arrived.
+export const createFrameReader = (onData) => {
+    let pending = Promise.resolve();
+    return (event) => {
+        pending = pending
+            .then(() => decodeFrame(event.data))
+            .then(onData)
+            .catch(err => console.error("Failed to handle socket frame", err));
+    };
+};